@@ -86,6 +86,33 @@ class Runner():
 
 __action_counter__ = 0
 """action counter for unique settings in created script for code generation"""
+
+__plan_listeners__ = []
+"""functions called if some action can be planned after a change outside of the action processing"""
+__plan_listeners_lock__ = threading.Lock()
+"""lock for plan listeners"""
+
+def add_plan_listener(listener):
+    """add function, that is called by notify_plan_listeners"""
+    with __plan_listeners_lock__:
+        __plan_listeners__.append(listener)
+
+def remove_plan_listener(listener):
+    """remove function added by add_plan_listener"""
+    with __plan_listeners_lock__:
+        if listener in __plan_listeners__:
+            __plan_listeners__.remove(listener)
+
+def notify_plan_listeners():
+    """
+    Signal that some action can be planned. Actions changed by their own
+    threads (e.g. calibration optimizer) call it, so the pipeline processor
+    plans them without polling.
+    """
+    with __plan_listeners_lock__:
+        listeners = list(__plan_listeners__)
+    for listener in listeners:
+        listener()
         
 class BaseActionType(metaclass=abc.ABCMeta):
     """
@@ -446,8 +473,22 @@ class BaseActionType(metaclass=abc.ABCMeta):
         action is set for externall processing.        
         """
         return None
-        
-    def _after_update(self, store_dir):    
+
+    def _get_evaluation(self):
+        """
+        Return tuple (function, args) computing the action output from
+        input values, or None if the action must be processed by _update.
+        Function must be module-level and args and result picklable
+        (DTT types), pipeline processor can call it in sepparate process.
+        The result is set by _set_evaluation_result instead of _update.
+        """
+        return None
+
+    def _set_evaluation_result(self, output):
+        """Set output computed by function returned by _get_evaluation"""
+        self._output = output
+
+    def _after_update(self, store_dir):
         """
         Set real output variable and set finished state.
         """
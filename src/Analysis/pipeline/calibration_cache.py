@@ -0,0 +1,75 @@
+"""
+Cache of model evaluations of Calibration.
+
+Evaluations are keyed by the parameter vector in scipy format quantized
+to given number of significant digits, so lookup is O(1) and nearly equal
+vectors (e.g. from line searches) share one evaluation. Cache stores
+observations, objective value is computed from them by calibration.
+
+Cache can be persisted in file, one evaluation per line in JSON format,
+appended after every evaluation. Restarted calibration with the same
+wrapped workflow and parameters reuses it and doesn't rerun the model.
+"""
+
+import os
+import json
+import logging
+
+logger = logging.getLogger("Analysis")
+
+
+def evaluation_key(x, digits=12):
+    """return key of parameter vector x quantized to digits significant digits"""
+    return " ".join("{0:.{1}e}".format(float(v), digits - 1) for v in x)
+
+
+class EvaluationCache():
+    """Evaluated observations: quantized parameter vector -> {observation name: value}"""
+
+    def __init__(self, file=None, digits=12):
+        """
+        :param str file: file for persistence, if None cache is only in memory
+        :param int digits: number of significant digits of key
+        """
+        self.file = file
+        """file for persistence"""
+        self.digits = digits
+        """number of significant digits of key"""
+        self._data = {}
+        """key -> observations"""
+        if file is not None:
+            self._load()
+
+    def key(self, x):
+        """return key of parameter vector"""
+        return evaluation_key(x, self.digits)
+
+    def get(self, x):
+        """return observations evaluated in x or None"""
+        return self._data.get(self.key(x))
+
+    def add(self, x, observations):
+        """add observations evaluated in x, and append it to file"""
+        self._data[self.key(x)] = observations
+        if self.file is not None:
+            try:
+                with open(self.file, "a") as fd:
+                    fd.write(json.dumps({"x": [float(v) for v in x], "observations": observations}) + "\n")
+            except OSError as err:
+                logger.warning("Calibration cache saving error: {0}".format(err))
+
+    def __len__(self):
+        return len(self._data)
+
+    def _load(self):
+        """load evaluations from file, incomplete lines are skipped"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.file)), exist_ok=True)
+        if not os.path.isfile(self.file):
+            return
+        with open(self.file) as fd:
+            for line in fd:
+                try:
+                    record = json.loads(line)
+                    self._data[self.key(record["x"])] = record["observations"]
+                except (ValueError, KeyError, TypeError):
+                    continue
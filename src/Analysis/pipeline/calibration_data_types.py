@@ -270,4 +270,7 @@ class CalibrationOutputType():
         return Struct(optimisation=Sequence(SingleIterationInfo.create_type(parameters, observations)),
                       result=Struct(n_iter=Int(),
                                     converge_reason=Enum(["none", "converged", "failure"]),
-                                    residual=Float()))
+                                    residual=Float(),
+                                    n_real_evaluation=Int(),
+                                    n_cached_evaluation=Int(),
+                                    n_surrogate_evaluation=Int()))
@@ -0,0 +1,99 @@
+"""
+Differential evolution for Calibration.
+
+Same algorithm as scipy.optimize.differential_evolution with strategy
+'best1bin' and deferred updating: trial vectors of the whole generation
+are made from the population of the previous generation, so the objective
+is evaluated for the whole generation at once and the model runs of one
+generation may be processed concurrently. Installed scipy versions
+(< 1.2) evaluate the population point by point.
+"""
+
+import numpy as np
+from scipy.optimize import OptimizeResult
+
+
+def min_diff_evolution(fun_batch, lb, ub, callback=None, maxiter=1000, popsize=15, tol=0.01,
+                       mutation=(0.5, 1.0), recombination=0.7, seed=None, atol=0.0, disp=False):
+    """
+    Minimize objective by differential evolution, generations are evaluated in batches.
+
+    :param fun_batch: function, list of points -> list of objective values,
+        points of one call may be evaluated concurrently
+    :param lb, ub: lower and upper bounds
+    :param callback: called with best point and convergence after each generation,
+        minimization is stopped if it returns True
+    :param int maxiter: maximal number of generations
+    :param int popsize: population size is popsize * number of parameters
+    :param float tol: relative tolerance of the standard deviation of population values
+    :param mutation: mutation constant, or (min, max) for random constant of each generation
+    :param float recombination: crossover probability
+    :param seed: seed of random numbers
+    :param float atol: absolute tolerance of the standard deviation of population values
+    :return: OptimizeResult
+    """
+    lb = np.asarray(lb, dtype=float)
+    ub = np.asarray(ub, dtype=float)
+    dim = lb.shape[0]
+    n_pop = max(5, popsize * dim)
+    random = np.random.RandomState(seed)
+
+    # Latin hypercube initialization in unit cube
+    segment = 1.0 / n_pop
+    samples = segment * random.random_sample((n_pop, dim)) + np.linspace(0.0, 1.0, n_pop, endpoint=False)[:, None]
+    population = np.zeros_like(samples)
+    for j in range(dim):
+        population[:, j] = samples[random.permutation(n_pop), j]
+
+    def to_x(u):
+        return lb + u * (ub - lb)
+
+    energies = np.array(fun_batch([to_x(u) for u in population]), dtype=float)
+    nfev = n_pop
+    i_best = int(np.argmin(energies))
+
+    success = False
+    message = "Maximum number of iterations has been exceeded."
+    nit = 0
+    for nit in range(1, maxiter + 1):
+        if np.isscalar(mutation):
+            scale = mutation
+        else:
+            # dithering
+            scale = mutation[0] + random.rand() * (mutation[1] - mutation[0])
+
+        # trials of the generation from the previous population, best1bin
+        trials = np.zeros_like(population)
+        for i in range(n_pop):
+            r1, r2 = random.choice([k for k in range(n_pop) if k != i], 2, replace=False)
+            mutant = population[i_best] + scale * (population[r1] - population[r2])
+            crossover = random.rand(dim) < recombination
+            crossover[random.randint(dim)] = True
+            trial = np.where(crossover, mutant, population[i])
+            # parameters out of bounds are replaced by random values
+            out = (trial < 0.0) | (trial > 1.0)
+            trial[out] = random.random_sample(np.count_nonzero(out))
+            trials[i] = trial
+
+        trial_energies = np.array(fun_batch([to_x(u) for u in trials]), dtype=float)
+        nfev += n_pop
+        better = trial_energies <= energies
+        population[better] = trials[better]
+        energies[better] = trial_energies[better]
+        i_best = int(np.argmin(energies))
+
+        spread = np.std(energies)
+        threshold = atol + tol * np.abs(np.mean(energies))
+        if disp:
+            print("differential_evolution step {0}: f(x)= {1}".format(nit, energies[i_best]))
+        if callback is not None and \
+                callback(to_x(population[i_best]), convergence=threshold / spread if spread > 0 else np.inf):
+            message = "callback function requested stop early by returning True"
+            break
+        if spread <= threshold:
+            success = True
+            message = "Optimization terminated successfully."
+            break
+
+    return OptimizeResult(x=to_x(population[i_best]), fun=energies[i_best], success=success, message=message,
+                          nit=nit, nfev=nfev)
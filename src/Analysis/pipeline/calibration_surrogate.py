@@ -0,0 +1,243 @@
+"""
+Surrogate assisted minimization for Calibration.
+
+Objective is evaluated (expensive model run) only in candidate points,
+candidates are found by minimization of a cheap surrogate model fitted
+to all real evaluations. Surrogate is a cubic radial basis function
+interpolant with linear polynomial tail, fitted in coordinates scaled
+by the initial step, so it is isotropic. Candidates are searched in
+trust region around the best point, region is expanded after successful
+and shrunk after unsuccessful iteration.
+"""
+
+import numpy as np
+from scipy.optimize import minimize, OptimizeResult
+
+
+class RBFSurrogate():
+    """
+    Cubic RBF interpolant with polynomial tail. Tail is quadratic if there
+    are enough points (twice the number of quadratic terms), so least squares
+    objectives of nearly linear models are approximated well, else linear.
+    """
+
+    def __init__(self, points, values):
+        """
+        :param array points: (N, n) points
+        :param array values: (N,) values in points
+        """
+        self.points = np.asarray(points, dtype=float)
+        n_points, dim = self.points.shape
+        n_quadratic = (dim + 1) * (dim + 2) // 2
+        self.quadratic = n_points >= 2 * n_quadratic
+        """tail is quadratic polynomial"""
+        dist = np.linalg.norm(self.points[:, None, :] - self.points[None, :, :], axis=2)
+        tail = self._tail(self.points)
+        n_tail = tail.shape[1]
+        a = np.zeros((n_points + n_tail, n_points + n_tail))
+        a[:n_points, :n_points] = dist ** 3
+        a[:n_points, n_points:] = tail
+        a[n_points:, :n_points] = tail.T
+        rhs = np.concatenate((np.asarray(values, dtype=float), np.zeros(n_tail)))
+        # least squares solution is robust for nearly coincident points
+        coef = np.linalg.lstsq(a, rhs, rcond=None)[0]
+        self.weights = coef[:n_points]
+        self.tail = coef[n_points:]
+        self.n_eval = 0
+        """number of evaluated points"""
+
+    def _tail(self, u):
+        """return matrix of tail polynomial terms in points u (M, n)"""
+        terms = [np.ones((u.shape[0], 1)), u]
+        if self.quadratic:
+            i, j = np.triu_indices(u.shape[1])
+            terms.append(u[:, i] * u[:, j])
+        return np.hstack(terms)
+
+    def __call__(self, u):
+        """return values in points u (M, n) or in one point u (n,)"""
+        u = np.asarray(u, dtype=float)
+        uu = u.reshape(-1, self.points.shape[1])
+        self.n_eval += uu.shape[0]
+        dist = np.linalg.norm(uu[:, None, :] - self.points[None, :, :], axis=2)
+        values = dist ** 3 @ self.weights + self._tail(uu) @ self.tail
+        return values if u.ndim > 1 else values[0]
+
+    def grad(self, u):
+        """return gradient in point u"""
+        u = np.asarray(u, dtype=float)
+        dim = u.shape[0]
+        diff = u - self.points
+        dist = np.linalg.norm(diff, axis=1)
+        grad = 3 * (self.weights * dist) @ diff + self.tail[1:dim + 1]
+        if self.quadratic:
+            i, j = np.triu_indices(dim)
+            c = self.tail[dim + 1:]
+            grad += np.bincount(i, weights=c * u[j], minlength=dim) + np.bincount(j, weights=c * u[i], minlength=dim)
+        return grad
+
+
+def _normalize(values):
+    """scale values to [0, 1]"""
+    v_min, v_max = np.min(values), np.max(values)
+    if v_max > v_min:
+        return (values - v_min) / (v_max - v_min)
+    return np.zeros_like(values)
+
+
+def min_surrogate(fun_batch, x0, lb, ub, callback=None, ter_crit=None, n_candidates=1, maxiter=100,
+                  init_step=None, n_samples=None, merit_weights=(0.5, 0.8, 0.95, 1.0), xtol=1e-4,
+                  ftol=1e-10, n_stall=12, delta_max=4.0, seed=0, disp=False):
+    """
+    Minimize objective by surrogate assisted trust region method.
+
+    :param fun_batch: function, list of points -> list of objective values,
+        points of one call may be evaluated concurrently
+    :param array x0: initial point
+    :param lb, ub: lower and upper bounds
+    :param callback: called with best point after each iteration
+    :param CalibrationTerminationCriteria ter_crit: termination criteria,
+        evaluated for every new point with gradient of surrogate
+    :param int n_candidates: maximal number of candidates evaluated in one iteration
+    :param int maxiter: maximal number of iterations
+    :param array init_step: initial design step and scale of coordinates,
+        default 0.1 * (ub - lb) limited by max(|x0|, 1)
+    :param int n_samples: number of random samples of surrogate in trust region
+    :param merit_weights: cycle of weights of surrogate value in merit of candidates,
+        rest of merit is distance to evaluated points, for weight 1 candidates
+        are minima of surrogate
+    :param float xtol: minimal size of trust region relative to init_step
+    :param float ftol: minimal relative decrease predicted by surrogate
+        for evaluation of its minimum, else trust region is shrunk
+    :param int n_stall: maximal number of exploitation iterations (minima of surrogate)
+        without improvement, minimization is then ended as not converged
+    :param float delta_max: maximal size of trust region relative to init_step
+    :return: OptimizeResult, with n_surrogate_eval number of surrogate evaluations
+    """
+    x0 = np.asarray(x0, dtype=float)
+    lb = np.asarray(lb, dtype=float)
+    ub = np.asarray(ub, dtype=float)
+    dim = x0.shape[0]
+    if init_step is None:
+        init_step = np.minimum(0.1 * (ub - lb), np.maximum(np.abs(x0), 1.0))
+    scale = np.where(init_step > 0, init_step, 1.0)
+    u_lb = (lb - x0) / scale
+    u_ub = (ub - x0) / scale
+    if n_samples is None:
+        n_samples = 100 * dim
+    terminator = ter_crit.get_terminator() if ter_crit is not None else None
+    random = np.random.RandomState(seed)
+
+    def to_x(u):
+        return x0 + u * scale
+
+    # initial design: x0 and steps in all directions
+    points = [np.zeros(dim)]
+    for i in range(dim):
+        for sign in [1.0, -1.0]:
+            u = np.zeros(dim)
+            u[i] = np.clip(sign, u_lb[i], u_ub[i])
+            if u[i] != 0.0:
+                points.append(u)
+    values = list(fun_batch([to_x(u) for u in points]))
+    i_best = int(np.argmin(values))
+
+    delta = 1.0
+    n_cycle = 0
+    n_no_improvement = 0
+    n_surrogate_eval = 0
+    nit = 0
+    success = False
+    message = "Maximum number of iterations reached"
+    while nit < maxiter:
+        if delta < xtol:
+            success = True
+            message = "Trust region is smaller than xtol"
+            break
+        surrogate = RBFSurrogate(points, values)
+        best = points[i_best]
+        box_lb = np.maximum(best - delta, u_lb)
+        box_ub = np.minimum(best + delta, u_ub)
+        weight = merit_weights[n_cycle % len(merit_weights)]
+        n_cycle += 1
+
+        # sample trust region
+        samples = box_lb + random.random_sample((n_samples, dim)) * (box_ub - box_lb)
+        samples = np.vstack((best, samples))
+        s_values = surrogate(samples)
+        if weight < 1.0:
+            # exploration, merit of samples mixes surrogate value and distance to evaluated points
+            dist = np.min(np.linalg.norm(samples[:, None, :] - np.array(points)[None, :, :], axis=2), axis=1)
+            merit = weight * _normalize(s_values) + (1.0 - weight) * (1.0 - _normalize(dist))
+            ranked = [(float(m), u) for m, u in zip(merit, samples)]
+        else:
+            # exploitation, polish the best samples on surrogate
+            starts = samples[np.argsort(s_values, kind='mergesort')[:max(n_candidates, 2)]]
+            ranked = []
+            for start in starts:
+                res = minimize(surrogate, start, jac=surrogate.grad, method="L-BFGS-B",
+                               bounds=list(zip(box_lb, box_ub)))
+                ranked.append((float(res.fun), res.x))
+        ranked.sort(key=lambda m: m[0])
+
+        # distinct candidates, not too close to evaluated points
+        min_dist = 1e-3 * delta
+        candidates = []
+        for rank, u in ranked:
+            if np.min(np.linalg.norm(np.array(points) - u, axis=1)) < min_dist:
+                continue
+            if any(np.linalg.norm(c - u) < min_dist for c in candidates):
+                continue
+            candidates.append(u)
+            if len(candidates) >= n_candidates:
+                break
+        n_surrogate_eval += surrogate.n_eval
+        f_best = values[i_best]
+        predicted = f_best - min(surrogate(u) for u in candidates) if len(candidates) > 0 else 0.0
+        if weight == 1.0 and predicted < ftol * (abs(f_best) + ftol):
+            candidates = []
+        if len(candidates) == 0:
+            # surrogate minimum is already evaluated
+            if weight == 1.0:
+                delta *= 0.5
+            continue
+
+        nit += 1
+        c_values = fun_batch([to_x(u) for u in candidates])
+        for u, value in zip(candidates, c_values):
+            points.append(u)
+            values.append(value)
+        i_best = int(np.argmin(values))
+        if values[i_best] < f_best:
+            n_no_improvement = 0
+        elif weight == 1.0:
+            n_no_improvement += 1
+        if weight < 1.0:
+            if values[i_best] < f_best:
+                delta = min(2.0 * delta, delta_max)
+        else:
+            # ratio of real and predicted decrease
+            rho = (f_best - values[i_best]) / predicted if predicted > 0 else 0.0
+            if rho > 0.75:
+                delta = min(2.0 * delta, delta_max)
+            elif rho < 0.25:
+                delta *= 0.5
+        if disp:
+            print("surrogate iteration {0}: f(x)= {1} delta= {2}".format(nit, values[i_best], delta))
+        if callback is not None:
+            callback(to_x(points[i_best]))
+
+        if n_no_improvement >= n_stall:
+            success = False
+            message = "No improvement in {0} iterations".format(n_stall)
+            break
+        if terminator is not None:
+            i_new = len(values) - len(candidates) + int(np.argmin(c_values))
+            g = surrogate.grad(points[i_new]) / scale
+            if terminator(to_x(points[i_new]), values[i_new], g):
+                success = True
+                message = "Termination criteria satisfied"
+                break
+
+    return OptimizeResult(x=to_x(points[i_best]), fun=values[i_best], success=success, message=message,
+                          nit=nit, nfev=len(values), n_surrogate_eval=n_surrogate_eval)
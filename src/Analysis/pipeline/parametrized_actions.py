@@ -321,9 +321,21 @@ class FunctionAction(ParametrizedActionType):
         environment and return Runner class with  process description if
         action is set for externall processing.
         """
-        self._output = self.__func_result()
+        function, args = self._get_evaluation()
+        self._output = function(*args)
         return None
 
+    def _get_evaluation(self):
+        """
+        Return function evaluating expressions and its picklable arguments,
+        expressions can be evaluated in sepparate process
+        """
+        input = self.get_input_val(0)
+        params = {}
+        for par in self.__get_require_params():
+            params[par] = getattr(input, par).value
+        return evaluate_expressions, (params, self.__parse_expressions())
+
     def _check_params(self):
         """check if all require params is set"""
         err = super()._check_params()
@@ -400,14 +412,17 @@ class FunctionAction(ParametrizedActionType):
             setattr(output, v, Float())
         return output
 
-    def __func_result(self):
-        """Add to DTT output real values from function evaluation"""
-        input = self.get_input_val(0)
-        loc = {}
-        for par in self.__get_require_params():
-            loc[par] = getattr(input, par).value
-        output = Struct()
-        for v, e in self.__parse_expressions():
-            res = eval(e, globals(), loc)
-            setattr(output, v, Float(float(res)))
-        return output
+
+def evaluate_expressions(params, expressions):
+    """
+    Evaluate function action expressions.
+
+    :param dict params: values of input parameters
+    :param list expressions: list of (output variable, expression)
+    :return: Struct of Float output variables
+    """
+    output = Struct()
+    for v, e in expressions:
+        res = eval(e, globals(), dict(params))
+        setattr(output, v, Float(float(res)))
+    return output
@@ -1,15 +1,70 @@
 """Pipeline help function for internall using in tak JobPanel only"""
+import sys
 import threading
-import time
-import subprocess
+import itertools
+import queue
+import concurrent.futures
+import multiprocessing
 import logging
 import os
 import shutil
-from .action_types import ActionRunningState, QueueType
+from .action_types import ActionRunningState, add_plan_listener, remove_plan_listener
 from .identical_list import  IdenticalList
 
 logger = logging.getLogger("Analysis")
 
+
+class ThreadExecutor():
+    """
+    Executor evaluating internal actions directly in the worker thread
+    (default, actions are processed by their _update function).
+    """
+    def evaluate(self, action):
+        """
+        Process action, return None or Runner for external processing
+        """
+        return action._update()
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class ProcessExecutor(ThreadExecutor):
+    """
+    Executor dispatching pure internal actions (that return evaluation
+    function by _get_evaluation) to process pool, so CPU-heavy actions
+    are not serialized on GIL. Other actions are processed in the worker
+    thread.
+
+    Processes are spawned (Python >= 3.7), forked process would inherit
+    locks held by other threads. Forked processes (older Python) are
+    started by the constructor, so the executor has to be created before
+    any thread of the processor is started.
+    """
+    def __init__(self, pool_size):
+        """
+        :param int pool_size: number of processes in pool
+        """
+        kwargs = {}
+        if sys.version_info >= (3, 7):
+            kwargs["mp_context"] = multiprocessing.get_context("spawn")
+        self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=pool_size, **kwargs)
+        """pool of processes"""
+        # start all processes now
+        self._pool.submit(int).result()
+
+    def evaluate(self, action):
+        evaluation = action._get_evaluation()
+        if evaluation is None:
+            return action._update()
+        function, args = evaluation
+        action._set_evaluation_result(self._pool.submit(function, *args).result())
+        return None
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+
 class Pipelineprocessor():
     """
     Class for pipeline processing.
@@ -43,12 +98,28 @@ class Pipelineprocessor():
     protected by action_lock. Any access to pipeline can't
     be made directly from communication thread.
     For logging is used standart python logging, that is thread-save
+
+    Scheduling is event driven, nothing is polled. Sepparate thread
+    plans actions whose inputs are finished and puts them to the work
+    queue (ordered by action priority), workers block on the queue.
+    Every end of action processing, finished external job, stop or
+    pause is signalled by the _events condition (on action_lock) and
+    the sepparate thread plans again only after such signal. Actions
+    changed by their own threads must signal every change by
+    notify_plan_listeners, the processor waits for events without timeout.
     """
 
     __workers__ = 4
     """Number of threads for processing internal jobs"""
 
-    def __init__(self, pipeline, log_path=None, log_level=logging.WARNING, save_path="./backup", identical_list=None):
+    __process_pool_size__ = 0
+    """
+    Default number of processes for pure internal actions, 0 means that
+    all internal actions are processed in workers threads
+    """
+
+    def __init__(self, pipeline, log_path=None, log_level=logging.WARNING, save_path="./backup", identical_list=None,
+                 process_pool_size=None):
         self._pipeline = pipeline
         """pipeline"""       
         self._is_validate = False
@@ -69,6 +140,8 @@ class Pipelineprocessor():
             establishing connection. File identical_list is needed only for action
             processing, and for action planning should be None. Equal list is
             created in client site by :class:`client_pipeline.identical_list_creator.ELCreator`.
+        :param int process_pool_size: Number of processes for pure internal
+            actions, if None __process_pool_size__ is used
         """
         self._errs = []
         """validation errors"""
@@ -82,7 +155,25 @@ class Pipelineprocessor():
         self._thread = None
         """Sepparated thread"""
         self._action_lock = threading.Lock()
-        """lock for _stop, _pause"""
+        """lock for _stop, _pause, runners arrays and events counting"""
+        self._events = threading.Condition(self._action_lock)
+        """condition signalled by every event, that can make next action ready"""
+        self._n_events = 0
+        """number of signalled events"""
+        self._work_queue = queue.PriorityQueue()
+        """queue of internal actions for workers: (-priority, order, after_run, action)"""
+        self._work_order = itertools.count()
+        """order of actions with the same priority in the work queue"""
+        self._n_queued = 0
+        """number of actions in the work queue or processed by a worker"""
+        self._worker_errs = []
+        """errors of action processing in workers"""
+        self._complex_runners = []
+        """Runners of independent actions that wait for external processing"""
+        self._processed_runners = []
+        """Runners of independent actions that are processing"""
+        self._finished_runners = []
+        """Runners of independent actions was processed"""
         self._stop = False
         """signal to sepparate thread for stopping"""
         self._pause = False
@@ -91,121 +182,62 @@ class Pipelineprocessor():
         """errors during run"""
         self._save_path = save_path
         """path for result saving (read-only)"""
+        if process_pool_size is None:
+            process_pool_size = self.__process_pool_size__
+        self._process_pool_size = process_pool_size
+        """number of processes for pure internal actions (read-only)"""
+        self._executor = None
+        """executor of internal actions, created by run"""
         if log_path is not None:
             self.__set_loger(log_path,  log_level)
         self._save_path = save_path
-        self.WorkerThread._save_path = save_path
         self._establish_processing(identical_list)
         
     class WorkerThread():
-        _complex_runners=[]
-        """Runners of independent actions that wait for external processing"""
-        _processed_runners=[]
-        """Runners of independent actions that are processing"""
-        _finished_runners=[]
-        """Runners of independent actions was processed"""
-        _runners_lock = threading.Lock()
-        """lock for runners"""
-        _save_path = None
-        """path for result saving (read-only)"""
-        def __init__(self):
-            self._action = None
-            """processed action"""
-            self._stop = False
-            """stop thread"""            
-            self._action_lock = threading.Lock()
-            """lock for action settings"""
-            self._after_run = False
-            """is processed after run externall action"""
-            self._error = None
-            """Processing error"""
-            t = threading.Thread(target=self.run)
-            t.daemon = True
-            t.start()
-            
-        def add_action(self, action, after_run=False):
-            """Add action if is empty, and return if is action added"""
-            ret=False
-            self._action_lock.acquire()
-            if self._action is None:
-                self._after_run=after_run
-                self._action = action
-                ret = True
-            self._action_lock.release()            
-            return ret            
-        
-        def is_empty(self):
-            """Add action if is empty, and return if is action added"""
-            ret=False
-            self._action_lock.acquire()
-            if self._action is None:
-                ret = True
-            self._action_lock.release()
-            return ret
+        """
+        Thread processing internal actions. Worker blocks on the work queue
+        of the processor and signals the end of every action processing.
+        """
+        def __init__(self, processor):
+            self._processor = processor
+            """pipeline processor, owner of the work queue"""
+            self._thread = threading.Thread(target=self.run)
+            self._thread.daemon = True
+            self._thread.start()
 
         def run(self):
             """worker thread"""
+            processor = self._processor
             while True:
-                is_action = False
-                while not is_action:                
-                    self._action_lock.acquire()
-                    if self._stop:
-                        self._action_lock.release()
-                        return
-                    if self._action is not None:
-                        is_action = True
-                    self._action_lock.release()
-                    if not  is_action:
-                        time.sleep(0.1)
-                if self._after_run:
-                    self._action._after_update(self._save_path)
-                    logger.info("External action {0} processing is ended".format(
-                        self._action. _get_instance_name()))
-                else:
-                    runner = self._action._update()
-                    if runner is not None:
-                        if self._action is QueueType.internal:
-                            logger.info("Internal action {0} processing is began".format(
-                                self._action. _get_instance_name()))
-                            process = subprocess.Popen(runner.command, stderr=subprocess.PIPE, cwd=runner.work_dir)
-                            return_code = process.poll()
-                            if return_code is not None:
-                                out = process.stderr.read().decode(errors="replace")
-                                err = "Can not start action {0}(return code:{1} ,stderr:{2}".format(
-                                    self._action. _get_instance_name(), str(return_code), out)
-                                logger.error(err)
-                                self._action_lock.acquire()
-                                self._error = err
-                                self._action_lock.release()
-                            else:
-                                self._action._after_update(self._save_path)
-                                logger.info("Internal action {0} processing is ended".format(
-                                    self._action. _get_instance_name()))
-                        else:
-                            logger.info("External action {0} processing is began".format(
-                                self._action. _get_instance_name()))
-                            self._runners_lock.acquire()
-                            self._complex_runners.append(runner)
-                            self._runners_lock.release()
+                priority, order, after_run, action = processor._work_queue.get()
+                if action is None:
+                    # stop signal
+                    return
+                error = None
+                try:
+                    if after_run:
+                        action._after_update(processor._save_path)
+                        logger.info("External action {0} processing is ended".format(
+                            action._get_instance_name()))
                     else:
-                        self._action._after_update(self._save_path)
-                        logger.info("Short action {0} processing is finished".format(
-                            self._action. _get_instance_name()))
-                self._action_lock.acquire()
-                self._action = None
-                self._action_lock.release()
-
-        def stop(self):
-            self._action_lock.acquire()
-            self._stop = True
-            self._action_lock.release()
-            
-        def get_error(self):
-            self._action_lock.acquire()
-            err = self._error
-            self._action_lock.release()
-            return err
-        
+                        runner = processor._executor.evaluate(action)
+                        if runner is not None:
+                            logger.info("External action {0} processing is began".format(
+                                action._get_instance_name()))
+                            processor._add_runner(runner)
+                        else:
+                            action._after_update(processor._save_path)
+                            logger.info("Short action {0} processing is finished".format(
+                                action._get_instance_name()))
+                except Exception as err:
+                    error = "Action {0} processing fails ({1})".format(
+                        action._get_instance_name(), str(err))
+                    logger.error(error)
+                processor._set_action_done(error)
+
+        def join(self):
+            self._thread.join()
+
     def get_script(self):
         """return pipeline python script"""
         if not self._is_validate:
@@ -249,27 +281,34 @@ class Pipelineprocessor():
             logger.error("Analysis validation return errors:\n    {0}".format(
                 '\n    '.join(self._errs)))
             raise Exception("Validation fails, call Validate function for more information.")
+        # executor is created before the threads of processing
+        if self._process_pool_size > 0:
+            self._executor = ProcessExecutor(self._process_pool_size)
+        else:
+            self._executor = ThreadExecutor()
+        self._action_lock.acquire()
+        self._is_run = True
+        self._stop = False
+        self._action_lock.release()
         t = threading.Thread(target=self._pipeline_procesing)
         t.daemon = True
         t.start()
-        self._is_run = True
-        self._stop = False
-        
+
     def stop(self):
         """Terminate pipeline thread and stop procesing"""
         if not self.is_run():
             return
-        self._action_lock.acquire()
-        self._stop = True
-        self._action_lock.release()
+        with self._events:
+            self._stop = True
+            self._signal_event()
 
     def pause(self, pause):
         """Pause or rerun sepparate thread"""
         if not self.is_run():
             return
-        self._action_lock.acquire()
-        self._pause = pause
-        self._action_lock.release()
+        with self._events:
+            self._pause = pause
+            self._signal_event()
 
     def get_statistics(self):
         """Get pipeline statistics. First statistics are ready after 
@@ -281,28 +320,54 @@ class Pipelineprocessor():
         if not self.is_run():
             return None
         ret = None
-        self.WorkerThread._runners_lock.acquire()
-        if len(self.WorkerThread._complex_runners)>0:
-            ret = self.WorkerThread._complex_runners.pop()
-            self.WorkerThread._processed_runners.append(ret)
-        self.WorkerThread._runners_lock.release()        
-        if ret is None:
-            return None        
+        with self._events:
+            if len(self._complex_runners)>0:
+                ret = self._complex_runners.pop()
+                self._processed_runners.append(ret)
         return ret
         
     def set_job_finished(self, job_id):
         """set job as finished"""
         if not self.is_run():
             return None
-        self.WorkerThread._runners_lock.acquire()
-        ret = None
-        for runner in self.WorkerThread._processed_runners:
-            if job_id == runner.id:
-                ret = runner                
-                break
-        self.WorkerThread._processed_runners.remove(ret)
-        self.WorkerThread._finished_runners.append(ret)                
-        self.WorkerThread._runners_lock.release()
+        with self._events:
+            ret = None
+            for runner in self._processed_runners:
+                if job_id == runner.id:
+                    ret = runner
+                    break
+            self._processed_runners.remove(ret)
+            self._finished_runners.append(ret)
+            self._signal_event()
+
+    def _signal_event(self):
+        """signal event to sepparate thread, call with acquired action_lock"""
+        self._n_events += 1
+        self._events.notify_all()
+
+    def _notify_plan(self):
+        """plan listener, some action can be planned"""
+        with self._events:
+            self._signal_event()
+
+    def _add_runner(self, runner):
+        """add runner of external action (called from worker)"""
+        with self._events:
+            self._complex_runners.append(runner)
+
+    def _set_action_done(self, error=None):
+        """signal end of action processing (called from worker)"""
+        with self._events:
+            self._n_queued -= 1
+            if error is not None:
+                self._worker_errs.append(error)
+            self._signal_event()
+
+    def _queue_action(self, action, after_run=False):
+        """put action to the work queue, higher priority is processed first"""
+        with self._events:
+            self._n_queued += 1
+        self._work_queue.put((-action._get_priority(), next(self._work_order), after_run, action))
         
     def _establish_processing(self, identical_list):
         """
@@ -398,96 +463,73 @@ class Pipelineprocessor():
 
     def _pipeline_procesing(self):
         """function started in sepparate thread"""
-        workers=[]
+        # every process in pool needs its worker thread waiting for result
+        n_workers = max(self.__workers__, self._process_pool_size)
+        workers = [self.WorkerThread(self) for i in range(0, n_workers)]
         """ threads for processing internal jobs"""
-        wait_actions = []
-        """action that can be processed"""
-        
-        for i in range(0, self.__workers__):
-            workers.append(self.WorkerThread())
-        while True:           
-            self._action_lock.acquire()
-            if self._stop or self._pause:
-                while True:
-                    if self._stop:
-                        # stop  after signall
-                        for worker in workers:
-                            if worker.is_empty():
-                                worker.stop()
-                        self._is_run = False
-                        self._action_lock.release()
-                        return
-                    if self._pause:
-                        # pause after signall
-                        self._action_lock.release()
-                        time.sleep(1)                        
-                        self._action_lock.acquire()
-                    else:
-                        break
-            self._action_lock.release()            
-            state = ActionRunningState.repeat
-            # get all available actions
-            while state is ActionRunningState.repeat:
-                state, action = self._pipeline. _plan_action(self._save_path)
-                if action is not None and state is not ActionRunningState.finished:
-                    wait_actions.append(action)
-            wait_actions = sorted(wait_actions, key=lambda item: item._get_priority())
-            # finished external tasks
+        add_plan_listener(self._notify_plan)
+        try:
+            errs = self._schedule()
+        finally:
+            remove_plan_listener(self._notify_plan)
+            # stop workers after processing of queued actions
             for worker in workers:
-                self.WorkerThread._runners_lock.acquire()
-                if len(self.WorkerThread._finished_runners)==0:
-                    self.WorkerThread._runners_lock.release()
-                    break
-                self.WorkerThread._runners_lock.release()                
-                if worker.is_empty():  
-                    self.WorkerThread._runners_lock.acquire()
-                    runner = self.WorkerThread._finished_runners.pop()
-                    self.WorkerThread._runners_lock.release()   
-                    worker.add_action(runner.action, True)
-            # try add action to workers
-            if len(wait_actions)==0:
-                time.sleep(0.1)
-            try:
-                action = wait_actions.pop() 
-                for worker in workers:
-                    if worker. add_action(action):
-                        action = wait_actions.pop()
-                wait_actions.append(action)
-            except IndexError:
-                # empty queue
-                pass
-            if state is ActionRunningState.finished and \
-                len(self.WorkerThread._complex_runners) == 0 and \
-                len(self.WorkerThread._processed_runners) == 0 and \
-                len(self.WorkerThread._finished_runners) == 0 and \
-                len(wait_actions) == 0:
-                #wait for  finishing worker threads
-                for worker in workers:
-                    if worker.is_empty():
-                        worker.stop()
-                # TODO: asi se zapisuji věci do souborů, zjistit proč
-                time.sleep(0.1)
-                self._action_lock.acquire()
-                self._is_finished = True
-                self._is_run = False
-                self._action_lock.release()
-                return
-            if state is ActionRunningState.error:
-                logger.error("Analysis processing return errors:\n    {0}".format(
-                    '\n    '.join(runner)))
+                self._work_queue.put((float("inf"), next(self._work_order), False, None))
+        if errs is not None:
             for worker in workers:
-                err = worker.get_error()
-                if err is not None:
+                worker.join()
+        # stopped processing does not wait for evaluations in pool
+        self._executor.shutdown(wait=errs is not None)
+        self._action_lock.acquire()
+        if errs:
+            self._run_errs = errs
+        elif errs is not None:
+            self._is_finished = True
+        self._is_run = False
+        self._action_lock.release()
+
+    def _schedule(self):
+        """
+        Plan actions and wait for events until the pipeline is finished.
+        Return [] if pipeline is finished, list of errors or None if processing is stopped.
+        """
+        while True:
+            with self._events:
+                n_events = self._n_events
+                while self._pause and not self._stop:
+                    # pause after signall
+                    self._events.wait()
+                    n_events = self._n_events
+                if self._stop:
+                    # stop after signall
+                    return None
+                if len(self._worker_errs) > 0:
                     # error is logged in worker
-                    runner = [err]
-                    state = ActionRunningState.error
-                    break 
-            if state is ActionRunningState.error:
-                for worker in workers:
-                    if worker.is_empty():
-                        worker.stop() 
-                self._run_errs = runner
-                self._action_lock.acquire()
-                self._is_run = False
-                self._action_lock.release()
-                return
+                    return list(self._worker_errs)
+                finished_runners = self._finished_runners
+                self._finished_runners = []
+            # finished external tasks
+            for runner in finished_runners:
+                self._queue_action(runner.action, True)
+            # get all available actions
+            state = ActionRunningState.repeat
+            planned = False
+            while state is ActionRunningState.repeat:
+                state, action = self._pipeline._plan_action(self._save_path)
+                if state is ActionRunningState.error:
+                    logger.error("Analysis processing return errors:\n    {0}".format(
+                        '\n    '.join(action)))
+                    return action
+                if action is not None and state is not ActionRunningState.finished:
+                    self._queue_action(action)
+                    planned = True
+            with self._events:
+                if state is ActionRunningState.finished and \
+                    len(self._complex_runners) == 0 and \
+                    len(self._processed_runners) == 0 and \
+                    len(self._finished_runners) == 0 and \
+                    self._n_queued == 0:
+                    return []
+                if not planned and self._n_events == n_events:
+                    # next action can be ready only after some event
+                    self._events.wait()
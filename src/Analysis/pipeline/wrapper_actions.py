@@ -1,4 +1,5 @@
-from .action_types import WrapperActionType, ActionStateType, BaseActionType, ActionsStatistics, ActionRunningState
+from .action_types import WrapperActionType, ActionStateType, BaseActionType, ActionsStatistics, ActionRunningState, \
+    notify_plan_listeners
 from .data_types_tree import Ensemble, DTT
 from .generator_actions import VariableGenerator
 from .workflow_actions import Workflow
@@ -6,8 +7,13 @@ from .data_types_tree import Struct, Float
 from .calibration_data_types import *
 from .calibration_lbfgsb import min_lbfgsb
 from .calibration_slsqp import min_slsqp
+from .calibration_cache import EvaluationCache
+from .calibration_surrogate import min_surrogate
+from .calibration_diff_evolution import min_diff_evolution
 
 import threading
+import os
+import hashlib
 import time
 from enum import IntEnum
 import math
@@ -222,15 +228,23 @@ class Calibration(WrapperActionType):
         :param list of CalibrationObservation Observations: list of observations
         :param list of CalibrationAlgorithmParameter AlgorithmParameters: list of algorithm parameters
         :param CalibrationTerminationCriteria TerminationCriteria: termination criteria
-        :param str MinimizationMethod: type of solver
+        :param str MinimizationMethod: type of solver, 'L-BFGS-B', 'SLSQP', 'DIFF' (differential evolution)
+            or 'SURROGATE' (surrogate assisted, see calibration_surrogate)
         :param CalibrationBoundsType BoundsType: type of bounds
         :param CalibrationOutputType Output: output from calibration
+        :param int MaxConcurrency: maximal number of concurrently evaluated
+            wrapped workflows (jacobian perturbations, population members),
+            all evaluations of a batch if not set
+        :param bool PersistentCache: if True evaluated observations are saved
+            to file in analysis directory and reused by restarted calibration
+            with the same wrapped workflow and parameters
         :param Action Input: action that return input to calibration
         """
 
         self._scipy_started = False
         """true if scipy thread was started"""
-        self._tmp_action = None
+        self._tmp_actions = {}
+        """workflows evaluating the batch: index in batch -> workflow"""
         self._tmp_action_index = 0
 
         self._scipy_thread = None
@@ -242,16 +256,23 @@ class Calibration(WrapperActionType):
         self._scipy_state = self.ScipyState.created
         """scipy state"""
         self._scipy_x = None
-        self._scipy_y = None
+        self._scipy_batch = []
+        """x values requested by scipy thread for concurrent evaluation"""
+        self._scipy_batch_y = []
+        """objective values of batch, None if not evaluated yet"""
         self._scipy_log_transform = []
         self._scipy_lb = []
         self._scipy_ub = []
         self._scipy_diff_inc_rel = []
         self._scipy_diff_inc_abs = []
         self._scipy_res = None
-        self._scipy_xy_log = []
-        self._scipy_xj_log = []
-        self._scipy_x_output_log = []
+        self._scipy_cache = EvaluationCache()
+        """cache of evaluated observations, keys of logs are made by it"""
+        self._scipy_cache_hits = 0
+        """number of evaluations found in persistent cache"""
+        self._scipy_xy_log = {}
+        self._scipy_xj_log = {}
+        self._scipy_x_output_log = {}
         self._scipy_iterations = []
         self._scipy_model_eval_num = 0
 
@@ -366,7 +387,10 @@ class Calibration(WrapperActionType):
                 cr = "failure"
             res = Struct(n_iter=Int(len(self._scipy_iterations)),
                          converge_reason=Enum(["none", "converged", "failure"], cr),
-                         residual=Float(self._scipy_res.fun))
+                         residual=Float(self._scipy_res.fun),
+                         n_real_evaluation=Int(self._scipy_model_eval_num),
+                         n_cached_evaluation=Int(self._scipy_cache_hits),
+                         n_surrogate_evaluation=Int(self._scipy_res.get("n_surrogate_eval", 0)))
             self._output = Struct(optimisation=opt, result=res)
         else:
             self._output = CalibrationOutputType.create_type(
@@ -426,6 +450,16 @@ class Calibration(WrapperActionType):
             v = "BoundsType={0}".format(str(self._variables['BoundsType']))
             var.append([v])
 
+        # MaxConcurrency
+        if 'MaxConcurrency' in self._variables:
+            v = "MaxConcurrency={0}".format(self._variables['MaxConcurrency'])
+            var.append([v])
+
+        # PersistentCache
+        if 'PersistentCache' in self._variables:
+            v = "PersistentCache={0}".format(self._variables['PersistentCache'])
+            var.append([v])
+
         return var
 
     def _set_storing(self, identical_list):
@@ -453,6 +487,8 @@ class Calibration(WrapperActionType):
                     self._set_state(ActionStateType.processed)
                     # send as short action for storing and settings state
                     return ActionRunningState.repeat,  self
+            if self._variables.get('PersistentCache', False) and path is not None:
+                self._scipy_cache = EvaluationCache(self._get_cache_file(path))
             # run scipy thread
             self._scipy_thread = threading.Thread(target=self._scipy_run)
             self._scipy_thread.daemon = True
@@ -463,21 +499,7 @@ class Calibration(WrapperActionType):
                 if self._scipy_event.is_set():
                     return ActionRunningState.wait, None
                 else:
-                    if self._tmp_action is None:
-                        self._tmp_action = self._create_tmp_action(self._scipy_x_to_wrapped_input(self._scipy_x))
-                    state, action = self._tmp_action._plan_action(path)
-                    if state is ActionRunningState.finished:
-                        output = action._get_output()
-                        self._scipy_y = self._wrapped_output_to_scipy_y(output, self._scipy_x)
-                        self._tmp_action = None
-                        self._scipy_event.set()
-                        return ActionRunningState.wait, None
-                    if state is ActionRunningState.repeat:
-                        return state, action
-                    if state is ActionRunningState.error:
-                        return state, action
-                    if state is ActionRunningState.wait and action is not None:
-                        return ActionRunningState.repeat, action
+                    return self._plan_batch(path)
             if self._get_scipy_state() == self.ScipyState.finished:
                 self._set_state(ActionStateType.processed)
                 self.__make_output()
@@ -485,6 +507,56 @@ class Calibration(WrapperActionType):
             return ActionRunningState.wait, None
         return ActionRunningState.wait, None
 
+    def _plan_batch(self, path):
+        """
+        Plan workflows evaluating the batch requested by scipy thread,
+        at most MaxConcurrency workflows are processed concurrently.
+        """
+        max_concurrency = self._variables.get('MaxConcurrency', len(self._scipy_batch))
+        for i, x in enumerate(self._scipy_batch):
+            if self._scipy_batch_y[i] is not None:
+                continue
+            if i not in self._tmp_actions:
+                if len(self._tmp_actions) >= max_concurrency:
+                    break
+                self._tmp_actions[i] = self._create_tmp_action(self._scipy_x_to_wrapped_input(x))
+            state, action = self._tmp_actions[i]._plan_action(path)
+            if state is ActionRunningState.finished:
+                output = action._get_output()
+                self._scipy_cache.add(x, {obs.name: getattr(output, obs.name).value
+                                          for obs in self._variables['Observations']})
+                self._scipy_batch_y[i] = self._wrapped_output_to_scipy_y(output, x)
+                del self._tmp_actions[i]
+                continue
+            if state is ActionRunningState.repeat:
+                return state, action
+            if state is ActionRunningState.error:
+                return state, action
+            if state is ActionRunningState.wait and action is not None:
+                return ActionRunningState.repeat, action
+        if len(self._tmp_actions) == 0 and \
+                all(y is not None for y in self._scipy_batch_y):
+            self._scipy_event.set()
+        return ActionRunningState.wait, None
+
+    def _get_cache_file(self, path):
+        """
+        Return file of persistent cache, name is made from hash of wrapped
+        workflow, parameters and static parameters, that determine observations,
+        and of names of cached observations.
+        """
+        h = hashlib.sha1()
+        h.update(bytes(self._variables['WrappedAction']._get_hash(), "utf-8"))
+        for par in self._variables['Parameters']:
+            h.update(bytes("\n".join(par._get_variables_script()), "utf-8"))
+        h.update(bytes("\n".join(obs.name for obs in self._variables['Observations']), "utf-8"))
+        try:
+            if hasattr(self.get_input_val(0), "static_parameters"):
+                h.update(bytes("\n".join(self.get_input_val(0).static_parameters._get_settings_script()), "utf-8"))
+        except ValueError:
+            pass
+        return os.path.join(path, "calibration_cache", "{0}.json".format(h.hexdigest()))
+
     def _create_tmp_action(self, input):
         self._tmp_action_index += 1
 
@@ -574,7 +646,7 @@ class Calibration(WrapperActionType):
         # MinimizationMethod
         if 'MinimizationMethod' in self._variables:
             if isinstance(self._variables['MinimizationMethod'], str):
-                if not self._variables['MinimizationMethod'] in ["L-BFGS-B", "SLSQP", "DIFF"]:
+                if not self._variables['MinimizationMethod'] in ["L-BFGS-B", "SLSQP", "DIFF", "SURROGATE"]:
                     self._add_error(err, "Method '{0}' is not supported.".format(self._variables['MinimizationMethod']))
             else:
                 self._add_error(err, "Parameter 'MinimizationMethod' must be string")
@@ -587,6 +659,17 @@ class Calibration(WrapperActionType):
             else:
                 self._add_error(err, "Parameter 'BoundsType' must be CalibrationBoundsType")
 
+        # MaxConcurrency
+        if 'MaxConcurrency' in self._variables:
+            if not isinstance(self._variables['MaxConcurrency'], int) or \
+                    self._variables['MaxConcurrency'] < 1:
+                self._add_error(err, "Parameter 'MaxConcurrency' must be positive integer")
+
+        # PersistentCache
+        if 'PersistentCache' in self._variables:
+            if not isinstance(self._variables['PersistentCache'], bool):
+                self._add_error(err, "Parameter 'PersistentCache' must be bool")
+
         # WrappedAction
         if 'WrappedAction' in self._variables:
             if not isinstance(self._variables['WrappedAction'], Workflow):
@@ -732,16 +815,27 @@ class Calibration(WrapperActionType):
 
         self._scipy_event.set()
         self._set_scipy_state(self.ScipyState.running)
+        notify_plan_listeners()
 
         # self._scipy_res = minimize(self._scipy_fun, x0, method='L-BFGS-B', jac=self._scipy_jac, callback=self._scipy_callback,
         #                            options={'maxiter': self._variables['TerminationCriteria'].n_max_steps,
         #                                     'ftol': 1e-6, 'disp': True}, **args)
 
         if self._variables['MinimizationMethod'] == "DIFF":
-            self._scipy_res = differential_evolution(self._scipy_fun, strategy= "best1bin",
-                                                     maxiter=self._variables['TerminationCriteria'].n_max_steps,
-                                                     popsize=5, tol=1e-4, callback=self._scipy_callback,
-                                                     disp=True, polish=False, **args)
+            # population of the generation is evaluated as one batch,
+            # fixed seed makes restarted calibration reuse the persistent cache
+            self._scipy_res = min_diff_evolution(self._scipy_model_eval_batch, self._scipy_lb, self._scipy_ub,
+                                                 maxiter=self._variables['TerminationCriteria'].n_max_steps,
+                                                 popsize=5, tol=1e-4, callback=self._scipy_callback, seed=0,
+                                                 disp=True)
+        elif self._variables['MinimizationMethod'] == "SURROGATE":
+            # real evaluations only in candidates found on surrogate model
+            self._scipy_res = min_surrogate(self._scipy_model_eval_batch, x0, self._scipy_lb, self._scipy_ub,
+                                            callback=self._scipy_callback,
+                                            ter_crit=self._variables['TerminationCriteria'],
+                                            n_candidates=self._variables.get('MaxConcurrency', 1),
+                                            maxiter=self._variables['TerminationCriteria'].n_max_steps,
+                                            disp=True)
         elif self._variables['MinimizationMethod'] == "L-BFGS-B":
             self._scipy_res = min_lbfgsb(self._scipy_fun, x0, jac=self._scipy_jac, callback=self._scipy_callback,
                                          disp=True, ter_crit=self._variables['TerminationCriteria'], **args)
@@ -754,6 +848,7 @@ class Calibration(WrapperActionType):
             self._scipy_callback(self._scipy_res.x)
 
         self._set_scipy_state(self.ScipyState.finished)
+        notify_plan_listeners()
 
         #print("scipy_model_eval_num = {}".format(str(self._scipy_model_eval_num)))
         #print("x = {}".format(str(self._scipy_res.x)))
@@ -770,7 +865,22 @@ class Calibration(WrapperActionType):
     def _scipy_jac(self, x):
         """jacobian function called by scipy"""
         #print("_scipy_jac enter")
-        fx = self._scipy_model_eval(x)
+        # evaluate all perturbations concurrently
+        xhs = []
+        steps = []
+        for i in range(x.shape[0]):
+            xh = x.copy()
+            if self._scipy_log_transform[i]:
+                h = self._scipy_diff_inc_rel[i] * math.fabs(math.pow(10.0, x[i])) + self._scipy_diff_inc_abs[i]
+                xh[i] = math.log10(math.pow(10.0, xh[i]) + h)
+                steps.append(xh[i] - x[i])
+            else:
+                h = self._scipy_diff_inc_rel[i] * math.fabs(x[i]) + self._scipy_diff_inc_abs[i]
+                xh[i] += h
+                steps.append(h)
+            xhs.append(xh)
+        ys = self._scipy_model_eval_batch([x] + xhs)
+        fx = ys[0]
 
         # observations in x
         obs_num = len(self._variables['Observations'])
@@ -784,16 +894,8 @@ class Calibration(WrapperActionType):
         jac = np.zeros_like(x)
         jac_matrix = np.zeros((obs_num, x.shape[0]))
         for i in range(x.shape[0]):
-            if self._scipy_log_transform[i]:
-                h = self._scipy_diff_inc_rel[i] * math.fabs(math.pow(10.0, x[i])) + self._scipy_diff_inc_abs[i]
-                xh = x.copy()
-                xh[i] = math.log10(math.pow(10.0, xh[i]) + h)
-                jac[i] = (self._scipy_model_eval(xh) - fx) / (xh[i] - x[i])
-            else:
-                h = self._scipy_diff_inc_rel[i] * math.fabs(x[i]) + self._scipy_diff_inc_abs[i]
-                xh = x.copy()
-                xh[i] += h
-                jac[i] = (self._scipy_model_eval(xh) - fx) / h
+            xh = xhs[i]
+            jac[i] = (ys[i + 1] - fx) / steps[i]
 
             # observations in xh
             obs_xh = np.zeros((obs_num, 1))
@@ -804,7 +906,7 @@ class Calibration(WrapperActionType):
                 ind += 1
 
             jac_matrix[:, i] = ((obs_xh - obs_x) / (xh[i] - x[i])).reshape(obs_num)
-        self._scipy_xj_log.append((x.copy(), jac_matrix))
+        self._scipy_xj_log[self._scipy_cache.key(x)] = jac_matrix
         return jac
 
     def _scipy_callback(self, xk, convergence=None):
@@ -815,16 +917,42 @@ class Calibration(WrapperActionType):
 
     def _scipy_model_eval(self, x):
         """model evaluation used in _scipy_fun and _scipy_jac"""
-        for xy in self._scipy_xy_log:
-            if np.all(xy[0] == x):
-                return xy[1]
+        return self._scipy_model_eval_batch([x])[0]
 
-        self._scipy_model_eval_num += 1
-        self._scipy_x = x
-        self._scipy_event.clear()
-        self._scipy_event.wait()
-        self._scipy_xy_log.append((x.copy(), self._scipy_y))
-        return self._scipy_y
+    def _scipy_model_eval_batch(self, xs):
+        """
+        Evaluate model in all x of list xs, values not found in log or
+        in persistent cache are evaluated by concurrently processed
+        workflows (see _plan_batch). Return list of objective values.
+        """
+        self._scipy_x = xs[-1]
+        batch = []
+        batch_keys = set()
+        for x in xs:
+            key = self._scipy_cache.key(x)
+            if key in self._scipy_xy_log or key in batch_keys:
+                continue
+            observations = self._scipy_cache.get(x)
+            if observations is not None and \
+                    all(obs.name in observations for obs in self._variables['Observations']):
+                # evaluated by previous run
+                self._scipy_cache_hits += 1
+                output = Struct(**{name: Float(value) for name, value in observations.items()})
+                self._scipy_xy_log[key] = self._wrapped_output_to_scipy_y(output, x)
+            else:
+                batch.append(x.copy())
+                batch_keys.add(key)
+
+        if len(batch) > 0:
+            self._scipy_model_eval_num += len(batch)
+            self._scipy_batch = batch
+            self._scipy_batch_y = [None] * len(batch)
+            self._scipy_event.clear()
+            notify_plan_listeners()
+            self._scipy_event.wait()
+            for x, y in zip(batch, self._scipy_batch_y):
+                self._scipy_xy_log[self._scipy_cache.key(x)] = y
+        return [self._scipy_xy_log[self._scipy_cache.key(x)] for x in xs]
 
     def _scipy_x_to_wrapped_input(self, x):
         """convert x from scipy format to workflow format"""
@@ -873,7 +1001,7 @@ class Calibration(WrapperActionType):
     def _wrapped_output_to_scipy_y(self, output, x):
         """convert output from workflow to scipy objective value"""
         # log
-        self._scipy_x_output_log.append((x.copy(), output))
+        self._scipy_x_output_log[self._scipy_cache.key(x)] = output
 
         ret = 0.0
         for obs in self._variables['Observations']:
@@ -901,18 +1029,8 @@ class Calibration(WrapperActionType):
 
     def _find_output_from_x(self, x):
         """find output from x"""
-        output = None
-        for o in self._scipy_x_output_log:
-            if np.all(o[0] == x):
-                output = o[1]
-                break
-        return output
+        return self._scipy_x_output_log.get(self._scipy_cache.key(x))
 
     def _find_jac_matrix_from_x(self, x):
         """find jacobian matrix from x"""
-        jac = None
-        for j in self._scipy_xj_log:
-            if np.all(j[0] == x):
-                jac = j[1]
-                break
-        return jac
+        return self._scipy_xj_log.get(self._scipy_cache.key(x))
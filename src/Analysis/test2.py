@@ -1,6 +1,8 @@
 import os
 import sys
 import re
+import subprocess
+import time
 
 #__lib_dir__ = os.path.join(os.path.split(
 #    os.path.dirname(os.path.realpath(__file__)))[0], "gm_base")
@@ -0,0 +1,104 @@
+"""
+Content addressed on-disk cache of the common decompositions of the interfaces.
+
+The common decomposition of an interface and the maps of its subobjects to the objects of the
+original decompositions (see Interface._finish_init) depend only on the nodes and topologies
+of the decompositions added to the interface. The cache file is named by the hash of these inputs,
+so repeated meshing of the same geometry skips the intersection of the decompositions.
+
+The common decomposition is stored in the serialized form (see polygons_io.serialize), so
+the IDs of the loaded decomposition are consecutive indices of the objects, subobject maps are
+renumbered accordingly.
+"""
+import os
+import pickle
+import hashlib
+import numpy as np
+import gm_base.polygons.polygons_io as polygons_io
+
+
+CACHE_VERSION = 1
+# Change when the stored data or the decomposition algorithms change.
+
+
+def decomposition_hash(nodes, topology):
+    """
+    Hash of a decomposition given by the nodes and topology, as passed to Interface.add_decomposition.
+    :param nodes: List of node coordinates (x,y).
+    :param topology: Topology object.
+    :return: Hex digest.
+    """
+    h = hashlib.sha1()
+    nodes = np.array(nodes, dtype=float).reshape(-1, 2)
+    seg_nodes = np.array([seg.node_ids for seg in topology.segments], dtype=int).reshape(-1, 2)
+    h.update(repr((nodes.shape, seg_nodes.shape)).encode())
+    h.update(nodes.tobytes())
+    h.update(seg_nodes.tobytes())
+    for poly in topology.polygons:
+        polygon = (list(poly.segment_ids), [list(hole) for hole in poly.holes], list(poly.free_points))
+        h.update(repr(polygon).encode())
+    return h.hexdigest()
+
+
+class DecompCache:
+    """
+    Cache of the common decompositions, counts hits and misses.
+    """
+    def __init__(self, cache_dir):
+        """
+        :param cache_dir: Directory of the cache files, created if necessary.
+        """
+        self.cache_dir = cache_dir
+        self.n_hits = 0
+        self.n_misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(decomp_hashes):
+        """
+        Cache key of an interface.
+        :param decomp_hashes: List of decomposition_hash of the decompositions in the order they were added.
+        """
+        h = hashlib.sha1()
+        h.update(repr((CACHE_VERSION, list(decomp_hashes))).encode())
+        return h.hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.cache_dir, key + ".pickle")
+
+    def load(self, key):
+        """
+        :return: (common_decomp, subobj_lists) or None if there is no valid cache file for the key.
+        """
+        try:
+            with open(self._file(key), "rb") as f:
+                version, nodes, topology, subobj_lists = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            version = None
+        if version != CACHE_VERSION:
+            self.n_misses += 1
+            return None
+        self.n_hits += 1
+        return polygons_io.deserialize(nodes, topology), subobj_lists
+
+    def store(self, key, common_decomp, subobj_lists):
+        """
+        Store the common decomposition and subobject lists, see Interface._finish_init.
+        The file is written atomically, so concurrent runs can share the cache.
+        :param subobj_lists: decomp_id -> [point map, segment map, polygon map], map: orig_id -> list of new_ids
+        """
+        nodes, topology = polygons_io.serialize(common_decomp)
+        shapes = common_decomp.decomp.shapes
+        indexed_lists = {}
+        for decomp_id, subobjs in subobj_lists.items():
+            indexed_lists[decomp_id] = [
+                {orig_id: [shapes[dim][new_id].index for new_id in new_ids] for orig_id, new_ids in one_dim.items()}
+                for dim, one_dim in enumerate(subobjs)]
+
+        tmp_file = "{}.{}.tmp".format(self._file(key), os.getpid())
+        with open(tmp_file, "wb") as f:
+            pickle.dump((CACHE_VERSION, nodes, topology, indexed_lists), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, self._file(key))
+
+    def report(self):
+        return "Decomposition cache: {} hits, {} misses".format(self.n_hits, self.n_misses)
@@ -29,7 +29,10 @@ Heterogeneous mesh step:
 
 import os
 import sys
+import copy
+import time
 import subprocess
+import concurrent.futures
 
 
 
@@ -48,6 +51,11 @@ import gm_base.polygons.merge as merge
 import gm_base.polygons.polygons_io as polygons_io
 import gm_base.geometry_files.bspline_io as bspline_io
 import Geometry.gmsh_io as gmsh_io
+import Geometry.mesh_deform as mesh_deform
+import Geometry.decomp_cache as decomp_cache
+import Geometry.rebuild_state as rebuild_state
+import Geometry.mesh_stats as mesh_stats
+import Geometry.profiling as profiling
 import numpy as np
 import numpy.linalg as la
 import math
@@ -55,6 +63,11 @@ import math
 import bspline as bs
 import bspline_approx as bs_approx
 import brep_writer as bw
+try:
+    import gmsh
+except ImportError:
+    # Only the gmsh executable is used, see LayerGeometry.call_gmsh.
+    gmsh = None
 # def import_plotting():
 # global plt
 # global bs_plot
@@ -115,11 +128,16 @@ class ShapeInfo:
             self.bot_iface = bot
             self.free = True
 
-    def set_shape(self, i_reg, top, bot):
+    def set_shape(self, i_reg, top, bot, origin=None):
+        """
+        :param origin: (layer id, topology dim, object index) of the layer object the shape is made of,
+        determines the region of the shape, see LayerGeometry.region_of.
+        """
         assert not self.free
         self.i_reg = i_reg
         self.top_iface = top
         self.bot_iface = bot
+        self.origin = origin
         self.free = True
 
     def dim(self):
@@ -341,6 +359,11 @@ class Interface:
             self._surface = lg.surfaces[self.surface_id]
         self.common_decomp = None
         self.decompositions = {}
+        self._decomp_hashes = {}
+        # Hashes of the added decompositions, used as the key to the decomposition cache.
+        self._decomp_cache = getattr(lg, 'decomp_cache', None)
+        self._flat_mesh = getattr(lg, 'flat_mesh', False)
+        # Make flat geometry at the elevation, the surface is applied by the mesh deformation (algorithm I).
 
     def add_decomposition(self, nodes, topology):
         """
@@ -353,6 +376,8 @@ class Interface:
         if not topology.id in self.decompositions:
             decomp = polygons_io.deserialize(nodes, topology)
             self.decompositions[topology.id] = decomp
+            if self._decomp_cache is not None:
+                self._decomp_hashes[topology.id] = decomp_cache.decomposition_hash(nodes, topology)
         else:
             decomp = self.decompositions[topology.id]
         return decomp
@@ -364,9 +389,37 @@ class Interface:
         if self.common_decomp is not None:
             return
 
+        if self._decomp_cache is not None:
+            cache_key = self._decomp_cache.key(self._decomp_hashes.values())
+            cached = self._decomp_cache.load(cache_key)
+            if cached is None:
+                self._make_common_decomp()
+                self._decomp_cache.store(cache_key, self.common_decomp, self.subobj_lists)
+            else:
+                self.common_decomp, self.subobj_lists = cached
+        else:
+            self._make_common_decomp()
+
+        #self.common_decomp = decomps[0]
+        nodes_xy = { pt.id: pt.xy for pt in self.common_decomp.points.values() }
+        self._check_nodes(list(nodes_xy.values()))
+        # Z of all nodes in single surface evaluation.
+        nodes_z = self.approx_eval_z_array(np.array(list(nodes_xy.values())))
+        self.nodes = { id: (x, y, z) for (id, (x, y)), z in zip(nodes_xy.items(), nodes_z) }
+
+    def _make_common_decomp(self):
+        """
+        Intersect the decompositions, set the common decomposition and the subobject lists.
+        """
         decomps = list(self.decompositions.values())
         decomp_ids = list(self.decompositions.keys())
-        self.common_decomp, all_maps = merge.intersect_decompositions(decomps)
+        # Both paths merge points of different decompositions with the same tolerance.
+        merge_tol = 1e-10
+        if len(decomps) > 2:
+            self.common_decomp, all_maps = merge.overlay_decompositions(decomps, merge_tol=merge_tol)
+        else:
+            # Pairwise intersection is cheap here and keeps object numbering of the existing outputs.
+            self.common_decomp, all_maps = merge.intersect_decompositions(decomps, merge_tol=merge_tol)
         #plot_polygons.plot_polygon_decomposition(self.common_decomp)
         # make subpolygon lists
         self.subobj_lists={}
@@ -401,15 +454,21 @@ class Interface:
             self.subobj_lists[decomp_ids[decomp_idx]] = subobjs
 
 
-        #self.common_decomp = decomps[0]
-        nodes_xy = { pt.id: pt.xy for pt in self.common_decomp.points.values() }
-        self._check_nodes(list(nodes_xy.values()))
-        self.nodes = { id: (x, y, self.approx_eval_z(x, y) ) for id, (x,y) in nodes_xy.items() }
-
+    def edge_sample_points(self):
+        """
+        Sample points of all edges of the common decomposition in single surface evaluation.
+        :return: Array (n_segments, n_points, 3), segments in the order of the common decomposition.
+        """
+        self._finish_init()
+        segments = list(self.common_decomp.segments.values())
+        a_xyz = np.array([self.nodes[seg.vtxs[0].id] for seg in segments]).reshape(-1, 3)
+        b_xyz = np.array([self.nodes[seg.vtxs[1].id] for seg in segments]).reshape(-1, 3)
+        return self.eval_edge_points(a_xyz, b_xyz)
 
-    def make_shapes(self):
+    def make_shapes(self, edge_curves=None):
         """
         Make dictionaries of shapes for points, segments, polygons in common decomposition.
+        :param edge_curves: Approximation curves of the edges, see _fit_edge_curves. Computed here if not given.
         :return:
         """
         self._finish_init()
@@ -421,12 +480,19 @@ class Interface:
         for id, vert in self.vertices.items():
             vert.shape.dbg_id = id
 
+        segments = list(decomp.segments.values())
+        if edge_curves is None:
+            edge_curves = [None] * len(segments)
+            edges_xyz = self.edge_sample_points()
+        else:
+            edges_xyz = [None] * len(segments)
+
         self.edges = {}
-        for segment in decomp.segments.values():
+        for segment, xyz_points, curve_xyz in zip(segments, edges_xyz, edge_curves):
             #nodes_id, surface_id = segment
             pa, pb = segment.vtxs
             edge = bw.Edge( [self.vertices[pa.id].shape, self.vertices[pb.id].shape] )
-            curve_z = self.add_curve_to_edge(edge)
+            curve_z = self.add_curve_to_edge(edge, xyz_points, curve_xyz)
             si = ShapeInfo(edge)
             si.curve_z = curve_z
             self.edges[segment.id] =  si
@@ -472,14 +538,11 @@ class Interface:
         Used by InterpolatedNodeSet.
         """
         assert len(a_nodes) == len(b_nodes)
-        nodes=[]
-        for (ax, ay), (bx, by) in zip(a_nodes, b_nodes):
-            az = a_iface.approx_eval_z(ax, ay)
-            bz = b_iface.approx_eval_z(bx, by)
-            line = ( (ax, ay, az), (bx, by, bz) )
-            x,y,z = self.line_intersect( *line )
-            nodes.append( (x,y,z) )
-        return nodes
+        a_xy = np.array(a_nodes, dtype=float).reshape(-1, 2)
+        b_xy = np.array(b_nodes, dtype=float).reshape(-1, 2)
+        a = np.concatenate((a_xy, a_iface.approx_eval_z_array(a_xy)[:, None]), axis=1)
+        b = np.concatenate((b_xy, b_iface.approx_eval_z_array(b_xy)[:, None]), axis=1)
+        return [tuple(xyz) for xyz in self.lines_intersect(a, b)]
 
     def iter_shapes(self):
         """
@@ -505,21 +568,52 @@ class Interface:
             if self.transform_z[1] != self.elevation:
                 self.transform_z = [ 1.0, self.elevation]
             self.surface_approx = self._surface.make_flat_surface(nod_aabb, self.transform_z)
+            self.target_approx = self.surface_approx
 
         else:
             # bumpy surface
             self.surface_approx = self._surface.make_bumpy_surface(self.transform_z)
+            self.target_approx = self.surface_approx
 
             uv_nodes = self.surface_approx.xy_to_uv(np.array(nodes))
             for i, uv in enumerate(uv_nodes):
                 if not ( 0.0 < uv[0] < 1.0 and 0.0 < uv[1] < 1.0 ):
                     raise IndexError("Node {}: {} is out of surface domain, uv: {}".format(i, nodes[i], uv))
+
+            if self._flat_mesh:
+                # flat surface over the domain of the bumpy surface
+                domain_xy = self.target_approx.uv_to_xy(np.array([[0, 0], [1, 0], [1, 1], [0, 1]], dtype=float))
+                domain_aabb = (np.amin(domain_xy, axis=0), np.amax(domain_xy, axis=0))
+                self.surface_approx = Surface().make_flat_surface(domain_aabb, [1.0, self.elevation])
         self.bw_surface = bw.surface_from_bs(self.surface_approx.make_full_surface())
 
 
     def approx_eval_z(self, x, y):
         return self.surface_approx.z_eval_xy_array(np.array([[x, y]]))[0]
 
+    def approx_eval_z_array(self, xy):
+        """
+        Vectorized approx_eval_z.
+        :param xy: Array (N, 2) of points.
+        :return: Array (N,) of Z values.
+        """
+        xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+        if len(xy) == 0:
+            return np.empty(0)
+        return self.surface_approx.z_eval_xy_array(xy)
+
+    def target_eval_z_array(self, xy):
+        """
+        Vectorized evaluation of the true surface of the interface, differs from
+        approx_eval_z_array for the flat geometry of the mesh deformation.
+        :param xy: Array (N, 2) of points.
+        :return: Array (N,) of Z values.
+        """
+        xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+        if len(xy) == 0:
+            return np.empty(0)
+        return self.target_approx.z_eval_xy_array(xy)
+
 
     # TODO:
     # - test
@@ -529,35 +623,77 @@ class Interface:
         return (t * b + (1-t) * a)
 
     def line_intersect(self, a, b):
-        # TODO: Compute true intersection.
-        t = 0.5
-        z = (a[2] + b[2]) / 2
-        z_diff = 1.0
-        tol = np.abs(a[2] - b[2]) * 0.001
-        while abs(z_diff) > tol:
-            x = self.interpol(a[0], b[0], t)
-            y = self.interpol(a[1], b[1], t)
-            z_new = self.approx_eval_z(x, y)
-            z_diff = z - z_new
-            z = z_new
-            t = (z - b[2]) / (a[2] - b[2])
+        x, y, z = self.lines_intersect(np.array([a], dtype=float), np.array([b], dtype=float))[0]
         return (x, y, z)
 
+    def lines_intersect(self, a, b):
+        """
+        Intersections of the lines with the surface, fixed point iteration for all lines at once.
+        Every line is iterated until its own Z change is under the tolerance.
+        TODO: Compute true intersection.
+        :param a: Array (N, 3), first points of the lines.
+        :param b: Array (N, 3), second points of the lines.
+        :return: Array (N, 3) of intersection points.
+        """
+        n_lines = len(a)
+        t = np.full(n_lines, 0.5)
+        z = (a[:, 2] + b[:, 2]) / 2
+        xy = np.empty((n_lines, 2))
+        tol = np.abs(a[:, 2] - b[:, 2]) * 0.001
+        active = np.ones(n_lines, dtype=bool)
+        while np.any(active):
+            idx = np.nonzero(active)[0]
+            xy[idx] = self.interpol(a[idx, 0:2], b[idx, 0:2], t[idx, None])
+            z_new = self.approx_eval_z_array(xy[idx])
+            z_diff = z[idx] - z_new
+            z[idx] = z_new
+            with np.errstate(divide='ignore', invalid='ignore'):
+                t[idx] = (z_new - b[idx, 2]) / (a[idx, 2] - b[idx, 2])
+            active[idx] = np.abs(z_diff) > tol[idx]
+        return np.concatenate((xy, z[:, None]), axis=1)
 
-    def add_curve_to_edge(self, edge):
+    @staticmethod
+    def edge_points(a, b, n_points):
+        """
+        Equidistant points on the lines, same values as np.linspace for every line.
+        :param a: Array (N, D), start points.
+        :param b: Array (N, D), end points.
+        :return: Array (N, n_points, D)
+        """
+        step = (b - a) / (n_points - 1)
+        points = np.arange(n_points, dtype=float)[None, :, None] * step[:, None, :] + a[:, None, :]
+        points[:, -1, :] = b
+        return points
+
+    def eval_edge_points(self, a_xyz, b_xyz, n_points=16):
+        """
+        Sample points of the edges projected to the surface, single evaluation of the surface for all edges.
+        :param a_xyz: Array (N, 3) of the first vertices of the edges.
+        :param b_xyz: Array (N, 3) of the second vertices.
+        :return: Array (N, n_points, 3)
+        """
+        xy_points = self.edge_points(a_xyz[:, 0:2], b_xyz[:, 0:2], n_points)
+        if len(xy_points) == 0:
+            return np.empty((0, n_points, 3))
+        xyz_points = self.surface_approx.eval_xy_array(xy_points.reshape(-1, 2))
+        return xyz_points.reshape(len(a_xyz), n_points, 3)
+
+
+    def add_curve_to_edge(self, edge, xyz_points=None, curve_xyz=None):
         """
         Make the projection curve for an edge on the surface.
         :param edge: BRepWriter Edge object
+        :param xyz_points: Sample points of the edge on the surface, see eval_edge_points.
+            Evaluated for the single edge if not given.
+        :param curve_xyz: Approximation of the sample points, computed here if not given.
         :return:
         """
         axyz, bxyz = edge.points()
 
-        n_points = 16
-        x_points = np.linspace(axyz[0], bxyz[0], n_points)
-        y_points = np.linspace(axyz[1], bxyz[1], n_points)
-        xy_points = np.stack( (x_points, y_points), axis =1)
-        xyz_points = self.surface_approx.eval_xy_array(xy_points)
-        curve_xyz = bs_approx.curve_from_grid(xyz_points)
+        if curve_xyz is None:
+            if xyz_points is None:
+                xyz_points, = self.eval_edge_points(np.array([axyz]), np.array([bxyz]))
+            curve_xyz, = _fit_edge_curves([xyz_points])
         start, end = curve_xyz.eval_array(np.array([0, 1]))
         check_point_tol( start, axyz, 1e-3)
         check_point_tol( end, bxyz, 1e-3)
@@ -598,6 +734,16 @@ class Interface:
 
 
 
+def _fit_edge_curves(edges_xyz):
+    """
+    Approximation curves of the edges given by their sample points on the surface.
+    Module level function, so it can be used as a task of the process pool.
+    :param edges_xyz: Sequence of arrays (n_points, 3).
+    :return: List of B-spline curves.
+    """
+    return [bs_approx.curve_from_grid(xyz_points) for xyz_points in edges_xyz]
+
+
 class InterfaceNodeSet(gs.InterfaceNodeSet):
 
     def init(self, lg):
@@ -712,7 +858,7 @@ class FractureLayer(gs.FractureLayer):
             reg = self.regions[1][seg.id]
             if reg.is_active(1):
                 for sub_seg_id in obj_maps[1][seg.id]:
-                    self.i_top.edges[sub_seg_id].set_shape(reg.id, self.i_top, self.i_top)
+                    self.i_top.edges[sub_seg_id].set_shape(reg.id, self.i_top, self.i_top, (self.id, 1, seg.index))
 
         for poly in decomp.polygons.values():
             if poly.is_outer_polygon():
@@ -720,7 +866,7 @@ class FractureLayer(gs.FractureLayer):
             reg = self.regions[2][poly.id]
             if reg.is_active(2):
                 for sub_poly_id in obj_maps[2][poly.id]:
-                    self.i_top.faces[sub_poly_id].set_shape(reg.id, self.i_top, self.i_top)
+                    self.i_top.faces[sub_poly_id].set_shape(reg.id, self.i_top, self.i_top, (self.id, 2, poly.index))
         return []
 
 class StratumLayer(gs.StratumLayer):
@@ -876,7 +1022,7 @@ class StratumLayer(gs.StratumLayer):
             vert_edges[id] = edge_info
             reg = self.regions[0][id]
             if reg.is_active(1):
-                edge_info.set_shape( reg.id, self.i_top, self.i_bot)
+                edge_info.set_shape( reg.id, self.i_top, self.i_bot, (self.id, 0, pt.index))
             shapes.append(edge_info)
 
         assert len(vert_edges) == len(self.top.decomp.points) #, "n_vert_edges: %d n_nodes: %d"%(len(vert_edges), self.topology.n_nodes)
@@ -913,7 +1059,7 @@ class StratumLayer(gs.StratumLayer):
             vert_faces[id] = face_info
             reg = self.regions[1][id]
             if reg.is_active(2):
-                face_info.set_shape(reg.id, self.i_top, self.i_bot)
+                face_info.set_shape(reg.id, self.i_top, self.i_bot, (self.id, 1, segment.index))
             shapes.append(face_info)
 
         assert len(vert_faces) == len(self.top.decomp.segments)
@@ -945,7 +1091,7 @@ class StratumLayer(gs.StratumLayer):
             solid_info = ShapeInfo(solid)
             reg = self.regions[2][id]
             if reg.is_active(3):
-                solid_info.set_shape(reg.id, self.i_top, self.i_bot)
+                solid_info.set_shape(reg.id, self.i_top, self.i_bot, (self.id, 2, polygon.index))
             shapes.append(solid_info)
 
         return shapes
@@ -958,6 +1104,9 @@ class LayerGeometry(gs.LayerGeometry):
 
     el_type_to_dim = {15: 0, 1: 1, 2: 2, 4: 3}
 
+    profiler = profiling.NoProfiler()
+    """Profiler of the construction stages, set by construct_geometry."""
+
     """
         - create BREP B-spline approximation from Z-grids (Bapprox)
         - load other surfaces
@@ -982,6 +1131,34 @@ class LayerGeometry(gs.LayerGeometry):
         for i, item in enumerate(xlist):
             item.id = i
 
+    def set_files(self, filename_base, scratch_dir=None, mesh_format="ascii", binary_tmp_mesh=False):
+        """
+        Set names and formats of the output files.
+        :param filename_base: Base of the file names, the final mesh is '<filename_base>.msh'.
+        :param scratch_dir: Directory of the intermediate files (.brep, .tmp.geo, .tmp.msh),
+            next to the final mesh by default. Created if necessary.
+        :param mesh_format: Format of the final mesh: 'ascii', 'binary' (both '.msh') or 'gzip' (ASCII '.msh.gz').
+        :param binary_tmp_mesh: Gmsh writes the binary .tmp.msh file, which is read by a memory map
+            without a copy of the mesh in memory. Not supported by the stream processing of modify_mesh.
+        """
+        assert mesh_format in ["ascii", "binary", "gzip"], "Unknown mesh format: {}".format(mesh_format)
+        self.filename_base = filename_base
+        self.scratch_dir = scratch_dir
+        self.mesh_format = mesh_format
+        self.binary_tmp_mesh = binary_tmp_mesh
+        if scratch_dir is not None:
+            os.makedirs(scratch_dir, exist_ok=True)
+        self.tmp_msh_file = self.intermediate_file(".tmp.msh")
+        self.msh_file = filename_base + (".msh.gz" if mesh_format == "gzip" else ".msh")
+
+    def intermediate_file(self, suffix):
+        """
+        Name of an intermediate file, placed to the scratch directory if set.
+        """
+        if self.scratch_dir is None:
+            return self.filename_base + suffix
+        return os.path.join(self.scratch_dir, os.path.basename(self.filename_base) + suffix)
+
     def init(self):
         # keep unique interface per surface
         self.brep_shapes=[]     # Final shapes in top compound to being meshed.
@@ -1005,9 +1182,10 @@ class LayerGeometry(gs.LayerGeometry):
         # initialize layers, neigboring layers refer to common interface
         for id, layer in enumerate(self.layers):
             layer.id = id
-            layer.init(self)
+            with self.profiler.stage("layer {}".format(id)):
+                layer.init(self)
 
-    def construct_brep_geometry(self):
+    def construct_brep_geometry(self, n_jobs=1):
         """
         Algorithm for creating geometry from Layers:
 
@@ -1040,10 +1218,21 @@ class LayerGeometry(gs.LayerGeometry):
                 for every region:
                     make compoud of subdivision BREP shapes
 
+
+        Curves of the interface edges are approximated by a pool of 'n_jobs' processes if n_jobs > 1.
+        This is the only costly fitting: curves and surfaces of the vertical faces of the layers
+        (make_vert_bw_surface) are closed form, a plane through three points, lines and rescaled poles
+        of the interface curves, so they are made in the main process together with the shapes.
+        BREP shapes are always assembled in the main process in the same order,
+        so the output does not depend on 'n_jobs'.
         """
 
-        for iface in self.interfaces:
-            iface.make_shapes()
+        if n_jobs > 1:
+            self._make_interface_shapes_parallel(n_jobs)
+        else:
+            for i_iface, iface in enumerate(self.interfaces):
+                with self.profiler.stage("interface {}".format(i_iface)):
+                    iface.make_shapes()
 
         self.split_to_blocks()
 
@@ -1055,7 +1244,8 @@ class LayerGeometry(gs.LayerGeometry):
 
         for block in self.blocks:
             for layer in block:
-                self.all_shapes += layer.make_shapes()
+                with self.profiler.stage("layer {}".format(layer.id)):
+                    self.all_shapes += layer.make_shapes()
 
         for i_face in self.interfaces:
             for shp in i_face.iter_shapes():
@@ -1068,13 +1258,42 @@ class LayerGeometry(gs.LayerGeometry):
 
         compound = bw.Compound(free_shapes)
         compound.set_free_shapes()
-        self.brep_file = os.path.abspath(self.filename_base + ".brep")
-        with open(self.brep_file, 'w') as f:
+        self.brep_file = os.path.abspath(self.intermediate_file(".brep"))
+        with self.profiler.stage("write_brep"), open(self.brep_file, 'w') as f:
             bw.write_model(f, compound, bw.Location())
 
+    def _make_interface_shapes_parallel(self, n_jobs):
+        """
+        Make shapes of all interfaces, the edge curves of all interfaces are fitted in a process pool.
+        """
+        with self.profiler.stage("interface decompositions"):
+            edges_xyz = [iface.edge_sample_points() for iface in self.interfaces]
+        all_edges_xyz = [xyz_points for iface_xyz in edges_xyz for xyz_points in iface_xyz]
+        # few chunks per process to balance the load, order of results is kept by map
+        n_chunks = min(len(all_edges_xyz), 4 * n_jobs)
+        chunks = [all_edges_xyz[i::n_chunks] for i in range(n_chunks)]
+        with self.profiler.stage("edge curves (parallel)"), \
+                concurrent.futures.ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            chunk_curves = list(pool.map(_fit_edge_curves, chunks))
+        all_curves = [None] * len(all_edges_xyz)
+        for i, curves in enumerate(chunk_curves):
+            all_curves[i::n_chunks] = curves
+
+        begin = 0
+        for i_iface, (iface, iface_xyz) in enumerate(zip(self.interfaces, edges_xyz)):
+            end = begin + len(iface_xyz)
+            with self.profiler.stage("interface {}".format(i_iface)):
+                iface.make_shapes(all_curves[begin:end])
+            begin = end
+
     def make_gmsh_shape_dict(self):
         """
         Construct a dictionary self.gmsh_shape_dict, mapping the pair (dim, gmsh_object_id) -> shape info object
+        Then collect the data of the gmsh shapes that depend only on the layer objects the shapes are made of,
+        i.e. are independent of the region properties (see rebuild_state):
+        self.n_gmsh_shapes - number of gmsh shapes for every dimension
+        self.free_origins - (dim, gmsh_object_id) -> origin of the free shape
+        self.vertex_origins - gmsh vertex id -> list of origins of the free shapes containing the vertex
         :return:
         """
         # ignore shapes without ID - not part of the output
@@ -1091,77 +1310,127 @@ class LayerGeometry(gs.LayerGeometry):
         for dim, shp_list in enumerate(shape_by_dim):
             for gmsh_shp_id, si in enumerate(shp_list):
                 self.gmsh_shape_dist[(dim, gmsh_shp_id + 1)] = si
+        self.n_gmsh_shapes = [len(shp_list) for shp_list in shape_by_dim]
+        self.free_origins = {key: si.origin for key, si in self.gmsh_shape_dist.items() if si.free}
+        self.vertex_origins = self._vertex_origins()
+        self.physical_tables = self.physical_id_tables()
 
-    def set_free_si_mesh_step(self, si, step):
+    def _vertex_origins(self):
         """
-        Set the mesh step to the free SI (root of local DFS tree).
-        :param si: A free shape info object
-        :param step: Meash step from corresponding region.
-        :return:
+        Pass the origins of the free shapes down to the vertices in a single sweep over all shapes ordered
+        from solids to vertices, every shape passes its origins to its BREP subshapes.
+        :return: gmsh vertex id -> sorted list of origins of the free shapes containing the vertex
+        """
+        shapes = sorted(self.all_shapes, key=lambda si: si.dim(), reverse=True)
+        shape_idx = {id(shp_info.shape): i for i, shp_info in enumerate(shapes)}
+        shape_origins = [{si.origin} if si.free else set() for si in shapes]
+
+        # parents are processed before their subshapes
+        for i, shp_info in enumerate(shapes):
+            if not shape_origins[i]:
+                continue
+            for i_sub in self._brep_subshapes(shp_info.shape, shape_idx):
+                shape_origins[i_sub].update(shape_origins[i])
+
+        vertex_origins = {}
+        for (dim, gmsh_shp_id), si in self.gmsh_shape_dist.items():
+            if dim == 0:
+                origins = shape_origins[shape_idx[id(si.shape)]]
+                if origins:
+                    vertex_origins[gmsh_shp_id] = sorted(origins)
+        return vertex_origins
+
+    @staticmethod
+    def _brep_subshapes(shape, shape_idx):
+        """
+        Indices of the direct BREP subshapes (Vertex, Edge, Face, Solid) of the shape,
+        looking through the auxiliary shapes (Wire, Shell, ...).
+        """
+        subshapes = []
+        stack = list(shape.subshapes())
+        while stack:
+            sub = stack.pop(-1)
+            if isinstance(sub, (bw.Vertex, bw.Edge, bw.Face, bw.Solid)):
+                subshapes.append(shape_idx[id(sub)])
+            else:
+                stack.extend(sub.subshapes())
+        return subshapes
+
+    def region_of(self, origin):
+        """
+        Region of the layer object given by the origin (layer id, topology dim, object index).
         """
-        if step <= 0.0:
-            step = self.global_mesh_step
-        self.min_step = min(self.min_step, step)
-        self.max_step = max(self.max_step, step)
-        si.mesh_step = step
+        layer_id, topo_dim, index = origin
+        layer = self.layers[layer_id]
+        region_ids = [layer.node_region_ids, layer.segment_region_ids, layer.polygon_region_ids][topo_dim]
+        return self.regions[region_ids[index]]
+
+    def init_regions(self):
+        """
+        Initialize the regions used by the layers, without the initialization of the layers
+        (see make_geometry_incremental).
+        """
+        self.set_ids(self.regions)
+        for layer in self.layers:
+            extrude = isinstance(layer, StratumLayer)
+            region_id_lists = [layer.node_region_ids, layer.segment_region_ids, layer.polygon_region_ids]
+            for topo_dim, region_ids in enumerate(region_id_lists):
+                for i_reg in sorted(set(region_ids)):
+                    self.regions[i_reg].init(topo_dim=topo_dim, extrude=extrude)
 
-    def distribute_mesh_step(self):
+    def distribute_mesh_step(self, mesh_step=0.0):
         """
-        For every free shape:
-         1. get the mesh step from the region
-         2. pass down through its tree using DFS
-         3. set the mesh_step  to all child vertices, take minimum of exisiting and new mesh_step
+        For every free shape get the mesh step from the region, the global mesh step
+        is used for regions without a mesh step. Every vertex gets the minimum mesh_step
+        of the free shapes containing it (see make_gmsh_shape_dict), the global mesh step if there is none.
+        Per region statistics of the resulting vertex mesh steps are stored in self.mesh_step_stats.
+        Can be called repeatedly with different global mesh steps.
+        :param mesh_step: The global mesh step, estimated from the bounding box if zero.
         :return:
         """
         print("distribute mesh\n")
         self.compute_bounding_box()
-        self.global_mesh_step = self.mesh_step_estimate()
-
-        # prepare map from shapes to their shape info objs
-        # initialize mesh_step of individual shape infos
-        shape_dict = {}
-        for shp_info in self.all_shapes:
-            shape_dict[shp_info.shape] = shp_info
-            shp_info.mesh_step = np.inf
-            shp_info.visited = -1
-
-        # Propagate mesh_step from the free_shapes to vertices via DFS
-        # use global mesh step if the local mesh_step is zero.
-        for i_free, shp_info in enumerate(self.free_shapes):
-            self.set_free_si_mesh_step(shp_info, self.regions[shp_info.i_reg].mesh_step)
-            shape_dict[shp_info.shape].visited = i_free
-            stack = [shp_info.shape]
-            while stack:
-
-                shp = stack.pop(-1)
-                #print("shp: {} id: {}\n".format(type(shp), shp.id))
-                for sub in shp.subshapes():
-                    if isinstance(sub, (bw.Vertex, bw.Edge, bw.Face, bw.Solid)):
-                        if shape_dict[sub].visited < i_free:
-                            shape_dict[sub].visited = i_free
-                            stack.append(sub)
-                    else:
+        self.set_mesh_steps(mesh_step)
 
-                        stack.append(sub)
-                if isinstance(shp, bw.Vertex):
-                    shape_dict[shp].mesh_step = min(shape_dict[shp].mesh_step, shp_info.mesh_step)
+    def set_mesh_steps(self, mesh_step=0.0):
+        """
+        Set self.vtx_char_length, self.min_step, self.max_step, see distribute_mesh_step.
+        Uses only self.aabb, self.free_origins and self.vertex_origins, so it is applicable also
+        to the geometry restored from the rebuild state without the BREP shapes.
+        """
+        self.global_mesh_step = mesh_step if mesh_step > 0.0 else self.mesh_step_estimate()
+        region_steps = [reg.mesh_step if reg.mesh_step > 0.0 else self.global_mesh_step for reg in self.regions]
+        free_steps = [region_steps[self.region_of(origin).id] for origin in self.free_origins.values()]
+        self.min_step = min(free_steps, default=np.inf)
+        self.max_step = max(free_steps, default=0)
 
         self.min_step *= 0.2
         self.vtx_char_length = []
-        for (dim, gmsh_shp_id), si in self.gmsh_shape_dist.items():
-            if dim == 0:
-                mesh_step = si.mesh_step
-                if mesh_step == np.inf:
-                    mesh_step = self.global_mesh_step
-                self.vtx_char_length.append((gmsh_shp_id, mesh_step))
-
-
-
-            # debug listing
-            # xx=[ (k, v.shape.id) for k, v in self.shape_dict.items()]
-            # xx.sort(key=lambda x: x[0])
-            # for i in xx:
-            #    print(i[0][0], i[0][1], i[1])
+        region_vertex_steps = {}
+        for gmsh_shp_id in range(1, self.n_gmsh_shapes[0] + 1):
+            vtx_regions = {self.region_of(origin).id for origin in self.vertex_origins.get(gmsh_shp_id, [])}
+            mesh_step = min([region_steps[i_reg] for i_reg in vtx_regions], default=self.global_mesh_step)
+            self.vtx_char_length.append((gmsh_shp_id, mesh_step))
+            for i_reg in vtx_regions:
+                region_vertex_steps.setdefault(i_reg, []).append(mesh_step)
+        self.mesh_step_stats = self.region_mesh_step_stats(region_vertex_steps)
+
+    def region_mesh_step_stats(self, region_steps):
+        """
+        Print and return statistics of the mesh steps of the vertices of the regions.
+        :param region_steps: i_reg -> list of the mesh steps of the vertices of the region's free shapes
+        :return: region name -> dict(mesh_step, n_vertices, min, max, mean)
+        """
+        stats = {}
+        print("{:<24} {:>12} {:>10} {:>12} {:>12} {:>12}".format("region", "mesh_step", "n_vtx", "min", "max", "mean"))
+        for i_reg, steps in sorted(region_steps.items()):
+            region = self.regions[i_reg]
+            steps = np.array(steps)
+            stats[region.name] = dict(mesh_step=region.mesh_step, n_vertices=len(steps),
+                                      min=float(np.min(steps)), max=float(np.max(steps)), mean=float(np.mean(steps)))
+            print("{:<24} {:>12.4g} {:>10} {:>12.4g} {:>12.4g} {:>12.4g}".format(
+                region.name, region.mesh_step, len(steps), np.min(steps), np.max(steps), np.mean(steps)))
+        return stats
 
     def split_to_blocks(self):
         blocks=[]
@@ -1198,15 +1467,32 @@ class LayerGeometry(gs.LayerGeometry):
         print("Char length: {} mesh step: {}", char_length, mesh_step)
         return mesh_step
 
-    def call_gmsh(self, mesh_step):
+    def gmsh_rand_factor(self):
+        # rand_factor has to be increased when the triangle/model ratio
+        # multiplied by rand_factor approaches 'machine accuracy'
+        return 1e-14 * np.max(self.aabb[1] - self.aabb[0]) / self.min_step
+
+    def call_gmsh(self, mesh_step, backend="subprocess", progress=None):
         """
         :param mesh_step:
+        :param backend: 'subprocess' (default) - write the .tmp.geo file and run the gmsh executable, the mesh
+            is written to the .tmp.msh file; 'api' - mesh in process through the gmsh Python module, the mesh is
+            kept in self.gmsh_mesh and no .tmp.geo and .tmp.msh files are written; 'auto' - 'api' if the gmsh
+            module is available.
+        :param progress: Optional function called with every line of the gmsh output as it is produced.
         :return: (stdout, stderr)
         Raise ExcGMSHCall if the call fails.
         """
         if mesh_step == 0.0:
             mesh_step = self.mesh_step_estimate()
-        self.geo_file = self.filename_base + ".tmp.geo"
+        self.gmsh_mesh = None
+        if backend == "auto":
+            backend = "subprocess" if gmsh is None else "api"
+        if backend == "api":
+            return self._call_gmsh_api(progress)
+        assert backend == "subprocess", "Unknown gmsh backend: {}".format(backend)
+
+        self.geo_file = self.intermediate_file(".tmp.geo")
         with open(self.geo_file, "w") as f:
             print(r'SetFactory("OpenCASCADE");', file=f)
             # print(r'Mesh.Algorithm = 2;', file=f)
@@ -1254,110 +1540,315 @@ class LayerGeometry(gs.LayerGeometry):
             # rand_factor has to be increased when the triangle/model ratio
             # multiplied by rand_factor approaches 'machine accuracy'
 
-            rand_factor = 1e-14 * np.max(self.aabb[1] - self.aabb[0]) / self.min_step
+            rand_factor = self.gmsh_rand_factor()
             print(r'Mesh.RandomFactor = %s;'%rand_factor , file=f)
+            if self.binary_tmp_mesh:
+                print(r'Mesh.MshFileVersion = 2.2;', file=f)
+                print(r'Mesh.Binary = 1;', file=f)
             print(r'ShapeFromFile("%s")' % self.brep_file, file=f)
 
             for id, char_length in self.vtx_char_length:
                 print(r'Characteristic Length {%s} = %s;' % (id, char_length), file=f)
 
-                gmsh_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "../gmsh/gmsh.exe")
+        gmsh_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "../gmsh/gmsh.exe")
         if not os.path.exists(gmsh_path):
             gmsh_path = "gmsh"
 
-        process = subprocess.run([gmsh_path, "-3", self.geo_file], stderr=subprocess.PIPE, stdout=subprocess.PIPE)
-        stderr = process.stderr.decode('ascii')
-        stdout = process.stdout.decode('ascii')
-        if process.returncode != 0:
+        if progress is None:
+            process = subprocess.run([gmsh_path, "-3", self.geo_file, "-o", self.tmp_msh_file], stderr=subprocess.PIPE, stdout=subprocess.PIPE)
+            stderr = process.stderr.decode('ascii')
+            stdout = process.stdout.decode('ascii')
+            returncode = process.returncode
+        else:
+            process = subprocess.Popen([gmsh_path, "-3", self.geo_file, "-o", self.tmp_msh_file], stderr=subprocess.PIPE, stdout=subprocess.PIPE)
+            # read stderr concurrently, to not block the process on the full pipe
+            stderr_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+            stderr_future = stderr_pool.submit(process.stderr.read)
+            stdout_lines = []
+            for line in process.stdout:
+                line = line.decode('ascii')
+                stdout_lines.append(line)
+                progress(line.rstrip())
+            stderr = stderr_future.result().decode('ascii')
+            stderr_pool.shutdown()
+            stdout = "".join(stdout_lines)
+            returncode = process.wait()
+        if returncode != 0:
             raise ExcGMSHCall(stdout, stderr)
         return (stdout, stderr)
 
-
-    def deform_mesh(self):
+    def _call_gmsh_api(self, progress):
+        """
+        Mesh the BREP file by the gmsh Python API, same settings as in the .tmp.geo file of call_gmsh.
+        Nodes and elements are pulled directly into self.gmsh_mesh (gmsh_io.GmshIO),
+        elements are tagged by the elementary (shape) tag as in the MSH file.
+        The mesh is generated by dimensions, the gmsh log is passed to 'progress' after every dimension.
+        :return: (log, "")
+        """
+        log = []
+
+        def flush_log():
+            messages = gmsh.logger.get()
+            gmsh.logger.stop()
+            gmsh.logger.start()
+            for line in messages:
+                log.append(line)
+                if progress is not None:
+                    progress(line)
+
+        gmsh.initialize()
+        try:
+            gmsh.option.setNumber("General.Terminal", 0)
+            gmsh.logger.start()
+            gmsh.model.add(os.path.basename(self.filename_base) or "geometry")
+            gmsh.option.setNumber("Mesh.CharacteristicLengthMin", self.min_step)
+            gmsh.option.setNumber("Mesh.CharacteristicLengthMax", self.max_step)
+            gmsh.option.setNumber("Mesh.RandomFactor", self.gmsh_rand_factor())
+            gmsh.model.occ.importShapes(self.brep_file)
+            gmsh.model.occ.synchronize()
+            for id, char_length in self.vtx_char_length:
+                gmsh.model.mesh.setSize([(0, id)], char_length)
+            for dim in range(1, 4):
+                gmsh.model.mesh.generate(dim)
+                flush_log()
+
+            mesh = gmsh_io.GmshIO()
+            node_ids, node_xyz, _ = gmsh.model.mesh.getNodes()
+            mesh.set_nodes(node_ids, np.asarray(node_xyz).reshape(-1, 3))
+            blocks = []
+            for dim, shape_tag in gmsh.model.getEntities():
+                el_types, el_ids, el_nodes = gmsh.model.mesh.getElements(dim, shape_tag)
+                for el_type, ids, nodes in zip(el_types, el_ids, el_nodes):
+                    if len(ids) == 0:
+                        continue
+                    tags = np.zeros((len(ids), 2), dtype=int)
+                    tags[:, 1] = shape_tag
+                    blocks.append(gmsh_io.ElementBlock(el_type, ids, tags, np.asarray(nodes).reshape(len(ids), -1)))
+            mesh.set_element_blocks(blocks)
+            self.gmsh_mesh = mesh
+            flush_log()
+        except Exception as e:
+            flush_log()
+            raise ExcGMSHCall("\n".join(log), str(e))
+        finally:
+            gmsh.logger.stop()
+            gmsh.finalize()
+        return ("\n".join(log), "")
+
+
+    def deform_mesh(self, algorithm=1):
         """
         In fact three different algorithms are necessary:
         I. Modification of extruded mesh, surfaces are horizontal planes.
         II. Small modification of curved mesh, modify just surface nodes and possibly
             small number of neighbouring elements.
         III. Big modification o curved mesh, need to evaluate discrete surface. Line/triangle intersection, need BIH.
+
+        Algorithms I and III are implemented, see mesh_deform. For I. the geometry must be constructed
+        with flat interfaces at their elevations (self.flat_mesh = True).
+        Nodes of elements of every free shape are mapped linearly between the reference positions
+        of its bottom and top interface to the true surfaces. Nodes shared by several elements
+        are moved by the mean shift.
+        :param algorithm: 1 or 3
         :return:
         """
-        # The I. algorithm:
-        # new empty nodes list
-        # go through volume elements; every volume region should have reference to its top and bot interface;
-        # move nodes of volume element
-
-        assert False, "Mesh deformation code must be revisited."
-
-        nodes_shift = { id: [] for id, el in self.mesh.nodes.items()}
-        for id, elm in self.mesh.elements.items():
-            el_type, tags, nodes = elm
-            if len(tags) < 2:
-                raise Exception("Less then 2 tags.")
-            dim = self.el_type_to_dim[el_type]
-            shape_id = tags[1]
-            shape_info = self.shape_dict[ (dim, shape_id) ]
-            if not shape_info.free:
-                continue
-            for i_node in nodes:
-                x,y,z = self.mesh.nodes[i_node]
-                top_ref_z = shape_info.top_iface.surface.depth
-                top_z = shape_info.top_iface.surface.eval_z(x,y)
-                bot_ref_z = shape_info.bot_iface.surface.depth
-                bot_z = shape_info.bot_iface.surface.eval_z(x, y)
-                assert bot_ref_z >= z and z >= top_ref_z, "{} >= {} >= {}".format(bot_ref_z, z, top_ref_z)
-                if shape_info.top_iface.surface.id == shape_info.bot_iface.surface.id:
-                    z_shift = top_z - z
-                else:
-                    t = (z - bot_ref_z) / (top_ref_z - bot_ref_z)
-                    z_shift = (1 - t) * bot_z + t * top_z - z
-                nodes_shift[i_node].append( z_shift )
-
-        for id, shift_list in nodes_shift.items():
-            assert len(shift_list) != 0, "Node: {}".format(id)
-            mean_shift = sum(shift_list) / float(len(shift_list))
-            assert sum([ math.fabs(x - mean_shift) for x in shift_list]) / float(len(shift_list)) < math.fabs(mean_shift)/100.0,\
-                "{} List: {}".format(id, shift_list)
-            self.mesh.nodes[id][2] += mean_shift
-
-    def modify_mesh(self):
-        self.tmp_msh_file = self.filename_base + ".tmp.msh"
-        self.mesh = gmsh_io.GmshIO()
-        with open(self.tmp_msh_file, "r") as f:
-            self.mesh.read(f)
-
-        # deform mesh, nontrivial evaluation of Z for the interface mesh
-        #self.deform_mesh()
-
-
-        new_elements = {}
-        for id, elm in self.mesh.elements.items():
-            el_type, tags, nodes = elm
-            if len(tags) < 2:
-                raise Exception("Less then 2 tags.")
-            dim = self.el_type_to_dim[el_type]
-            shape_id = tags[1]
-            shape_info = self.gmsh_shape_dist[ (dim, shape_id)]
+        assert algorithm in (1, 3), "Unsupported mesh deformation algorithm: {}".format(algorithm)
+        iface_idx = {id(iface): i for i, iface in enumerate(self.interfaces)}
+
+        # (dim, gmsh_shape_id) -> index of the top and bottom interface, -1 for non-free shapes
+        max_shape_id = [0, 0, 0, 0]
+        for dim, shape_id in self.gmsh_shape_dist.keys():
+            max_shape_id[dim] = max(max_shape_id[dim], shape_id)
+        top_tables = [np.full(max_id + 1, -1, dtype=int) for max_id in max_shape_id]
+        bot_tables = [np.full(max_id + 1, -1, dtype=int) for max_id in max_shape_id]
+        for (dim, shape_id), shape_info in self.gmsh_shape_dist.items():
+            if shape_info.free:
+                top_tables[dim][shape_id] = iface_idx[id(shape_info.top_iface)]
+                bot_tables[dim][shape_id] = iface_idx[id(shape_info.bot_iface)]
+
+        mesh = self.mesh
+        sorted_nodes = mesh_deform.sort_node_ids(mesh.node_ids)
+        rows, top, bot = [], [], []
+        for block in mesh.element_blocks:
+            dim = self.el_type_to_dim[block.el_type]
+            shape_ids = block.tags[:, 1]
+            block_top, block_bot = top_tables[dim][shape_ids], bot_tables[dim][shape_ids]
+            free = block_top >= 0
+            n_nodes = block.nodes.shape[1]
+            rows.append(mesh_deform.node_rows(mesh.node_ids, block.nodes[free], sorted_nodes).reshape(-1))
+            top.append(np.repeat(block_top[free], n_nodes))
+            bot.append(np.repeat(block_bot[free], n_nodes))
+        rows, top, bot = [np.concatenate(a + [np.empty(0, dtype=int)]) for a in (rows, top, bot)]
+
+        if algorithm == 1:
+            ref_z = [(lambda xy, z=iface.elevation: np.full(len(xy), z)) for iface in self.interfaces]
+        else:
+            ref_z = [surface.eval_z for surface in self.mesh_interface_surfaces()]
+        target_z = [iface.target_eval_z_array for iface in self.interfaces]
+        mesh.writable_node_xyz()[:, 2] = mesh_deform.deform_z(mesh.node_xyz, rows, top, bot, ref_z, target_z)
 
-            if not shape_info.free:
+    def mesh_interface_surfaces(self):
+        """
+        Discrete surfaces formed by the mesh triangles on the faces of the interfaces.
+        :return: List of mesh_deform.DiscreteSurface, one per interface.
+        """
+        face_iface = {}
+        for i, iface in enumerate(self.interfaces):
+            for face_info in iface.faces.values():
+                face_iface[id(face_info)] = i
+        triangle_iface = np.full(max([0] + [shape_id for dim, shape_id in self.gmsh_shape_dist.keys() if dim == 2]) + 1,
+                                 -1, dtype=int)
+        for (dim, shape_id), shape_info in self.gmsh_shape_dist.items():
+            if dim == 2:
+                triangle_iface[shape_id] = face_iface.get(id(shape_info), -1)
+
+        mesh = self.mesh
+        sorted_nodes = mesh_deform.sort_node_ids(mesh.node_ids)
+        triangles = [[] for iface in self.interfaces]
+        for block in mesh.element_blocks:
+            if self.el_type_to_dim[block.el_type] != 2:
                 continue
-            region = self.regions[shape_info.i_reg]
+            block_iface = triangle_iface[block.tags[:, 1]]
+            for i in np.unique(block_iface[block_iface >= 0]).tolist():
+                rows = mesh_deform.node_rows(mesh.node_ids, block.nodes[block_iface == i], sorted_nodes)
+                triangles[i].append(mesh.node_xyz[rows])
+        return [mesh_deform.DiscreteSurface(np.concatenate(tri_list + [np.empty((0, 3, 3))]))
+                for tri_list in triangles]
+
+    def physical_id_tables(self):
+        """
+        Lookup tables of the physical IDs of the meshed shapes, used to tag the mesh elements.
+        :return: tables[dim][gmsh_shape_id] -> physical id (region index + 10000),
+        -1 for shapes that are not written to the final mesh, -2 for unknown shapes.
+        """
+        tables = [np.full(n_shapes + 1, -1, dtype=int) for n_shapes in self.n_gmsh_shapes]
+        for table in tables:
+            table[0] = -2
+        for (dim, shape_id), origin in self.free_origins.items():
+            region = self.region_of(origin)
             if not region.is_active(dim):
                 continue
             assert region.dim == dim
-            physical_id = shape_info.i_reg + 10000
-            if region.name in self.mesh.physical:
-                assert self.mesh.physical[region.name][0] == physical_id
+            tables[dim][shape_id] = region.id + 10000
+        return tables
+
+    def tag_element_block(self, block, tables, physical):
+        """
+        Set physical IDs of the elements in the block, drop elements of shapes that are not written.
+        :param block: gmsh_io.ElementBlock
+        :param tables: Result of physical_id_tables.
+        :param physical: Dict of physical names, regions of the block are added.
+        :return: New element block.
+        """
+        if block.tags.shape[1] < 2:
+            raise Exception("Less then 2 tags.")
+        dim = self.el_type_to_dim[block.el_type]
+        table = tables[dim]
+        shape_ids = block.tags[:, 1]
+        if np.any(shape_ids >= len(table)) or np.any(table[np.minimum(shape_ids, len(table) - 1)] == -2):
+            raise KeyError("Unknown shape of dim {} in the mesh.".format(dim))
+        physical_ids = table[shape_ids]
+        keep = physical_ids >= 0
+        for physical_id in np.unique(physical_ids[keep]).tolist():
+            region = self.regions[physical_id - 10000]
+            if region.name in physical:
+                assert physical[region.name][0] == physical_id
             else:
-                self.mesh.physical[region.name] = (physical_id, dim)
-            tags[0] = physical_id
-            new_elements[id] = (el_type, tags, nodes)
-        self.mesh.elements = new_elements
-        self.msh_file = self.filename_base + ".msh"
-        with open(self.msh_file, "w") as f:
-            self.mesh.write_ascii(f)
+                physical[region.name] = (physical_id, dim)
+        new_block = gmsh_io.ElementBlock(block.el_type, block.ids[keep], block.tags[keep], block.nodes[keep])
+        new_block.tags[:, 0] = physical_ids[keep]
+        return new_block
+
+    def modify_mesh(self, stream=False, chunk_size=100000, deform=None, stats=False):
+        """
+        Tag elements of the GMSH mesh by physical IDs of the regions, remove elements of non-free shapes
+        and inactive regions. Write the result to the final mesh file.
+        The mesh produced by the gmsh API (self.gmsh_mesh, see call_gmsh) is used if present, otherwise
+        the mesh is read from the .tmp.msh file.
+        :param stream: Process the elements of the .tmp.msh file chunk by chunk, without reading the mesh
+        into memory. Then the mesh is not kept and None is returned, the number of elements of the final mesh
+        is stored in self.final_n_elements.
+        :param chunk_size: Number of elements in one chunk of the stream.
+        :param deform: Mesh deformation algorithm (1 or 3), see deform_mesh. No deformation by default.
+        :param stats: Write statistics of the final mesh, see mesh_statistics. With 'stream' the final mesh
+        file is read back into memory for the statistics.
+        :return: The final mesh, gmsh_io.GmshIO.
+        """
+        tables = self.physical_tables
+        gmsh_mesh = getattr(self, 'gmsh_mesh', None)
+        if stream and gmsh_mesh is None:
+            assert deform is None, "Mesh deformation needs the whole mesh in memory."
+            assert self.mesh_format != "binary", "Stream processing writes just ASCII mesh files."
+            self.mesh = None
+            physical = {}
+            physical, self.final_n_elements = gmsh_io.modify_elements_stream(
+                self.tmp_msh_file, self.msh_file, lambda block: self.tag_element_block(block, tables, physical),
+                physical=physical, chunk_size=chunk_size)
+            if stats:
+                self.mesh_statistics()
+            return self.mesh
+
+        if gmsh_mesh is None:
+            self.mesh = gmsh_io.GmshIO(self.tmp_msh_file)
+        else:
+            self.mesh = gmsh_mesh
+            self.gmsh_mesh = None
+
+        # deform mesh, nontrivial evaluation of Z for the interface mesh
+        if deform is not None:
+            self.deform_mesh(deform)
+
+        new_blocks = [self.tag_element_block(block, tables, self.mesh.physical)
+                      for block in self.mesh.element_blocks]
+        self.mesh.set_element_blocks(new_blocks)
+        self.write_mesh(self.mesh)
+        if stats:
+            self.mesh_statistics()
         return self.mesh
 
+    def write_mesh(self, mesh, msh_file=None, mesh_format=None):
+        """
+        Write the mesh in the format given by set_files.
+        """
+        msh_file = msh_file or self.msh_file
+        mesh_format = mesh_format or self.mesh_format
+        if mesh_format == "binary":
+            mesh.write_binary(msh_file)
+        else:
+            with gmsh_io.replace_mesh_file(msh_file, "wt") as f:
+                mesh.write_ascii(f)
+
+    def mesh_statistics(self):
+        """
+        Compute statistics of the final mesh (see mesh_stats) and write them to '<base>.stats.json'.
+        The whole mesh file is read if the mesh is not kept in memory (stream processing),
+        so the statistics need the memory of the mesh also for the stream processing.
+        :return: Dict of the statistics.
+        """
+        mesh = self.mesh
+        if mesh is None:
+            mesh = gmsh_io.GmshIO(self.msh_file)
+        self.final_mesh_stats = mesh_stats.mesh_statistics(mesh)
+        stats_file = mesh_stats.write_statistics(self.final_mesh_stats, self.msh_file)
+        mesh_stats.print_statistics(self.final_mesh_stats)
+        print("Mesh statistics: {}".format(stats_file))
+        return self.final_mesh_stats
+
+
+    def mesh_job(self, filename_base):
+        """
+        Copy of the geometry with just the data necessary for call_gmsh and modify_mesh, for meshing
+        of the constructed BREP geometry in other process. Call after distribute_mesh_step.
+        :param filename_base: Base of the output files of the job.
+        :return: LayerGeometry
+        """
+        job = LayerGeometry.__new__(LayerGeometry)
+        for attr in ['regions', 'brep_file', 'aabb', 'min_step', 'max_step', 'global_mesh_step',
+                     'vtx_char_length', 'physical_tables']:
+            job.__dict__[attr] = copy.copy(self.__dict__[attr])
+        job.set_files(filename_base, self.scratch_dir, self.mesh_format, self.binary_tmp_mesh)
+        return job
+
 
     # def mesh_export(self, mesh, filename):
     #     """ export Netgen mesh to neutral format """
@@ -1424,6 +1915,48 @@ def construct_derived_geometry(gs_obj):
     return geo_obj
 
 
+def _file_options(kwargs):
+    return dict(scratch_dir=kwargs.get("scratch_dir", None), mesh_format=kwargs.get("mesh_format", "ascii"),
+                binary_tmp_mesh=kwargs.get("binary_tmp_mesh", False))
+
+
+def construct_geometry(**kwargs):
+    """
+    Read geometry from file or use provided gs.LayerGeometry object.
+    Construct the BREP geometry and the map of the gmsh shapes, see make_geometry for the keywords.
+    Stages are recorded by the optional 'profiler' keyword, see profiling.Profiler.
+    :return: LayerGeometry
+    """
+    raw_geometry = kwargs.get("geometry", None)
+    layers_file = kwargs.get("layers_file", None)
+    filename_base = "" if layers_file is None else os.path.splitext(layers_file)[0]
+    cache_dir = kwargs.get("cache_dir", None)
+    n_jobs = kwargs.get("n_jobs", 1)
+    deform = kwargs.get("deform", None)
+    profiler = kwargs.get("profiler", None) or profiling.NoProfiler()
+
+    if raw_geometry is None:
+        with profiler.stage("read_layers"):
+            raw_geometry = layers_io.read_geometry(layers_file)
+    with profiler.stage("construct_derived_geometry"):
+        lg = construct_derived_geometry(raw_geometry)
+    lg.profiler = profiler
+    lg.set_files(filename_base, **_file_options(kwargs))
+    lg.decomp_cache = None if cache_dir is None else decomp_cache.DecompCache(cache_dir)
+    lg.flat_mesh = (deform == 1)
+
+    with profiler.stage("init"):
+        lg.init()   # initialize the tree with ids and references where necessary
+
+    with profiler.stage("construct_brep_geometry"):
+        lg.construct_brep_geometry(n_jobs)
+    if lg.decomp_cache is not None:
+        print(lg.decomp_cache.report())
+    with profiler.stage("make_gmsh_shape_dict"):
+        lg.make_gmsh_shape_dict()
+    return lg
+
+
 def make_geometry(**kwargs):
     """
     TODO: Have LayerGeometry as a class for building geometry, manipulating geometry and meshing.
@@ -1432,32 +1965,164 @@ def make_geometry(**kwargs):
     Read geometry from file or use provided gs.LayerGeometry object.
     Construct the BREP geometry, call gmsh, postprocess mesh.
     Write: geo file, brep file, tmp.msh file, msh file
+    Optional 'cache_dir' keyword enables the on-disk cache of interface decompositions (see decomp_cache).
+    Optional 'n_jobs' keyword sets number of processes used to fit the curves of the interface edges,
+    see LayerGeometry.construct_brep_geometry.
+    Optional 'stream_mesh' keyword enables processing of the GMSH mesh without reading it into memory.
+    Optional 'deform' keyword selects the mesh deformation algorithm (see LayerGeometry.deform_mesh),
+    for the algorithm 1 the flat geometry is meshed.
+    Optional 'gmsh_backend' and 'progress' keywords are passed to LayerGeometry.call_gmsh,
+    the .tmp.geo and .tmp.msh files are not written by the 'api' backend.
+    Optional 'incremental' keyword enables reuse of the previous results, see make_geometry_incremental.
+    Optional 'mesh_stats' keyword writes statistics of the final mesh, see LayerGeometry.mesh_statistics.
+    Optional 'scratch_dir', 'mesh_format' and 'binary_tmp_mesh' keywords set the output files,
+    see LayerGeometry.set_files.
+    Optional 'profile_report' keyword is the name of the JSON report of the stages (time, memory, objects),
+    'cprofile_stage' selects a stage to run under cProfile, see profiling.Profiler.
     """
-    raw_geometry = kwargs.get("geometry", None)
-    layers_file = kwargs.get("layers_file", None)
-    filename_base = ""
+    if kwargs.get("incremental", False):
+        return make_geometry_incremental(**kwargs)
     mesh_step = kwargs.get("mesh_step", 0.0)
+    stream_mesh = kwargs.get("stream_mesh", False)
+    deform = kwargs.get("deform", None)
+    gmsh_backend = kwargs.get("gmsh_backend", "subprocess")
+    progress = kwargs.get("progress", None)
+    stats = kwargs.get("mesh_stats", False)
+    profiler = _make_profiler(kwargs)
 
-    if raw_geometry is None:
-        raw_geometry = layers_io.read_geometry(layers_file)
-        filename_base = os.path.splitext(layers_file)[0]
-    lg = construct_derived_geometry(raw_geometry)
-    lg.filename_base = filename_base
-
-    lg.init()   # initialize the tree with ids and references where necessary
-
-    lg.construct_brep_geometry()
-    lg.make_gmsh_shape_dict()
-    lg.distribute_mesh_step()
+    lg = construct_geometry(**dict(kwargs, profiler=profiler))
+    with profiler.stage("distribute_mesh_step"):
+        lg.distribute_mesh_step(mesh_step)
 
     #geom.mesh_netgen()
     #geom.netgen_to_gmsh()
 
-    lg.call_gmsh(mesh_step)
-    lg.modify_mesh()
+    with profiler.stage("call_gmsh"):
+        lg.call_gmsh(mesh_step, backend=gmsh_backend, progress=progress)
+    with profiler.stage("modify_mesh"):
+        lg.modify_mesh(stream=stream_mesh, deform=deform, stats=stats)
+
+    _write_profile(profiler, kwargs)
+    return lg
+
+
+def _make_profiler(kwargs):
+    """
+    Profiler of the stages for the 'profile_report' and 'cprofile_stage' keywords of make_geometry.
+    """
+    if kwargs.get("profile_report", None) is None:
+        return profiling.NoProfiler()
+    return profiling.Profiler(cprofile_stage=kwargs.get("cprofile_stage", None))
+
+
+def _write_profile(profiler, kwargs):
+    profile_report = kwargs.get("profile_report", None)
+    if profile_report is not None:
+        profiler.print_report()
+        profiler.write_report(profile_report)
+        print("Profile report: {}".format(profile_report))
+
+
+def make_geometry_incremental(**kwargs):
+    """
+    make_geometry reusing the results of the previous run for the same layers file, see rebuild_state:
+    - the BREP construction is skipped if only the region properties changed,
+    - also gmsh is skipped if the characteristic lengths are the same, then just the elements are tagged again.
+    Keywords are the same as for make_geometry, 'layers_file' is obligatory, mesh deformation is not supported.
+    The 'profile_report' contains only the stages actually performed.
+    """
+    assert kwargs.get("deform", None) is None, "Mesh deformation is not supported by the incremental rebuild."
+    layers_file = kwargs["layers_file"]
+    mesh_step = kwargs.get("mesh_step", 0.0)
+    stream_mesh = kwargs.get("stream_mesh", False)
+    gmsh_backend = kwargs.get("gmsh_backend", "subprocess")
+    progress = kwargs.get("progress", None)
+    stats = kwargs.get("mesh_stats", False)
+    profiler = _make_profiler(kwargs)
+
+    with profiler.stage("read_layers"):
+        raw_geometry = layers_io.read_geometry(layers_file)
+    filename_base = os.path.splitext(layers_file)[0]
+    state_file = filename_base + ".state.pickle"
+    with profiler.stage("load_state"):
+        brep_key = rebuild_state.brep_key(raw_geometry)
+        state = rebuild_state.RebuildState.load(state_file)
+
+    if state is None or not state.is_valid(brep_key):
+        lg = construct_geometry(**dict(kwargs, geometry=raw_geometry, profiler=profiler))
+        with profiler.stage("distribute_mesh_step"):
+            lg.distribute_mesh_step(mesh_step)
+        run_gmsh = True
+    else:
+        print("Reusing BREP geometry: {}".format(state.brep_file))
+        with profiler.stage("restore_state"):
+            lg = construct_derived_geometry(raw_geometry)
+            lg.profiler = profiler
+            lg.set_files(filename_base, **_file_options(kwargs))
+            lg.init_regions()
+            state.restore(lg)
+            lg.physical_tables = lg.physical_id_tables()
+            lg.set_mesh_steps(mesh_step)
+        run_gmsh = rebuild_state.mesh_key(lg) != state.mesh_key or not os.path.isfile(lg.tmp_msh_file)
+
+    if run_gmsh:
+        with profiler.stage("call_gmsh"):
+            lg.call_gmsh(mesh_step, backend=gmsh_backend, progress=progress)
+            if lg.gmsh_mesh is not None:
+                # keep the raw mesh for the next run
+                lg.write_mesh(lg.gmsh_mesh, lg.tmp_msh_file, "binary" if lg.binary_tmp_mesh else "ascii")
+        rebuild_state.RebuildState(brep_key, lg).save(state_file)
+    else:
+        print("Reusing mesh: {}".format(lg.tmp_msh_file))
+    with profiler.stage("modify_mesh"):
+        lg.modify_mesh(stream=stream_mesh, stats=stats)
+    _write_profile(profiler, kwargs)
     return lg
 
 
+def _mesh_sweep_step(job, mesh_step, gmsh_backend, stream_mesh):
+    """
+    Mesh one step of the sweep, see make_geometry_sweep. Executed in a process of the pool.
+    :return: (msh_file, n_elements, wall_time)
+    """
+    start = time.time()
+    job.call_gmsh(mesh_step, backend=gmsh_backend)
+    mesh = job.modify_mesh(stream=stream_mesh)
+    n_elements = job.final_n_elements if mesh is None else len(mesh.elements)
+    return job.msh_file, n_elements, time.time() - start
+
+
+def make_geometry_sweep(mesh_steps, n_workers=None, **kwargs):
+    """
+    Mesh the same geometry with several global mesh steps.
+    The BREP geometry is constructed once, gmsh is run for every step in a process pool.
+    Output files of the step are named: <base>_step_<mesh_step>.msh
+    Keywords are the same as for make_geometry, except 'mesh_step' and 'deform', mesh deformation is not supported.
+    :param mesh_steps: List of global mesh steps.
+    :param n_workers: Size of the process pool, number of CPUs by default.
+    :return: List of (mesh_step, msh_file, n_elements, wall_time).
+    """
+    assert kwargs.get("deform", None) is None, "Mesh deformation is not supported by the mesh step sweep."
+    gmsh_backend = kwargs.get("gmsh_backend", "subprocess")
+    stream_mesh = kwargs.get("stream_mesh", False)
+
+    lg = construct_geometry(**kwargs)
+    jobs = []
+    for mesh_step in mesh_steps:
+        lg.distribute_mesh_step(mesh_step)
+        jobs.append(lg.mesh_job("{}_step_{}".format(lg.filename_base, mesh_step)))
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as pool:
+        futures = [pool.submit(_mesh_sweep_step, job, mesh_step, gmsh_backend, stream_mesh)
+                   for job, mesh_step in zip(jobs, mesh_steps)]
+        results = [(mesh_step,) + future.result() for mesh_step, future in zip(mesh_steps, futures)]
+
+    print("{:>12} {:>12} {:>10}  {}".format("mesh_step", "n_elements", "time [s]", "mesh file"))
+    for mesh_step, msh_file, n_elements, wall_time in results:
+        print("{:>12} {:>12} {:>10.2f}  {}".format(mesh_step, n_elements, wall_time, msh_file))
+    return results
+
+
 
 if __name__ == "__main__":
     import argparse
@@ -1465,9 +2130,53 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('layers_file', help="Input Layers file (JSON).")
     parser.add_argument("--mesh-step", type=float, default=0.0, help="Maximal global mesh step.")
+    parser.add_argument("--mesh-steps", default=None,
+                        help="Comma separated list of global mesh steps, mesh the geometry for each of them "
+                             "in parallel (see --jobs).")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Directory of the cache of interface decompositions, no caching by default.")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Number of processes used to fit the B-spline curves of the interface edges "
+                             "and to mesh the mesh step sweep. BREP shapes are assembled serially.")
+    parser.add_argument("--stream-mesh", action="store_true",
+                        help="Process the GMSH mesh chunk by chunk, for meshes too large for the memory.")
+    parser.add_argument("--deform", type=int, choices=[1, 3], default=None,
+                        help="Mesh deformation algorithm: 1 - mesh flat geometry and map it to the surfaces, "
+                             "3 - map the curved mesh using its discrete interfaces.")
+    parser.add_argument("--gmsh-backend", choices=["auto", "api", "subprocess"], default="subprocess",
+                        help="Run gmsh through the executable ('subprocess', default) or its Python module ('api'), "
+                             "'auto' uses the module if available.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Reuse BREP geometry and mesh of the previous run if only region properties changed.")
+    parser.add_argument("--mesh-stats", action="store_true",
+                        help="Write size and quality statistics of the final mesh to <base>.stats.json. "
+                             "With --stream-mesh the final mesh is read back into memory.")
+    parser.add_argument("--scratch-dir", default=None,
+                        help="Directory of the intermediate files (.brep, .tmp.geo, .tmp.msh).")
+    parser.add_argument("--mesh-format", choices=["ascii", "binary", "gzip"], default="ascii",
+                        help="Format of the final mesh: ASCII or binary .msh, or gzip compressed ASCII .msh.gz.")
+    parser.add_argument("--binary-tmp-mesh", action="store_true",
+                        help="Gmsh writes binary .tmp.msh, read through a memory map. Not compatible with --stream-mesh.")
+    parser.add_argument("--profile", default=None, metavar="REPORT",
+                        help="Write JSON report of the time, memory and objects of the pipeline stages.")
+    parser.add_argument("--cprofile-stage", default=None,
+                        help="Run the stage of given name (e.g. 'call_gmsh', 'interface 0') under cProfile, "
+                             "needs --profile.")
     args = parser.parse_args()
 
     try:
-        make_geometry(layers_file=args.layers_file, mesh_step=args.mesh_step)
+        if args.mesh_steps is None:
+            make_geometry(layers_file=args.layers_file, mesh_step=args.mesh_step, cache_dir=args.cache_dir,
+                          n_jobs=args.jobs, stream_mesh=args.stream_mesh, deform=args.deform,
+                          gmsh_backend=args.gmsh_backend, progress=print, incremental=args.incremental,
+                          mesh_stats=args.mesh_stats, scratch_dir=args.scratch_dir, mesh_format=args.mesh_format,
+                          binary_tmp_mesh=args.binary_tmp_mesh, profile_report=args.profile,
+                          cprofile_stage=args.cprofile_stage)
+        else:
+            mesh_steps = [float(step) for step in args.mesh_steps.split(',')]
+            make_geometry_sweep(mesh_steps, n_workers=args.jobs, layers_file=args.layers_file,
+                                cache_dir=args.cache_dir, n_jobs=args.jobs, stream_mesh=args.stream_mesh,
+                                gmsh_backend=args.gmsh_backend, scratch_dir=args.scratch_dir,
+                                mesh_format=args.mesh_format, binary_tmp_mesh=args.binary_tmp_mesh)
     except ExcGMSHCall as e:
         print(str(e))
@@ -1,21 +1,234 @@
 """ Module containing an expanded python gmsh class"""
 from __future__ import print_function
 
-import struct
+import io
+import os
+import gzip
+import mmap
+import shutil
+import tempfile
+import contextlib
+import collections.abc
+import numpy as np
 
 
+element_n_nodes = {1: 2, 2: 3, 3: 4, 4: 4, 5: 8, 6: 6, 7: 5, 8: 3, 9: 6, 10: 9, 11: 10, 12: 27,
+                   13: 18, 14: 14, 15: 1, 16: 8, 17: 20, 18: 15, 19: 13}
+# el_type : num of nodes per element
+
+_node_dtype = np.dtype([('id', '=i4'), ('xyz', '=f8', (3,))])
+# Record of a node in the binary MSH file.
+
+
+class ElementBlock:
+    """
+    Elements of the same type and the same number of tags, stored in arrays.
+    """
+    def __init__(self, el_type, ids, tags, nodes):
+        """
+        :param el_type: Gmsh element type.
+        :param ids: Array (N,) of element IDs.
+        :param tags: Array (N, n_tags)
+        :param nodes: Array (N, n_nodes) of node IDs.
+        Integer arrays are kept without conversion, so the arrays may be read-only views to a memory mapped file.
+        """
+        self.el_type = int(el_type)
+        self.ids = _int_array(ids).reshape(-1)
+        n_elements = len(self.ids)
+        self.tags = _as_rows(tags, n_elements)
+        self.nodes = _as_rows(nodes, n_elements)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def _int_array(array):
+    array = np.asarray(array)
+    if array.dtype.kind not in 'iu':
+        array = array.astype(int)
+    return array
+
+
+def _as_rows(array, n_rows):
+    array = _int_array(array)
+    if array.ndim == 2:
+        return array
+    return array.reshape(n_rows, -1 if n_rows else 0)
+
+
+def make_element_blocks(elements):
+    """
+    Group elements given as dict { elemID: (type, [tags], [nodeIDs]) } into blocks
+    of consecutive elements with the same type and number of tags.
+    :return: List of ElementBlock.
+    """
+    blocks = []
+    run_key, run = None, []
+    for ele_id, (ele_type, tags, nodes) in elements.items():
+        key = (ele_type, len(tags), len(nodes))
+        if key != run_key and run:
+            blocks.append(_block_from_rows(run_key, run))
+            run = []
+        run_key = key
+        run.append((ele_id, tags, nodes))
+    if run:
+        blocks.append(_block_from_rows(run_key, run))
+    return blocks
+
+
+def _block_from_rows(key, rows):
+    ele_type, n_tags, n_nodes = key
+    ids = [ele_id for ele_id, tags, nodes in rows]
+    tags = np.array([list(tags) for ele_id, tags, nodes in rows], dtype=int).reshape(len(rows), n_tags)
+    nodes = np.array([list(nodes) for ele_id, tags, nodes in rows], dtype=int).reshape(len(rows), n_nodes)
+    return ElementBlock(ele_type, ids, tags, nodes)
+
+
+def element_blocks_from_values(values, n_elements, version_1=False):
+    """
+    Cut integers of the ASCII elements section into blocks of consecutive elements
+    of the same type and number of tags (nodes for 1.0).
+    Version 1.0 rows: id type reg_phys reg_elem n_nodes nodes
+    Version 2.0 rows: id type n_tags tags nodes
+    :param values: Array of all integers of 'n_elements' rows.
+    :return: List of ElementBlock.
+    """
+    blocks = []
+    offset = 0
+    n_read = 0
+    while n_read < n_elements:
+        el_type = values[offset + 1]
+        if version_1:
+            n_nodes = values[offset + 4]
+            key_col, n_head = 4, 5
+        else:
+            n_nodes = element_n_nodes[el_type]
+            key_col, n_head = 2, 3 + values[offset + 2]
+        row_len = n_head + n_nodes
+        max_rows = min(n_elements - n_read, (len(values) - offset) // row_len)
+        rows = values[offset: offset + max_rows * row_len].reshape(max_rows, row_len)
+        # Rows up to the first different element are aligned and have the same length.
+        same = (rows[:, 1] == el_type) & (rows[:, key_col] == values[offset + key_col])
+        n_rows = max_rows if np.all(same) else int(np.argmin(same))
+        rows = rows[:n_rows]
+        if version_1:
+            tags = rows[:, 2:4]
+        else:
+            tags = rows[:, 3:n_head]
+        blocks.append(ElementBlock(el_type, rows[:, 0], tags, rows[:, n_head:]))
+        offset += n_rows * row_len
+        n_read += n_rows
+    if offset != len(values):
+        raise ValueError("Element format error, expected {} elements.".format(n_elements))
+    return blocks
+
+
+def element_lines(block):
+    """
+    ASCII lines (without the line end) of the elements of the block, version 2.0 format.
+    """
+    n_tags, n_nodes = block.tags.shape[1], block.nodes.shape[1]
+    line_format = ' '.join(['%d'] * (3 + n_tags + n_nodes))
+    rows = np.empty((len(block), 3 + n_tags + n_nodes), dtype=int)
+    rows[:, 0] = block.ids
+    rows[:, 1] = block.el_type
+    rows[:, 2] = n_tags
+    rows[:, 3:3 + n_tags] = block.tags
+    rows[:, 3 + n_tags:] = block.nodes
+    return [line_format % tuple(row) for row in rows.tolist()]
+
+
+class NodesView(collections.abc.MutableMapping):
+    """
+    Dict view { nodeID: [ xcoord, ycoord, zcoord] } of the node arrays of GmshIO.
+    Values are views to the rows of the coordinate array, so in place changes are stored.
+    """
+    def __init__(self, mesh):
+        self._mesh = mesh
+
+    def __getitem__(self, node_id):
+        return self._mesh.node_xyz[self._mesh.node_row(node_id)]
+
+    def __setitem__(self, node_id, xyz):
+        mesh = self._mesh
+        try:
+            mesh.writable_node_xyz()[mesh.node_row(node_id)] = xyz
+        except KeyError:
+            mesh.set_nodes(np.append(mesh.node_ids, node_id), np.append(mesh.node_xyz, [xyz], axis=0))
+
+    def __delitem__(self, node_id):
+        mesh = self._mesh
+        row = mesh.node_row(node_id)
+        mesh.set_nodes(np.delete(mesh.node_ids, row), np.delete(mesh.node_xyz, row, axis=0))
+
+    def __iter__(self):
+        return iter(self._mesh.node_ids.tolist())
+
+    def __len__(self):
+        return len(self._mesh.node_ids)
+
+    def items(self):
+        return zip(self._mesh.node_ids.tolist(), self._mesh.node_xyz)
+
+
+class ElementsView(collections.abc.MutableMapping):
+    """
+    Dict view { elemID: (type, [tags], [nodeIDs]) } of the element blocks of GmshIO.
+    Tags and nodes are views to the rows of the block arrays, so in place changes are stored.
+    """
+    def __init__(self, mesh):
+        self._mesh = mesh
+
+    def __getitem__(self, ele_id):
+        block, row = self._mesh.element_position(ele_id)
+        return (block.el_type, block.tags[row], block.nodes[row])
+
+    def __setitem__(self, ele_id, elem):
+        if ele_id in self:
+            del self[ele_id]
+        blocks = self._mesh.element_blocks + make_element_blocks({ele_id: elem})
+        self._mesh.set_element_blocks(blocks)
+
+    def __delitem__(self, ele_id):
+        block, row = self._mesh.element_position(ele_id)
+        new_block = ElementBlock(block.el_type, np.delete(block.ids, row),
+                                 np.delete(block.tags, row, axis=0), np.delete(block.nodes, row, axis=0))
+        self._mesh.set_element_blocks([new_block if b is block else b for b in self._mesh.element_blocks])
+
+    def __iter__(self):
+        for block in self._mesh.element_blocks:
+            yield from block.ids.tolist()
+
+    def __len__(self):
+        return sum(len(block) for block in self._mesh.element_blocks)
+
+    def items(self):
+        for block in self._mesh.element_blocks:
+            for ele_id, tags, nodes in zip(block.ids.tolist(), block.tags, block.nodes):
+                yield ele_id, (block.el_type, tags, nodes)
+
 
 class GmshIO:
     """This is a class for storing nodes and elements. Based on Gmsh.py
 
     Members:
-    nodes -- A dict of the form { nodeID: [ xcoord, ycoord, zcoord] }
-    elements -- A dict of the form { elemID: (type, [tags], [nodeIDs]) }
+    node_ids -- Array (N,) of node IDs
+    node_xyz -- Array (N, 3) of node coordinates
+    element_blocks -- List of ElementBlock, elements in the file order
+    nodes -- A dict view of the form { nodeID: [ xcoord, ycoord, zcoord] }
+    elements -- A dict view of the form { elemID: (type, [tags], [nodeIDs]) }
     physical -- A dict of the form { name: (id, dim) }
 
+    Both 'nodes' and 'elements' can be also assigned by a dict of the same form.
+
     Methods:
-    read([file]) -- Parse a Gmsh version 1.0 or 2.0 mesh file
-    write([file]) -- Output a Gmsh version 2.0 mesh file
+    read([file]) -- Parse a Gmsh version 1.0 or 2.0 mesh file, ASCII or binary
+    write_ascii([file]) -- Output a Gmsh version 2.2 ASCII mesh file
+    write_binary([file]) -- Output a Gmsh version 2.2 binary mesh file
+
+    Files are read through a memory map. Node coordinates and elements of a binary file are then
+    read-only views to the map, loaded on demand by the OS and never copied as a whole.
+    Use writable_node_xyz to modify the coordinates in place. Files with the '.gz' suffix are decompressed.
     """
 
     def __init__(self, filename=None):
@@ -27,163 +240,384 @@ class GmshIO:
 
     def reset(self):
         """Reinitialise Gmsh data structure"""
-        self.nodes = {}
-        self.elements = {}
+        self.set_nodes(np.empty(0, dtype=int), np.empty((0, 3)))
+        self.set_element_blocks([])
         self.physical = {}
 
+    ###########################
+    # Columnar data and dict views.
+
+    def set_nodes(self, node_ids, node_xyz):
+        self.node_ids = _int_array(node_ids).reshape(-1)
+        self.node_xyz = np.asarray(node_xyz, dtype=float).reshape(-1, 3)
+        self._node_rows = None
+
+    def writable_node_xyz(self):
+        """
+        Node coordinates array that can be modified in place, copy of the memory mapped coordinates.
+        """
+        if not self.node_xyz.flags.writeable:
+            self.node_xyz = self.node_xyz.copy()
+        return self.node_xyz
+
+    def set_element_blocks(self, blocks):
+        self.element_blocks = [block for block in blocks if len(block) > 0]
+        self._element_positions = None
+
+    def node_row(self, node_id):
+        """
+        Row of the node in the node arrays. Raise KeyError for unknown ID.
+        """
+        if self._node_rows is None:
+            self._node_rows = dict(zip(self.node_ids.tolist(), range(len(self.node_ids))))
+        return self._node_rows[node_id]
+
+    def element_position(self, ele_id):
+        """
+        (block, row) of the element. Raise KeyError for unknown ID.
+        """
+        if self._element_positions is None:
+            self._element_positions = {}
+            for block in self.element_blocks:
+                self._element_positions.update(zip(block.ids.tolist(), ((block, row) for row in range(len(block)))))
+        return self._element_positions[ele_id]
+
+    @property
+    def nodes(self):
+        return NodesView(self)
+
+    @nodes.setter
+    def nodes(self, nodes):
+        node_ids = list(nodes.keys())
+        self.set_nodes(node_ids, [nodes[node_id] for node_id in node_ids])
+
+    @property
+    def elements(self):
+        return ElementsView(self)
+
+    @elements.setter
+    def elements(self, elements):
+        if isinstance(elements, ElementsView):
+            elements = dict(elements.items())
+        self.set_element_blocks(make_element_blocks(elements))
+
+    ###########################
+    # Reading.
+
     def read(self, mshfile=None):
         """Read a Gmsh .msh file.
-        
-        Reads Gmsh format 1.0 and 2.0 mesh files, storing the nodes and
-        elements in the appropriate dicts.
+
+        Reads Gmsh format 1.0 and 2.0 mesh files, ASCII or binary, storing the nodes and
+        elements in the node arrays and element blocks. Sections are parsed in bulk by numpy.
         """
 
         if not mshfile:
-            mshfile = open(self.filename,'r')
+            with open_mesh_file(self.filename, 'rb') as f:
+                self.read(f)
+            return
 
-        readmode = 0
-        print('Reading %s'%mshfile.name)
-        line='a'
-        while line:
-            line=mshfile.readline()
-            line = line.strip()
-            if line.startswith('$'):
-                if line == '$NOD' or line == '$Nodes':
-                    readmode = 1
-                elif line == '$ELM':
-                    readmode = 2
-                elif line == '$Elements':
-                    readmode = 3
-                elif line == '$MeshFormat':
-                    readmode = 4
+        print('Reading %s' % getattr(mshfile, 'name', ''))
+        data = _read_data(mshfile)
+
+        self.reset()
+        binary = False
+        pos = 0
+        while pos < len(data):
+            line, pos = _next_line(data, pos)
+            if line == b'$MeshFormat':
+                line, pos = _next_line(data, pos)
+                version, ftype, dsize = line.split()
+                binary = (int(ftype) == 1)
+                print(('ASCII', 'Binary')[binary] + ' format')
+                if binary:
+                    assert int(dsize) == 8, "Unsupported data size: {}".format(dsize)
+                    one = np.frombuffer(data, dtype='=i4', count=1, offset=pos)[0]
+                    assert one == 1, "Different endianness of the binary file."
+                    pos += 4
+            elif line == b'$PhysicalNames':
+                pos = self._read_physical(data, pos)
+            elif line == b'$Nodes' or line == b'$NOD':
+                if binary:
+                    pos = self._read_binary_nodes(data, pos)
+                else:
+                    pos = self._read_ascii_nodes(data, pos)
+            elif line == b'$Elements':
+                if binary:
+                    pos = self._read_binary_elements(data, pos)
                 else:
-                    readmode = 0
-            elif readmode:
-                columns = line.split()
-                if readmode == 4:
-                    if len(columns)==3:
-                        vno,ftype,dsize=(float(columns[0]),
-                                         int(columns[1]),
-                                         int(columns[2]))
-                        print(('ASCII','Binary')[ftype]+' format')
-                    else:
-                        endian=struct.unpack('i',columns[0])
-                if readmode == 1:
-                    # Version 1.0 or 2.0 Nodes
-                    try:
-                        if ftype==0 and len(columns)==4:
-                            self.nodes[int(columns[0])] = [ float(col) for col  in  columns[1:] ]
-                        elif ftype==1:
-                            nnods=int(columns[0])
-                            for N in range(nnods):
-                                data=mshfile.read(4+3*dsize)
-                                i,x,y,z=struct.unpack('=i3d',data)
-                                self.nodes[i]=[x,y,z]
-                            mshfile.read(1)
-                    except ValueError:
-                        print('Node format error: '+line, ERROR)
-                        readmode = 0
-                elif ftype==0 and  readmode > 1 and len(columns) > 5:
-                    # Version 1.0 or 2.0 Elements 
-                    try:
-                        columns = [ int(col) for col in columns ]
-                    except ValueError:
-                        print('Element format error: '+line, ERROR)
-                        readmode = 0
-                    else:
-                        (id, type) = columns[0:2]
-                        if readmode == 2:
-                            # Version 1.0 Elements
-                            tags = columns[2:4]
-                            nodes = columns[5:]
-                        else:
-                            # Version 2.0 Elements
-                            ntags = columns[2]
-                            tags = columns[3:3+ntags]
-                            nodes = columns[3+ntags:]
-                        self.elements[id] = (type, tags, nodes)
-                elif readmode == 3 and ftype==1:
-                    # el_type : num of nodes per element
-                    tdict={1:2,2:3,3:4,4:4,5:5,6:6,7:5,8:3,9:6,10:9,11:10,15:1}
-                    try:
-                        neles=int(columns[0])
-                        k=0
-                        while k<neles:
-                            etype,ntype,ntags=struct.unpack('=3i',
-                                                            mshfile.read(3*4))
-                            k+=1
-                            for j in range(ntype):
-                                mysize=1+ntags+tdict[etype]
-                                data=struct.unpack('=%di'%mysize,
-                                                   mshfile.read(4*mysize))
-                                self.elements[data[0]]=(etype,
-                                                        data[1:1+ntags],
-                                                        data[1+ntags:])
-                    except:
-                        raise
-                    mshfile.read(1)
-                            
-        print('  %d Nodes'%len(self.nodes))
-        print('  %d Elements'%len(self.elements))
-
-        mshfile.close()
+                    pos = self._read_ascii_elements(data, pos, version_1=False)
+            elif line == b'$ELM':
+                pos = self._read_ascii_elements(data, pos, version_1=True)
+        if isinstance(data, mmap.mmap) and not binary:
+            # nothing refers to the map of an ASCII file, release it
+            data.close()
+
+        print('  %d Nodes' % len(self.node_ids))
+        print('  %d Elements' % sum(len(block) for block in self.element_blocks))
+
+    def _read_physical(self, data, pos):
+        line, pos = _next_line(data, pos)
+        for i in range(int(line)):
+            line, pos = _next_line(data, pos)
+            dim, region_id, name = line.decode().split(maxsplit=2)
+            self.physical[name.strip('"')] = (int(region_id), int(dim))
+        return pos
+
+    def _read_ascii_nodes(self, data, pos):
+        line, pos = _next_line(data, pos)
+        n_nodes = int(line)
+        end = _find(data, b'$', pos)
+        values = np.fromstring(data[pos:end], dtype=float, sep=' ')
+        if len(values) != 4 * n_nodes:
+            raise ValueError("Node format error, expected {} nodes.".format(n_nodes))
+        values = values.reshape(n_nodes, 4)
+        self.set_nodes(values[:, 0].astype(int), values[:, 1:4])
+        return end
+
+    def _read_binary_nodes(self, data, pos):
+        line, pos = _next_line(data, pos)
+        n_nodes = int(line)
+        records = np.frombuffer(data, dtype=_node_dtype, count=n_nodes, offset=pos)
+        self.set_nodes(records['id'], records['xyz'])
+        return pos + n_nodes * _node_dtype.itemsize
+
+    def _read_ascii_elements(self, data, pos, version_1):
+        """
+        All integers of the section are parsed at once, see element_blocks_from_values.
+        """
+        line, pos = _next_line(data, pos)
+        n_elements = int(line)
+        end = _find(data, b'$', pos)
+        values = np.fromstring(data[pos:end], dtype=int, sep=' ')
+        blocks = element_blocks_from_values(values, n_elements, version_1)
+        self.set_element_blocks(blocks)
+        return end
+
+    def _read_binary_elements(self, data, pos):
+        line, pos = _next_line(data, pos)
+        n_elements = int(line)
+        blocks = []
+        n_read = 0
+        while n_read < n_elements:
+            el_type, n_block, n_tags = np.frombuffer(data, dtype='=i4', count=3, offset=pos)
+            pos += 3 * 4
+            row_len = 1 + n_tags + element_n_nodes[el_type]
+            rows = np.frombuffer(data, dtype='=i4', count=n_block * row_len, offset=pos)
+            rows = rows.reshape(n_block, row_len)
+            pos += rows.size * 4
+            blocks.append(ElementBlock(el_type, rows[:, 0], rows[:, 1:1 + n_tags], rows[:, 1 + n_tags:]))
+            n_read += n_block
+        self.set_element_blocks(blocks)
+        return pos
+
+    ###########################
+    # Writing.
 
     def write_ascii(self, mshfile=None):
         """Dump the mesh out to a Gmsh 2.0 msh file."""
 
         if not mshfile:
-            mshfile = open(self.filename, 'w')
+            with replace_mesh_file(self.filename, 'wt') as f:
+                self.write_ascii(f)
+            return
 
-
-        print('$MeshFormat\n2.2 0 8\n$EndMeshFormat', file=mshfile)
-        print('$PhysicalNames\n%d'%len(self.physical), file=mshfile)
+        lines = ['$MeshFormat\n2.2 0 8\n$EndMeshFormat']
+        lines.append('$PhysicalNames\n%d' % len(self.physical))
         for name in sorted(self.physical.keys()):
-            value = self.physical[name]
-            region_id, dim = value
-            print('%d %d "%s"'%(dim, region_id, name), file=mshfile)
-        print('$EndPhysicalNames', file=mshfile)
-        print('$Nodes\n%d'%len(self.nodes), file=mshfile)
-        for node_id in sorted(self.nodes.keys()):
-            coord = self.nodes[node_id]
-            print(node_id,' ',' '.join([str(c) for c in  coord]), sep="",
-                  file=mshfile)
-        print('$EndNodes',file=mshfile)
-        print('$Elements\n%d'%len(self.elements),file=mshfile)
-        for ele_id in sorted(self.elements.keys()):
-            elem = self.elements[ele_id]
-            (ele_type, tags, nodes) = elem
-            print(ele_id,' ',ele_type,' ',len(tags),' ',
-                  ' '.join([str(c) for c in tags]),' ',
-                  ' '.join([str(c) for c in nodes]), sep="", file=mshfile)
-        print('$EndElements',file=mshfile)
+            region_id, dim = self.physical[name]
+            lines.append('%d %d "%s"' % (dim, region_id, name))
+        lines.append('$EndPhysicalNames')
+        lines.append('$Nodes\n%d' % len(self.node_ids))
+        order = np.argsort(self.node_ids, kind='mergesort')
+        for node_id, coord in zip(self.node_ids[order].tolist(), self.node_xyz[order].tolist()):
+            lines.append('%d %s' % (node_id, ' '.join(map(str, coord))))
+        lines.append('$EndNodes')
+
+        lines.append('$Elements\n%d' % len(self.elements))
+        ele_ids, ele_lines = [], []
+        for block in self.element_blocks:
+            ele_ids.append(block.ids)
+            ele_lines.extend(element_lines(block))
+        if ele_lines:
+            order = np.argsort(np.concatenate(ele_ids), kind='mergesort')
+            lines.extend(ele_lines[i] for i in order.tolist())
+        lines.append('$EndElements')
+        mshfile.write('\n'.join(lines))
+        mshfile.write('\n')
 
     def write_binary(self, filename=None):
-        """Dump the mesh out to a Gmsh 2.0 msh file."""
+        """Dump the mesh out to a Gmsh 2.2 binary msh file."""
 
         if not filename:
             filename = self.filename
 
-        mshfile = open(filename, 'wr')
-
-        mshfile.write("$MeshFormat\n2.2 1 8\n")
-        mshfile.write(struct.pack('@i',1))
-        mshfile.write("\n$EndMeshFormat\n")
-        mshfile.write("$Nodes\n%d\n"%(len(self.nodes)))
-        for node_id, coord in self.nodes.items():
-            mshfile.write(struct.pack('@i',node_id))
-            mshfile.write(struct.pack('@3d',*coord))
-        mshfile.write("\n$EndNodes\n")
-        mshfile.write("$Elements\n%d\n"%(len(self.elements)))
-        for ele_id, elem in self.elements.items():
-            (ele_type, tags, nodes) = elem
-            mshfile.write(struct.pack('@i',ele_type))
-            mshfile.write(struct.pack('@i',1))
-            mshfile.write(struct.pack('@i',len(tags)))
-            mshfile.write(struct.pack('@i',ele_id))
-            for c in tags:
-                mshfile.write(struct.pack('@i',c))
-            for c in nodes:
-                mshfile.write(struct.pack('@i',c))
-        mshfile.write("\n$EndElements\n")
-                      
-        mshfile.close()
+        with replace_mesh_file(filename, 'wb') as mshfile:
+            mshfile.write(b"$MeshFormat\n2.2 1 8\n")
+            mshfile.write(np.array([1], dtype='=i4').tobytes())
+            mshfile.write(b"\n$EndMeshFormat\n")
+            mshfile.write(b"$PhysicalNames\n%d\n" % len(self.physical))
+            for name in sorted(self.physical.keys()):
+                region_id, dim = self.physical[name]
+                mshfile.write(('%d %d "%s"\n' % (dim, region_id, name)).encode())
+            mshfile.write(b"$EndPhysicalNames\n")
+
+            mshfile.write(b"$Nodes\n%d\n" % len(self.node_ids))
+            records = np.empty(len(self.node_ids), dtype=_node_dtype)
+            records['id'] = self.node_ids
+            records['xyz'] = self.node_xyz
+            mshfile.write(records.tobytes())
+            mshfile.write(b"\n$EndNodes\n")
+
+            mshfile.write(b"$Elements\n%d\n" % len(self.elements))
+            for block in self.element_blocks:
+                n_tags = block.tags.shape[1]
+                mshfile.write(np.array([block.el_type, len(block), n_tags], dtype='=i4').tobytes())
+                rows = np.concatenate((block.ids[:, None], block.tags, block.nodes), axis=1)
+                mshfile.write(rows.astype('=i4').tobytes())
+            mshfile.write(b"\n$EndElements\n")
+
+
+def modify_elements_stream(in_file, out_file, modify_block, physical=None, chunk_size=100000):
+    """
+    Copy the ASCII Gmsh 2.x mesh file 'in_file' to 'out_file' passing the elements through
+    'modify_block' chunk by chunk, so the whole mesh is never held in memory.
+    Nodes are copied unchanged, elements are written in the input order.
+    The output file is replaced when it is complete (see replace_mesh_file), so 'out_file'
+    may be the same as 'in_file'.
+
+    :param modify_block: Function ElementBlock -> ElementBlock or None, may modify the block in place,
+        may add regions to 'physical'. Elements of the returned block are written, None drops the whole block.
+    :param physical: Dict { name: (id, dim) } of the physical names written to the output. Names read
+        from the input are added to it.
+    :param chunk_size: Maximal number of element lines processed at once.
+    :return: (physical, n_elements), the 'physical' dict and the number of written elements.
+    """
+    if physical is None:
+        physical = {}
+    out_dir = os.path.dirname(os.path.abspath(out_file))
+    with open_mesh_file(in_file, 'rb') as f, tempfile.TemporaryFile(dir=out_dir) as elements_tmp:
+        nodes_range = None
+        n_out_elements = 0
+        line = f.readline()
+        while line:
+            line = line.strip()
+            if line == b'$MeshFormat':
+                version, ftype, dsize = f.readline().split()
+                if int(ftype) != 0:
+                    raise ValueError("Only ASCII mesh files can be processed by stream: {}".format(in_file))
+            elif line == b'$PhysicalNames':
+                for i in range(int(f.readline())):
+                    dim, region_id, name = f.readline().decode().split(maxsplit=2)
+                    physical.setdefault(name.strip().strip('"'), (int(region_id), int(dim)))
+            elif line == b'$Nodes':
+                begin = f.tell()
+                while line.strip() != b'$EndNodes':
+                    line = f.readline()
+                    if not line:
+                        raise ValueError("Missing $EndNodes in: {}".format(in_file))
+                nodes_range = (begin, f.tell())
+            elif line == b'$Elements':
+                n_elements = int(f.readline())
+                while n_elements > 0:
+                    n_chunk = min(chunk_size, n_elements)
+                    chunk = b''.join([f.readline() for i in range(n_chunk)])
+                    values = np.fromstring(chunk, dtype=int, sep=' ')
+                    for block in element_blocks_from_values(values, n_chunk):
+                        block = modify_block(block)
+                        if block is None or len(block) == 0:
+                            continue
+                        elements_tmp.write(('\n'.join(element_lines(block)) + '\n').encode())
+                        n_out_elements += len(block)
+                    n_elements -= n_chunk
+            line = f.readline()
+
+        with replace_mesh_file(out_file, 'wb') as out:
+            out.write(b"$MeshFormat\n2.2 0 8\n$EndMeshFormat\n")
+            out.write(b"$PhysicalNames\n%d\n" % len(physical))
+            for name in sorted(physical.keys()):
+                region_id, dim = physical[name]
+                out.write(('%d %d "%s"\n' % (dim, region_id, name)).encode())
+            out.write(b"$EndPhysicalNames\n")
+            out.write(b"$Nodes\n")
+            if nodes_range is None:
+                out.write(b"0\n$EndNodes\n")
+            else:
+                f.seek(nodes_range[0])
+                _copy_bytes(f, out, nodes_range[1] - nodes_range[0])
+            out.write(b"$Elements\n%d\n" % n_out_elements)
+            elements_tmp.seek(0)
+            shutil.copyfileobj(elements_tmp, out)
+            out.write(b"$EndElements\n")
+    return physical, n_out_elements
+
+
+def open_mesh_file(filename, mode):
+    """
+    Open the mesh file, files with the '.gz' suffix are (de)compressed by gzip.
+    """
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode, compresslevel=6) if 'w' in mode else gzip.open(filename, mode)
+    return open(filename, mode)
+
+
+@contextlib.contextmanager
+def replace_mesh_file(filename, mode):
+    """
+    Open a temporary file next to the mesh file for writing, same as open_mesh_file,
+    and replace the mesh file by it when the writing is done. The original file is never truncated,
+    so the memory mapped arrays of a mesh read from it stay valid, e.g. the mesh can be written back
+    to its own file.
+    """
+    directory, name = os.path.split(os.path.abspath(filename))
+    suffix = '.gz' if filename.endswith('.gz') else ''
+    tmp_name = os.path.join(directory, ".{}.{}.tmp{}".format(name, os.getpid(), suffix))
+    try:
+        with open_mesh_file(tmp_name, mode) as f:
+            yield f
+        os.replace(tmp_name, filename)
+    finally:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+
+
+def _read_data(mshfile):
+    """
+    Content of the open mesh file: read-only memory map of a regular file, bytes otherwise.
+    """
+    if isinstance(mshfile, io.TextIOBase):
+        # binary data can not be read through the text layer
+        mshfile = mshfile.buffer
+    if not isinstance(mshfile, gzip.GzipFile):
+        try:
+            fileno = mshfile.fileno()
+            if os.fstat(fileno).st_size > 0:
+                return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        except (AttributeError, OSError, io.UnsupportedOperation, ValueError):
+            pass
+    return mshfile.read()
+
+
+def _find(data, sub, pos):
+    end = data.find(sub, pos)
+    if end == -1:
+        raise ValueError("Missing {} in the mesh file.".format(sub))
+    return end
+
+
+def _copy_bytes(src, dst, size, buffer_size=1 << 20):
+    while size > 0:
+        buf = src.read(min(size, buffer_size))
+        if not buf:
+            break
+        dst.write(buf)
+        size -= len(buf)
+
+
+def _next_line(data, pos):
+    """
+    Return the stripped line starting at 'pos' and the position of the next line.
+    """
+    end = data.find(b'\n', pos)
+    if end == -1:
+        end = len(data)
+    return data[pos:end].strip(), end + 1
@@ -0,0 +1,219 @@
+"""
+Vectorized vertical deformation of a mesh between interfaces, see LayerGeometry.deform_mesh.
+
+Every node of an element of a layer is mapped from the reference position of the layer
+(bottom and top interface as they were meshed) to the target position (bottom and top surface)
+by linear interpolation in Z. Nodes shared by more elements are moved by the mean of the shifts.
+
+The reference position of an interface is either a constant elevation (algorithm I, mesh of
+the flat extruded geometry) or the discrete surface formed by the mesh triangles on the interface
+(algorithm III), evaluated through the vertical line / triangle intersection using BIH.
+"""
+import numpy as np
+
+
+class BIH:
+    """
+    Bounding interval hierarchy of static 2D boxes. Every inner node splits its boxes
+    along one axis into two children given by the clipping planes 'left_max' and 'right_min'.
+    """
+    def __init__(self, boxes, leaf_size=8):
+        """
+        :param boxes: Array (N, 4) of boxes [min_x, min_y, max_x, max_y].
+        :param leaf_size: Maximal number of boxes in a leaf.
+        """
+        self.boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        self.leaf_size = leaf_size
+        # Inner nodes: axis, left_max, right_min, left child, right child. Leafs: axis == -1, range of 'items'.
+        self.axis = []
+        self.planes = []
+        self.children = []
+        items = []
+        centers = (self.boxes[:, 0:2] + self.boxes[:, 2:4]) / 2
+
+        stack = [(self._new_node(), np.arange(len(self.boxes)))]
+        while stack:
+            node, idx = stack.pop()
+            if len(idx) > leaf_size:
+                node_centers = centers[idx]
+                axis = int(np.argmax(np.max(node_centers, axis=0) - np.min(node_centers, axis=0)))
+                split = np.median(node_centers[:, axis])
+                to_left = node_centers[:, axis] <= split
+                if 0 < np.count_nonzero(to_left) < len(idx):
+                    left, right = idx[to_left], idx[~to_left]
+                    left_node, right_node = self._new_node(), self._new_node()
+                    self.axis[node] = axis
+                    self.planes[node] = (np.max(self.boxes[left, axis + 2]), np.min(self.boxes[right, axis]))
+                    self.children[node] = (left_node, right_node)
+                    stack.append((left_node, left))
+                    stack.append((right_node, right))
+                    continue
+            self.children[node] = (len(items), len(items) + len(idx))
+            items.extend(idx.tolist())
+        self.items = np.array(items, dtype=int)
+
+    def _new_node(self):
+        self.axis.append(-1)
+        self.planes.append(None)
+        self.children.append(None)
+        return len(self.axis) - 1
+
+    def find_points(self, points):
+        """
+        Find boxes containing the points. All points are passed through the tree at once.
+        :param points: Array (M, 2).
+        :return: (point_idx, box_idx), arrays of all pairs of the point and the box containing it.
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        point_idx, box_idx = [np.empty(0, dtype=int)], [np.empty(0, dtype=int)]
+        if len(self.boxes) == 0:
+            return point_idx[0], box_idx[0]
+        stack = [(0, np.arange(len(points)))]
+        while stack:
+            node, idx = stack.pop()
+            if len(idx) == 0:
+                continue
+            axis = self.axis[node]
+            if axis >= 0:
+                left_max, right_min = self.planes[node]
+                left, right = self.children[node]
+                coord = points[idx, axis]
+                stack.append((left, idx[coord <= left_max]))
+                stack.append((right, idx[coord >= right_min]))
+            else:
+                begin, end = self.children[node]
+                items = self.items[begin:end]
+                boxes = self.boxes[items]
+                pts = points[idx]
+                inside = np.all(boxes[None, :, 0:2] <= pts[:, None, :], axis=2) \
+                         & np.all(pts[:, None, :] <= boxes[None, :, 2:4], axis=2)
+                i_pt, i_box = np.nonzero(inside)
+                point_idx.append(idx[i_pt])
+                box_idx.append(items[i_box])
+        return np.concatenate(point_idx), np.concatenate(box_idx)
+
+
+class DiscreteSurface:
+    """
+    Surface z(x,y) given by triangles, e.g. the mesh elements on an interface.
+    """
+    def __init__(self, triangles, eps=1e-10):
+        """
+        :param triangles: Array (N, 3, 3) of triangle vertices.
+        :param eps: Relative tolerance of the point in triangle test.
+        """
+        self.triangles = np.asarray(triangles, dtype=float).reshape(-1, 3, 3)
+        self.eps = eps
+        xy = self.triangles[:, :, 0:2]
+        self.bih = BIH(np.concatenate((np.min(xy, axis=1), np.max(xy, axis=1)), axis=1))
+
+    def eval_z(self, xy):
+        """
+        Intersection of the vertical lines through the points with the surface.
+        :param xy: Array (M, 2) of points.
+        :return: Array (M,) of Z values, NaN for points out of the surface.
+        """
+        xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+        z = np.full(len(xy), np.nan)
+        i_pt, i_tri = self.bih.find_points(xy)
+        tri = self.triangles[i_tri]
+        a, u, v = tri[:, 0, :], tri[:, 1, :] - tri[:, 0, :], tri[:, 2, :] - tri[:, 0, :]
+        det = u[:, 0] * v[:, 1] - u[:, 1] * v[:, 0]
+        regular = np.abs(det) > 0.0
+        det = np.where(regular, det, 1.0)
+        d = xy[i_pt] - a[:, 0:2]
+        bary_u = (d[:, 0] * v[:, 1] - d[:, 1] * v[:, 0]) / det
+        bary_v = (u[:, 0] * d[:, 1] - u[:, 1] * d[:, 0]) / det
+        inside = regular & (bary_u >= -self.eps) & (bary_v >= -self.eps) & (bary_u + bary_v <= 1 + self.eps)
+        tri_z = a[:, 2] + bary_u * u[:, 2] + bary_v * v[:, 2]
+        # First triangle containing the point.
+        i_pt, i_first = np.unique(i_pt[inside], return_index=True)
+        z[i_pt] = tri_z[inside][i_first]
+        return z
+
+
+def sort_node_ids(node_ids):
+    """
+    Sort the node IDs once for repeated node_rows calls.
+    :param node_ids: Array (N,) of all node IDs.
+    :return: (order, sorted_ids), order - rows of the sorted IDs, sorted_ids - node_ids[order]
+    """
+    order = np.argsort(node_ids, kind='mergesort')
+    return order, node_ids[order]
+
+
+def node_rows(node_ids, ids, sorted_nodes=None):
+    """
+    Rows of the nodes given by IDs in the array of all node IDs.
+    :param node_ids: Array (N,) of all node IDs.
+    :param ids: Array of IDs.
+    :param sorted_nodes: Result of sort_node_ids(node_ids), computed if None.
+    :return: Array of rows, same shape as 'ids'. Raise KeyError for unknown IDs.
+    """
+    ids = np.asarray(ids, dtype=int)
+    order, sorted_ids = sort_node_ids(node_ids) if sorted_nodes is None else sorted_nodes
+    pos = np.minimum(np.searchsorted(sorted_ids, ids), max(len(sorted_ids) - 1, 0))
+    if len(sorted_ids) == 0 or np.any(sorted_ids[pos] != ids):
+        raise KeyError("Unknown node IDs in elements.")
+    return order[pos]
+
+
+def deform_z(node_xyz, rows, top, bot, ref_z, target_z, tol=0.01):
+    """
+    Compute the deformed Z coordinates of the nodes.
+    :param node_xyz: Array (N, 3) of node coordinates.
+    :param rows: Array (K,) node rows, one item for every node of every element of a layer.
+    :param top: Array (K,) indices of the top interfaces, same as 'bot' for fracture elements.
+    :param bot: Array (K,) indices of the bottom interfaces.
+    :param ref_z: List of functions xy -> z, reference (meshed) position of the interfaces.
+    :param target_z: List of functions xy -> z, target position of the interfaces.
+    :param tol: Relative tolerance of the shifts of one node coming from different elements.
+    :return: Array (N,) of new Z coordinates, nodes without elements are not moved.
+    """
+    node_xyz = np.asarray(node_xyz, dtype=float)
+    rows, top, bot = [np.asarray(a, dtype=int).reshape(-1) for a in (rows, top, bot)]
+    n_nodes = len(node_xyz)
+    z = node_xyz[:, 2].copy()
+    if len(rows) == 0:
+        return z
+
+    # Evaluate every interface once per node.
+    iface_values = {}
+    for iface in np.unique(np.concatenate((top, bot))).tolist():
+        iface_rows = np.unique(np.concatenate((rows[top == iface], rows[bot == iface])))
+        xy = node_xyz[iface_rows, 0:2]
+        iface_values[iface] = (iface_rows, np.asarray(ref_z[iface](xy), dtype=float),
+                               np.asarray(target_z[iface](xy), dtype=float))
+
+    def lookup(iface_idx):
+        ref, target = np.empty(len(rows)), np.empty(len(rows))
+        for iface in np.unique(iface_idx).tolist():
+            sel = iface_idx == iface
+            iface_rows, iface_ref, iface_target = iface_values[iface]
+            pos = np.searchsorted(iface_rows, rows[sel])
+            ref[sel], target[sel] = iface_ref[pos], iface_target[pos]
+        return ref, target
+
+    node_z = z[rows]
+    top_ref, top_target = lookup(top)
+    bot_ref, bot_target = lookup(bot)
+    assert not np.any(np.isnan(top_ref) | np.isnan(bot_ref)), "Nodes out of the reference surfaces."
+    fracture = top == bot
+    height = np.where(fracture, 1.0, top_ref - bot_ref)
+    t = np.where(fracture, 1.0, (node_z - bot_ref) / height)
+    eps = 1e-6
+    bad = ~fracture & ((t < -eps) | (t > 1 + eps))
+    assert not np.any(bad), "Node {} out of its layer, t = {}".format(rows[bad][:1], t[bad][:1])
+    shift = (1 - t) * bot_target + t * top_target - node_z
+
+    count = np.bincount(rows, minlength=n_nodes)
+    has_shift = count > 0
+    mean_shift = np.zeros(n_nodes)
+    mean_shift[has_shift] = np.bincount(rows, weights=shift, minlength=n_nodes)[has_shift] / count[has_shift]
+    deviation = np.zeros(n_nodes)
+    deviation[has_shift] = np.bincount(rows, weights=np.abs(shift - mean_shift[rows]),
+                                       minlength=n_nodes)[has_shift] / count[has_shift]
+    scale = max(np.max(np.abs(node_xyz[:, 2])), 1.0)
+    bad = deviation > tol * np.abs(mean_shift) + eps * scale
+    assert not np.any(bad), "Inconsistent shifts of nodes (rows): {}".format(np.nonzero(bad)[0][:10])
+    return z + mean_shift
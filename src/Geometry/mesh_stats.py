@@ -0,0 +1,221 @@
+"""
+Size and quality statistics of a mesh, computed on the arrays of gmsh_io.GmshIO, see LayerGeometry.mesh_statistics.
+
+Per region (physical ID of the elements):
+- element counts by element type,
+- total measure (length, area, volume according to the dimension of the elements),
+- minimal and maximal edge length,
+- aspect ratio: min, max, mean and histogram.
+Per mesh: node valence (number of elements sharing the node), min, max, mean and histogram.
+
+Measure, edges and aspect ratio are computed for the first order simplices (lines, triangles,
+tetrahedra), other element types are just counted. Elements are processed in chunks
+of vectorized operations, so the memory overhead is bounded independently of the mesh size.
+
+Aspect ratio of a triangle or tetrahedron is the longest edge over the inscribed sphere
+diameter, normalized to 1 for the regular simplex. Degenerated elements have an infinite aspect ratio.
+"""
+import json
+import numpy as np
+import Geometry.mesh_deform as mesh_deform
+
+
+element_dim = {15: 0, 1: 1, 8: 1, 2: 2, 3: 2, 9: 2, 10: 2, 16: 2, 4: 3, 5: 3, 6: 3, 7: 3, 11: 3, 12: 3,
+               13: 3, 14: 3, 17: 3, 18: 3, 19: 3}
+# el_type : dimension of the element
+
+_simplex_edges = {
+    1: [(0, 1)],
+    2: [(0, 1), (1, 2), (2, 0)],
+    4: [(0, 1), (0, 2), (0, 3), (1, 2), (1, 3), (2, 3)]}
+# el_type : local edges, first order simplices with measure and quality
+
+aspect_ratio_bins = [1.0, 1.5, 2.0, 3.0, 5.0, 10.0, 100.0, np.inf]
+# Edges of the aspect ratio histogram bins, the last bin includes also the infinite aspect ratio.
+
+
+class _RegionStats:
+    """
+    Accumulated statistics of one region.
+    """
+    def __init__(self, region_id, dim):
+        self.region_id = region_id
+        self.dim = dim
+        self.type_counts = {}
+        self.measure = 0.0
+        self.min_edge = np.inf
+        self.max_edge = 0.0
+        self.n_quality = 0
+        self.min_aspect = np.inf
+        self.max_aspect = 0.0
+        self.sum_aspect = 0.0
+        self.aspect_hist = np.zeros(len(aspect_ratio_bins) - 1, dtype=int)
+
+    def result(self):
+        result = dict(id=self.region_id, dim=self.dim,
+                      n_elements=sum(self.type_counts.values()),
+                      element_types={str(el_type): count for el_type, count in sorted(self.type_counts.items())},
+                      measure=self.measure)
+        if self.max_edge > 0.0:
+            result.update(min_edge=self.min_edge, max_edge=self.max_edge)
+        if self.n_quality > 0:
+            result['aspect_ratio'] = dict(min=_json_float(self.min_aspect), max=_json_float(self.max_aspect),
+                                          mean=_json_float(self.sum_aspect / self.n_quality),
+                                          bins=[_json_float(b) for b in aspect_ratio_bins],
+                                          counts=self.aspect_hist.tolist())
+        return result
+
+
+def _json_float(value):
+    """
+    JSON has no infinity, use None.
+    """
+    value = float(value)
+    return value if np.isfinite(value) else None
+
+
+def simplex_measures(xyz):
+    """
+    Measure, edge lengths and aspect ratio of simplices.
+    :param xyz: Array (N, n_vertices, 3), n_vertices = 2, 3, 4.
+    :return: (measure (N,), edge lengths (N, n_edges), aspect ratio (N,) or None for lines)
+    """
+    n_vertices = xyz.shape[1]
+    el_type = {2: 1, 3: 2, 4: 4}[n_vertices]
+    edges = np.stack([xyz[:, j] - xyz[:, i] for i, j in _simplex_edges[el_type]], axis=1)
+    edge_len = np.sqrt(np.sum(edges ** 2, axis=2))
+    if n_vertices == 2:
+        return edge_len[:, 0], edge_len, None
+
+    max_edge = np.max(edge_len, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if n_vertices == 3:
+            measure = np.linalg.norm(np.cross(edges[:, 0], -edges[:, 2]), axis=1) / 2
+            # inscribed radius r = 2 A / perimeter, regular triangle: edge = 2 sqrt(3) r
+            r_in = 2 * measure / np.sum(edge_len, axis=1)
+            aspect = max_edge / (2 * np.sqrt(3) * r_in)
+        else:
+            u, v, w = edges[:, 0], edges[:, 1], edges[:, 2]
+            measure = np.abs(np.einsum('ij,ij->i', u, np.cross(v, w))) / 6
+            face_area = (np.linalg.norm(np.cross(u, v), axis=1) + np.linalg.norm(np.cross(u, w), axis=1)
+                         + np.linalg.norm(np.cross(v, w), axis=1)
+                         + np.linalg.norm(np.cross(v - u, w - u), axis=1)) / 2
+            # inscribed radius r = 3 V / surface, regular tetrahedron: edge = 2 sqrt(6) r
+            r_in = 3 * measure / face_area
+            aspect = max_edge / (2 * np.sqrt(6) * r_in)
+    aspect[~(r_in > 0.0)] = np.inf
+    return measure, edge_len, aspect
+
+
+def mesh_statistics(mesh, chunk_size=500000):
+    """
+    Compute statistics of the mesh.
+    :param mesh: gmsh_io.GmshIO, the first tag of the elements is the physical ID.
+    :param chunk_size: Number of elements processed at once.
+    :return: Dict of JSON compatible statistics:
+        { n_nodes, n_elements, regions: { name: region stats }, node_valence: {...} }
+    """
+    region_names = {region_id: name for name, (region_id, dim) in mesh.physical.items()}
+    regions = {}
+    node_ids = mesh.node_ids
+    sorted_nodes = mesh_deform.sort_node_ids(node_ids)
+    valence = np.zeros(len(node_ids), dtype=int)
+    n_bins = len(aspect_ratio_bins) - 1
+
+    for block in mesh.element_blocks:
+        dim = element_dim.get(block.el_type, -1)
+        simplex = block.el_type in _simplex_edges
+        for begin in range(0, len(block), chunk_size):
+            end = min(begin + chunk_size, len(block))
+            rows = mesh_deform.node_rows(node_ids, block.nodes[begin:end], sorted_nodes)
+            valence += np.bincount(rows.reshape(-1), minlength=len(node_ids))
+
+            physical_ids = block.tags[begin:end, 0] if block.tags.shape[1] > 0 else np.zeros(end - begin, dtype=int)
+            region_list, reg_idx = np.unique(physical_ids, return_inverse=True)
+            reg_stats = []
+            for region_id in region_list.tolist():
+                if region_id not in regions:
+                    regions[region_id] = _RegionStats(region_id, dim)
+                reg_stats.append(regions[region_id])
+            counts = np.bincount(reg_idx, minlength=len(region_list))
+            for stats, count in zip(reg_stats, counts.tolist()):
+                stats.type_counts[block.el_type] = stats.type_counts.get(block.el_type, 0) + count
+            if not simplex:
+                continue
+
+            measure, edge_len, aspect = simplex_measures(mesh.node_xyz[rows])
+            # Reduce over the consecutive elements of the same region.
+            order = np.argsort(reg_idx, kind='mergesort')
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            sum_measure = np.bincount(reg_idx, weights=measure, minlength=len(region_list))
+            min_edge = np.minimum.reduceat(np.min(edge_len, axis=1)[order], starts)
+            max_edge = np.maximum.reduceat(np.max(edge_len, axis=1)[order], starts)
+            for i, stats in enumerate(reg_stats):
+                stats.measure += float(sum_measure[i])
+                stats.min_edge = min(stats.min_edge, float(min_edge[i]))
+                stats.max_edge = max(stats.max_edge, float(max_edge[i]))
+            if aspect is None:
+                continue
+            finite_aspect = np.where(np.isfinite(aspect), aspect, 0.0)
+            sum_aspect = np.bincount(reg_idx, weights=finite_aspect, minlength=len(region_list))
+            min_aspect = np.minimum.reduceat(aspect[order], starts)
+            max_aspect = np.maximum.reduceat(aspect[order], starts)
+            i_bin = np.clip(np.searchsorted(aspect_ratio_bins, aspect, side='right') - 1, 0, n_bins - 1)
+            hist = np.bincount(reg_idx * n_bins + i_bin, minlength=len(region_list) * n_bins)
+            hist = hist.reshape(len(region_list), n_bins)
+            for i, stats in enumerate(reg_stats):
+                stats.n_quality += int(counts[i])
+                stats.sum_aspect += float(sum_aspect[i]) if np.isfinite(max_aspect[i]) else np.inf
+                stats.min_aspect = min(stats.min_aspect, float(min_aspect[i]))
+                stats.max_aspect = max(stats.max_aspect, float(max_aspect[i]))
+                stats.aspect_hist += hist[i]
+
+    region_results = {}
+    for region_id, stats in sorted(regions.items()):
+        name = region_names.get(region_id, str(region_id))
+        region_results[name] = stats.result()
+
+    used = valence[valence > 0]
+    valence_stats = dict(min=int(np.min(used)) if len(used) else 0,
+                         max=int(np.max(used)) if len(used) else 0,
+                         mean=float(np.mean(used)) if len(used) else 0.0,
+                         counts=np.bincount(used).tolist(),
+                         n_free_nodes=int(len(valence) - len(used)))
+    return dict(n_nodes=len(node_ids),
+                n_elements=sum(len(block) for block in mesh.element_blocks),
+                regions=region_results,
+                node_valence=valence_stats)
+
+
+def stats_file_name(msh_file):
+    """
+    Statistics file next to the mesh file: <base>.stats.json, for <base>.msh or <base>.msh.gz
+    """
+    base = msh_file
+    for suffix in [".gz", ".msh"]:
+        if base.endswith(suffix):
+            base = base[:-len(suffix)]
+    return base + ".stats.json"
+
+
+def write_statistics(stats, msh_file):
+    """
+    Write the statistics as JSON next to the mesh file.
+    :return: Name of the statistics file.
+    """
+    stats_file = stats_file_name(msh_file)
+    with open(stats_file, "w") as f:
+        json.dump(stats, f, indent=2, sort_keys=True)
+    return stats_file
+
+
+def print_statistics(stats):
+    print("{:<24} {:>4} {:>12} {:>14} {:>12} {:>12} {:>12}".format(
+        "region", "dim", "n_elements", "measure", "min_edge", "max_edge", "max_aspect"))
+    for name, reg in stats['regions'].items():
+        aspect = reg.get('aspect_ratio', {}).get('max', None)
+        print("{:<24} {:>4} {:>12} {:>14.6g} {:>12.4g} {:>12.4g} {:>12}".format(
+            name, reg['dim'], reg['n_elements'], reg['measure'], reg.get('min_edge', 0.0), reg.get('max_edge', 0.0),
+            "-" if aspect is None else "{:.4g}".format(aspect)))
+    print("nodes: {} elements: {} max valence: {}".format(
+        stats['n_nodes'], stats['n_elements'], stats['node_valence']['max']))
@@ -0,0 +1,134 @@
+"""
+Instrumentation of the geometry pipeline stages, see make_geometry 'profile' keyword.
+
+Every stage records wall time, the process RSS at the end of the stage, the peak RSS of the process
+so far and the change of the number of objects tracked by the garbage collector. Stages can be nested,
+e.g. interfaces and layers inside the BREP construction; the nested stage is named by the path
+of the stage names: 'construct_brep_geometry/layer 2'.
+
+Optionally the stages of a given name are run under cProfile, the statistics are written to '<report>.<stage>.prof'
+(see pstats, snakeviz).
+
+The report is written as JSON, stages in the order of their start.
+"""
+import os
+import gc
+import sys
+import json
+import time
+import cProfile
+import contextlib
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+
+def current_rss():
+    """
+    Resident set size of the process in bytes, None if not available (only Linux supported).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def peak_rss():
+    """
+    Peak resident set size of the process in bytes, None if not available.
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class Profiler:
+    """
+    Records the stages of the pipeline.
+    Usage:
+        with profiler.stage("call_gmsh"):
+            ...
+    """
+    def __init__(self, cprofile_stage=None, count_objects=True):
+        """
+        :param cprofile_stage: Name (not the path) of the stage to run under cProfile.
+        :param count_objects: Record number of the objects, the gc traversal takes time proportional to the heap size.
+        """
+        self.cprofile_stage = cprofile_stage
+        self.count_objects = count_objects
+        self.stages = []
+        self.profiles = {}
+        self._path = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        self._path.append(name)
+        record = dict(stage="/".join(self._path), depth=len(self._path) - 1)
+        self.stages.append(record)
+        n_objects = len(gc.get_objects()) if self.count_objects else None
+        profile = cProfile.Profile() if name == self.cprofile_stage else None
+        start = time.perf_counter()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield record
+        finally:
+            if profile is not None:
+                profile.disable()
+                self.profiles[record['stage']] = profile
+            record['wall_time'] = time.perf_counter() - start
+            record['rss'] = current_rss()
+            record['peak_rss'] = peak_rss()
+            if self.count_objects:
+                record['n_objects'] = len(gc.get_objects())
+                record['objects_delta'] = record['n_objects'] - n_objects
+            self._path.pop()
+
+    def report(self):
+        return dict(stages=self.stages,
+                    total_time=sum(s.get('wall_time', 0.0) for s in self.stages if s['depth'] == 0),
+                    peak_rss=peak_rss())
+
+    def write_report(self, report_file):
+        """
+        Write the JSON report and the cProfile statistics of the profiled stages
+        to '<report_file without .json>.<stage path>.prof'.
+        :return: The report dict.
+        """
+        report = self.report()
+        base = report_file[:-len(".json")] if report_file.endswith(".json") else report_file
+        prof_files = {}
+        for stage_path, profile in self.profiles.items():
+            prof_file = "{}.{}.prof".format(base, stage_path.replace("/", ".").replace(" ", "_"))
+            profile.dump_stats(prof_file)
+            prof_files[stage_path] = prof_file
+        report['cprofile'] = prof_files
+        with open(report_file, "w") as f:
+            json.dump(report, f, indent=2)
+        return report
+
+    def print_report(self):
+        print("{:<48} {:>10} {:>10} {:>10} {:>12}".format("stage", "time [s]", "RSS [MB]", "peak [MB]", "objects"))
+        for s in self.stages:
+            print("{:<48} {:>10.3f} {:>10} {:>10} {:>12}".format(
+                "  " * s['depth'] + s['stage'].split("/")[-1], s.get('wall_time', 0.0),
+                _mb(s.get('rss')), _mb(s.get('peak_rss')), s.get('objects_delta', '-')))
+
+
+def _mb(n_bytes):
+    return "-" if n_bytes is None else "{:.1f}".format(n_bytes / 2 ** 20)
+
+
+class NoProfiler:
+    """
+    Profiler doing nothing, the default of the LayerGeometry.
+    """
+    @contextlib.contextmanager
+    def stage(self, name):
+        yield None
@@ -0,0 +1,101 @@
+"""
+Dependency tracking of the geometry pipeline for incremental rebuilds, see geometry.make_geometry_incremental.
+
+The BREP geometry and the gmsh shapes depend only on the layers, surfaces, topologies and
+on which layer objects belong to an active region (of which dimension). The rest of the region
+properties (names, mesh steps, assignment of objects to the regions of the same activity) influence just:
+- the characteristic lengths of the gmsh vertices, computed from the origins of the free shapes
+  (see LayerGeometry.set_mesh_steps), gmsh must be called if they change;
+- the physical tags of the elements (see LayerGeometry.physical_id_tables), just the modify_mesh pass.
+
+The state of the last run is kept in the file '<base>.state.pickle' next to the layers file.
+"""
+import os
+import json
+import pickle
+import hashlib
+
+
+STATE_VERSION = 1
+# Change when the stored data or the meaning of the keys change.
+
+
+def brep_key(raw_geometry, flat_mesh=False):
+    """
+    Hash of the geometry data the BREP geometry depends on.
+    :param raw_geometry: gs.LayerGeometry as read from the layers file.
+    :param flat_mesh: The geometry is constructed with flat interfaces, see Interface.init.
+    :return: Hex digest.
+    """
+    data = raw_geometry.serialize()
+    regions = data.pop('regions')
+    data.pop('supplement', None)
+    activity = [(not reg['not_used'], reg['dim']) for reg in regions]
+    for layer in data['layers']:
+        for key in ['node_region_ids', 'segment_region_ids', 'polygon_region_ids']:
+            if key in layer:
+                layer[key] = [activity[i_reg] for i_reg in layer[key]]
+    h = hashlib.sha1()
+    h.update(json.dumps([STATE_VERSION, flat_mesh, data], sort_keys=True).encode())
+    return h.hexdigest()
+
+
+def mesh_key(lg):
+    """
+    Hash of the inputs of the gmsh call, see LayerGeometry.call_gmsh.
+    """
+    h = hashlib.sha1()
+    aabb = [list(map(float, corner)) for corner in lg.aabb]
+    h.update(repr((lg.brep_file, aabb, float(lg.min_step), float(lg.max_step), lg.vtx_char_length)).encode())
+    return h.hexdigest()
+
+
+class RebuildState:
+    """
+    Data of the last geometry run needed to reuse its BREP file and mesh.
+    """
+    def __init__(self, brep_key, lg):
+        """
+        :param brep_key: Result of brep_key.
+        :param lg: LayerGeometry after make_gmsh_shape_dict and call_gmsh.
+        """
+        self.brep_key = brep_key
+        self.brep_file = lg.brep_file
+        self.aabb = lg.aabb
+        self.n_gmsh_shapes = lg.n_gmsh_shapes
+        self.free_origins = lg.free_origins
+        self.vertex_origins = lg.vertex_origins
+        self.mesh_key = mesh_key(lg)
+
+    def restore(self, lg):
+        """
+        Set the shape data to the LayerGeometry constructed from the changed layers file.
+        """
+        lg.brep_file = self.brep_file
+        lg.aabb = self.aabb
+        lg.n_gmsh_shapes = self.n_gmsh_shapes
+        lg.free_origins = self.free_origins
+        lg.vertex_origins = self.vertex_origins
+
+    def is_valid(self, brep_key):
+        return self.brep_key == brep_key and os.path.isfile(self.brep_file)
+
+    @staticmethod
+    def load(state_file):
+        """
+        :return: RebuildState or None if there is no valid state file.
+        """
+        try:
+            with open(state_file, "rb") as f:
+                version, state = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError, AttributeError):
+            return None
+        if version != STATE_VERSION:
+            return None
+        return state
+
+    def save(self, state_file):
+        tmp_file = "{}.{}.tmp".format(state_file, os.getpid())
+        with open(tmp_file, "wb") as f:
+            pickle.dump((STATE_VERSION, self), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, state_file)
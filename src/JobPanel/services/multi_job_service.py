@@ -83,8 +83,9 @@ class JobReport(JsonData):
 class MultiJob(ServiceBase):
     def __init__(self, config):
         self.pipeline = {"python_script": "",
-                         "pipeline_name": ""}
-        """pipeline description"""
+                         "pipeline_name": "",
+                         "process_pool_size": 0}
+        """pipeline description, process_pool_size is number of processes for pure internal actions"""
 
         self.job_service_data = JsonDataNoConstruct()
         """job service data template"""
@@ -193,7 +194,8 @@ class MultiJob(ServiceBase):
         log_level = logging.INFO if self.log_all else logging.WARNING
         self._pipeline_processor = Pipelineprocessor(pipeline, log_level=log_level,
                                                      save_path=GEOMOP_INTERNAL_DIR_NAME,
-                                                     identical_list=identical_list)
+                                                     identical_list=identical_list,
+                                                     process_pool_size=self.pipeline.get("process_pool_size", 0))
 
         # validation
         err = self._pipeline_processor.validate()
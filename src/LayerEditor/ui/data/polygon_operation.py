@@ -155,18 +155,11 @@ class PolygonOperation():
         """Return point id in origin structure"""
         return self.decomposition.points[point_id].index
     
-    def _find_in_polygon(self, diagram, point, polygon_id=None):
+    def _find_in_polygon(self, diagram, point):
         """Find polygon for set point"""
-        if polygon_id is None:
-            polygon_id = self.outer_id
-        childs = self.decomposition.get_childs(polygon_id)
-        for id in childs:
-            if id!=polygon_id:
-                children = self.decomposition.polygons[id].qtpolygon
-                if children.containsPoint(point.qpointf(), QtCore.Qt.OddEvenFill):
-                    return self._find_in_polygon(diagram, point, id)
-        return polygon_id        
-    
+        polygon = self.decomposition.find_polygon((point.x, -point.y))
+        return polygon.id
+
     def _reload_boundary(self, diagram, polygon_id):
         """reload set polygon boundary"""
         spolygon = self._get_spolygon(diagram, polygon_id)
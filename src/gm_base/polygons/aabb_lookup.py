@@ -3,11 +3,16 @@ Dynmaicaly adding end removing AABB (axis aligned bounding boxes).
 Supported operations:
 - closest to point
 - intersecting box
+- crossing vertical ray (point location)
 
-Implementation:
-- linear search with usage of numpy arrays
-Possible improvements using some trees.
+Implementations:
+- AABB_Lookup, linear search with usage of numpy arrays
+- AABB_Tree, dynamic bounding volume hierarchy, logarithmic complexity of all operations
+
+Both classes have the same interface and return the same candidates (sorted by ID),
+so they can be freely interchanged.
 """
+import heapq
 import numpy as np
 #import numpy.linalg as la
 
@@ -46,6 +51,23 @@ class AABB_Lookup:
         self.n_boxes = max(self.n_boxes, id + 1)
         self.boxes[id, :] = box
 
+    def add_objects(self, ids, boxes):
+        """
+        Add or replace objects in bulk.
+        :param ids: Array of object IDs.
+        :param boxes: np array (N, 4), boxes of the objects
+        :return: None
+        """
+        ids = np.asarray(ids, dtype=int)
+        if len(ids) == 0:
+            return
+        max_id = int(np.max(ids))
+        while max_id >= self.boxes.shape[0]:
+            # double the size
+            self.boxes = np.append(self.boxes, np.full(self.boxes.shape, self.inf), axis=0)
+        self.n_boxes = max(self.n_boxes, max_id + 1)
+        self.boxes[ids, :] = boxes
+
     def rm_object(self, id):
         self.boxes[id, :] = self.inf
 
@@ -59,7 +81,7 @@ class AABB_Lookup:
         boxes = self.boxes[:self.n_boxes, :]
         if boxes.shape[0] == 0 :
             return []
-        inf_dists = np.max(np.maximum(self.boxes[:, 0:2] - point, point - self.boxes[:, 2:4]), axis=1)
+        inf_dists = np.max(np.maximum(boxes[:, 0:2] - point, point - boxes[:, 2:4]), axis=1)
         if np.amin(inf_dists) > 0.0:
             i_closest = np.argmin(inf_dists)
             c_boxes = boxes[i_closest:i_closest+1, :]
@@ -85,4 +107,407 @@ class AABB_Lookup:
                             box[2: 4] < boxes[:, 0:2],
                             boxes[:, 2:4] < box[0:2])
         not_intersect = np.logical_or(not_intersect[:,0], not_intersect[:,1])
-        return np.where( np.logical_not(not_intersect) )[0]
\ No newline at end of file
+        return np.where( np.logical_not(not_intersect) )[0]
+
+    def ray_candidates(self, point):
+        """
+        Yields (id, min_y) for boxes crossing the vertical ray going up from the given point,
+        in increasing order of 'min_y', the lower bound of the ray intersection with the box.
+        :param point: np array [x,y]
+        """
+        boxes = self.boxes[:self.n_boxes, :]
+        x, y = point[0], point[1]
+        ids = np.where((boxes[:, 0] <= x) & (x <= boxes[:, 2]) & (y <= boxes[:, 3]))[0]
+        min_y = np.maximum(boxes[ids, 1], y)
+        order = np.argsort(min_y, kind='mergesort')
+        for id, box_y in zip(ids[order].tolist(), min_y[order].tolist()):
+            yield (id, box_y)
+
+
+_small_subtree = 32
+# Max number of leafs of a subtree built without numpy.
+
+
+def _union(a, b):
+    # Union of two boxes given as tuples (min_x, min_y, max_x, max_y).
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+class AABB_Tree:
+    """
+    Dynamic bounding volume hierarchy, same interface as AABB_Lookup.
+
+    Leafs of the binary tree are boxes of the objects, inner nodes keep union box of their childs.
+    Insertion descends to the sibling with minimal increase of the box perimeter, the tree is kept
+    balanced by rotations (see the dynamic AABB tree of the Box2D library).
+    Nodes are stored in lists indexed by node index, released nodes are reused.
+    """
+    def __init__(self, infty = 1e50, init_size=128):
+        # 'infty' and 'init_size' are unused, kept for compatibility with AABB_Lookup.
+        self.inf = infty
+        self.box = []
+        # node -> box tuple (min_x, min_y, max_x, max_y)
+        self.parent = []
+        # node -> parent node, -1 for the root
+        self.childs = []
+        # node -> [left, right] child nodes, None for leafs
+        self.height = []
+        # node -> height of the subtree, 0 for leafs
+        self.obj_id = []
+        # node -> object ID for leafs
+        self._free_nodes = []
+        self.root = -1
+        self.leafs = {}
+        # object ID -> leaf node
+
+    @property
+    def n_boxes(self):
+        return len(self.leafs)
+
+    def add_object(self, id, box):
+        """
+        Add a new object as set of boxes. Any original box with same ID is replaced.
+        :param id: Object ID.
+        :param box: np array [min_x, min_y, max_x, max_y]
+        :return: None
+        """
+        if id in self.leafs:
+            self.rm_object(id)
+        leaf = self._new_node(tuple(float(x) for x in box))
+        self.obj_id[leaf] = id
+        self.leafs[id] = leaf
+        self._insert_leaf(leaf)
+
+    def add_objects(self, ids, boxes):
+        """
+        Add or replace objects in bulk.
+        An empty tree is built top-down by median splits of box centers along the longer axis,
+        that is faster and produce better tree then repeated insertion.
+        :param ids: Array of object IDs.
+        :param boxes: np array (N, 4), boxes of the objects
+        :return: None
+        """
+        ids = np.asarray(ids, dtype=int).tolist()
+        boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        if self.root != -1 or len(set(ids)) != len(ids):
+            for id, box in zip(ids, boxes):
+                self.add_object(id, box)
+            return
+        if not ids:
+            return
+
+        leafs = []
+        for id, box in zip(ids, boxes.tolist()):
+            leaf = self._new_node(tuple(box))
+            self.obj_id[leaf] = id
+            self.leafs[id] = leaf
+            leafs.append(leaf)
+        centers = (boxes[:, 0:2] + boxes[:, 2:4]) / 2
+        self.root = self._build_subtree(np.array(leafs), centers)
+        self.parent[self.root] = -1
+
+    def _build_subtree(self, leafs, centers):
+        """
+        Build subtree over given leafs.
+        :param leafs: array of leaf nodes
+        :param centers: array (N, 2) of centers of the leaf boxes
+        :return: root of the subtree
+        """
+        if len(leafs) <= _small_subtree:
+            return self._build_small_subtree(leafs.tolist(), centers.tolist())
+        axis = int(np.argmax(np.max(centers, axis=0) - np.min(centers, axis=0)))
+        order = np.argsort(centers[:, axis], kind='mergesort')
+        half = len(leafs) // 2
+        childs = [ self._build_subtree(leafs[part], centers[part]) for part in (order[:half], order[half:]) ]
+        return self._join_subtrees(childs)
+
+    def _build_small_subtree(self, leafs, centers):
+        """
+        Same as _build_subtree for lists, avoids numpy overhead for small subtrees.
+        """
+        if len(leafs) == 1:
+            return leafs[0]
+        xs = [c[0] for c in centers]
+        ys = [c[1] for c in centers]
+        axis = 0 if max(xs) - min(xs) >= max(ys) - min(ys) else 1
+        order = sorted(range(len(leafs)), key=lambda i: centers[i][axis])
+        half = len(leafs) // 2
+        childs = [ self._build_small_subtree([leafs[i] for i in part], [centers[i] for i in part])
+                   for part in (order[:half], order[half:]) ]
+        return self._join_subtrees(childs)
+
+    def _join_subtrees(self, childs):
+        node = self._new_node(_union(self.box[childs[0]], self.box[childs[1]]))
+        self.childs[node] = childs
+        self.height[node] = 1 + max(self.height[childs[0]], self.height[childs[1]])
+        for child in childs:
+            self.parent[child] = node
+        return node
+
+    def rm_object(self, id):
+        leaf = self.leafs.pop(id, None)
+        if leaf is None:
+            return
+        self._remove_leaf(leaf)
+        self._free_nodes.append(leaf)
+
+    def closest_candidates(self, point):
+        """
+        Return IDs of boxes that may contain boxes closest to the given point
+        in L2 norm. Same result as AABB_Lookup.closest_candidates.
+        :param point: np array [x,y]
+        :return: Array of IDs.
+        """
+        if self.root == -1:
+            return []
+        x, y = float(point[0]), float(point[1])
+        c_leafs = self._query_box(x, y, x, y)
+        if not c_leafs:
+            c_leafs = [self._closest_leaf(x, y)]
+        # Max distance of closest boxes
+        box = self.box
+        l_inf_max = max(max(x - box[i][0], y - box[i][1], box[i][2] - x, box[i][3] - y) for i in c_leafs)
+        l2_max = np.sqrt(2) * l_inf_max
+        leafs = self._query_inf_dist(x, y, l2_max)
+        return self._to_ids(leafs)
+
+    def intersect_candidates(self, box):
+        """
+        :param box: np array [min_x, min_y, max_x, max_y]
+        :return: Array of ids of boxes that intersect with given box.
+        """
+        if self.root == -1:
+            return np.array([], dtype=int)
+        x0, y0, x1, y1 = (float(x) for x in box)
+        leafs = self._query_box(x0, y0, x1, y1)
+        return self._to_ids(leafs)
+
+    def ray_candidates(self, point):
+        """
+        Yields (id, min_y) for boxes crossing the vertical ray going up from the given point,
+        in increasing order of 'min_y', the lower bound of the ray intersection with the box.
+        Nodes are visited best first, so the caller can stop after few candidates.
+        :param point: np array [x,y]
+        """
+        if self.root == -1:
+            return
+        x, y = float(point[0]), float(point[1])
+        box, childs = self.box, self.childs
+        heap = []
+        nodes = [self.root]
+        while True:
+            for node in nodes:
+                b0, b1, b2, b3 = box[node]
+                if b0 <= x <= b2 and y <= b3:
+                    heapq.heappush(heap, (b1 if b1 > y else y, node))
+            if not heap:
+                return
+            min_y, node = heapq.heappop(heap)
+            nodes = childs[node]
+            if nodes is None:
+                nodes = ()
+                yield (self.obj_id[node], min_y)
+
+    ###########################
+    # Queries.
+
+    def _to_ids(self, leafs):
+        ids = [self.obj_id[i] for i in leafs]
+        ids.sort()
+        return np.array(ids, dtype=int)
+
+    def _query_box(self, x0, y0, x1, y1):
+        """
+        Return leafs with boxes intersecting the closed box [x0, y0, x1, y1].
+        """
+        box, childs = self.box, self.childs
+        result = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            b0, b1, b2, b3 = box[node]
+            if x1 < b0 or y1 < b1 or b2 < x0 or b3 < y0:
+                continue
+            if childs[node] is None:
+                result.append(node)
+            else:
+                stack.extend(childs[node])
+        return result
+
+    def _query_inf_dist(self, x, y, dist):
+        """
+        Return leafs with boxes in L_inf distance from point (x, y) less then 'dist'.
+        """
+        box, childs = self.box, self.childs
+        result = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            b0, b1, b2, b3 = box[node]
+            if not (b0 - x < dist and b1 - y < dist and x - b2 < dist and y - b3 < dist):
+                continue
+            if childs[node] is None:
+                result.append(node)
+            else:
+                stack.extend(childs[node])
+        return result
+
+    def _closest_leaf(self, x, y):
+        """
+        Leaf with minimal L_inf distance of its box from the point (x, y).
+        Ties are resolved by the smallest object ID, same as numpy.argmin in AABB_Lookup.
+        """
+        def inf_dist(b):
+            return max(b[0] - x, b[1] - y, x - b[2], y - b[3])
+
+        best = (np.inf, None, -1)
+        heap = [(inf_dist(self.box[self.root]), self.root)]
+        while heap:
+            dist, node = heapq.heappop(heap)
+            if dist > best[0]:
+                break
+            childs = self.childs[node]
+            if childs is None:
+                candidate = (dist, self.obj_id[node], node)
+                if best[1] is None or candidate[0:2] < best[0:2]:
+                    best = candidate
+            else:
+                for child in childs:
+                    heapq.heappush(heap, (inf_dist(self.box[child]), child))
+        return best[2]
+
+    ###########################
+    # Tree modifications.
+
+    def _new_node(self, box):
+        if self._free_nodes:
+            node = self._free_nodes.pop()
+            self.box[node] = box
+            self.parent[node] = -1
+            self.childs[node] = None
+            self.height[node] = 0
+            self.obj_id[node] = None
+        else:
+            node = len(self.box)
+            self.box.append(box)
+            self.parent.append(-1)
+            self.childs.append(None)
+            self.height.append(0)
+            self.obj_id.append(None)
+        return node
+
+    def _replace_child(self, parent, old, new):
+        if parent == -1:
+            self.root = new
+        else:
+            childs = self.childs[parent]
+            childs[childs.index(old)] = new
+
+    def _insert_leaf(self, leaf):
+        if self.root == -1:
+            self.root = leaf
+            self.parent[leaf] = -1
+            return
+
+        # Find the best sibling, inlined perimeter computations for speed.
+        l0, l1, l2, l3 = l_box = self.box[leaf]
+        box, childs = self.box, self.childs
+        node = self.root
+        while childs[node] is not None:
+            n0, n1, n2, n3 = box[node]
+            # perimeter of union, conditional expressions are much faster then min/max builtins
+            combined = ((n2 if n2 > l2 else l2) - (n0 if n0 < l0 else l0)
+                        + (n3 if n3 > l3 else l3) - (n1 if n1 < l1 else l1))
+            cost = 2.0 * combined
+            # Minimum cost of pushing the leaf further down the tree.
+            inherit_cost = 2.0 * (combined - (n2 - n0 + n3 - n1))
+            child_costs = []
+            for child in childs[node]:
+                c0, c1, c2, c3 = box[child]
+                c_cost = ((c2 if c2 > l2 else l2) - (c0 if c0 < l0 else l0)
+                          + (c3 if c3 > l3 else l3) - (c1 if c1 < l1 else l1) + inherit_cost)
+                if childs[child] is not None:
+                    c_cost -= c2 - c0 + c3 - c1
+                child_costs.append(c_cost)
+            if cost < child_costs[0] and cost < child_costs[1]:
+                break
+            node = childs[node][0] if child_costs[0] < child_costs[1] else childs[node][1]
+        sibling = node
+
+        # Create a new parent.
+        old_parent = self.parent[sibling]
+        new_parent = self._new_node(_union(l_box, self.box[sibling]))
+        self.parent[new_parent] = old_parent
+        self.height[new_parent] = -1    # force refit in _fix_upwards
+        self._replace_child(old_parent, sibling, new_parent)
+        self.childs[new_parent] = [sibling, leaf]
+        self.parent[sibling] = new_parent
+        self.parent[leaf] = new_parent
+        self._fix_upwards(new_parent)
+
+    def _remove_leaf(self, leaf):
+        if leaf == self.root:
+            self.root = -1
+            return
+        parent = self.parent[leaf]
+        grand_parent = self.parent[parent]
+        p_childs = self.childs[parent]
+        sibling = p_childs[1] if p_childs[0] == leaf else p_childs[0]
+        self._replace_child(grand_parent, parent, sibling)
+        self.parent[sibling] = grand_parent
+        self.childs[parent] = None
+        self._free_nodes.append(parent)
+        if grand_parent != -1:
+            self._fix_upwards(grand_parent)
+
+    def _update_node(self, node):
+        """
+        Refit height and box of an inner node.
+        :return: True if the node has changed.
+        """
+        a, b = self.childs[node]
+        height = 1 + max(self.height[a], self.height[b])
+        box = _union(self.box[a], self.box[b])
+        changed = height != self.height[node] or box != self.box[node]
+        self.height[node] = height
+        self.box[node] = box
+        return changed
+
+    def _fix_upwards(self, node):
+        # Rebalance and refit boxes from 'node' up to the root.
+        # Stop as soon as a node is not changed, since its ancestors are unchanged as well.
+        while node != -1:
+            balanced = self._balance(node)
+            if not self._update_node(balanced) and balanced == node:
+                return
+            node = self.parent[balanced]
+
+    def _balance(self, a):
+        """
+        Perform a left or right rotation if the node 'a' is imbalanced.
+        :return: The new root of the subtree.
+        """
+        if self.childs[a] is None or self.height[a] < 2:
+            return a
+        b, c = self.childs[a]
+        balance = self.height[c] - self.height[b]
+        if -1 <= balance <= 1:
+            return a
+        # Rotate the higher child 'up' up.
+        up, i_up = (c, 1) if balance > 1 else (b, 0)
+        f, g = self.childs[up]
+        self.childs[up][0] = a
+        self.parent[up] = self.parent[a]
+        self.parent[a] = up
+        self._replace_child(self.parent[up], a, up)
+        # Keep the higher grandchild under 'up', give the lower one to 'a'.
+        if self.height[f] > self.height[g]:
+            keep, move = f, g
+        else:
+            keep, move = g, f
+        self.childs[up][1] = keep
+        self.childs[a][i_up] = move
+        self.parent[move] = a
+        self._update_node(a)
+        self._update_node(up)
+        return up
@@ -0,0 +1,58 @@
+"""
+Growable numpy arrays with rows indexed by object IDs.
+Used as the structure of arrays backing store of the Decomposition: point coordinates and
+segment end point IDs are kept in contiguous arrays, Point and Segment objects are thin views
+to their rows. This allows vectorized operations over all points or segments.
+"""
+import numpy as np
+
+
+class ArrayStore:
+    def __init__(self, row_shape, dtype, fill, init_size=64):
+        """
+        :param row_shape: Shape of a single row, e.g. (2,) for XY coordinates.
+        :param dtype: numpy dtype of the array
+        :param fill: Value of unused rows.
+        :param init_size: Initial number of rows.
+        """
+        self.fill = fill
+        self.array = np.full((init_size,) + tuple(row_shape), fill, dtype=dtype)
+        self.size = 0
+        # Max used ID + 1.
+
+    def _reserve(self, size):
+        capacity = self.array.shape[0]
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        new_array = np.full((capacity,) + self.array.shape[1:], self.fill, dtype=self.array.dtype)
+        new_array[:self.array.shape[0]] = self.array
+        self.array = new_array
+
+    def __getitem__(self, id):
+        return self.array[id]
+
+    def __setitem__(self, id, value):
+        """
+        Set row (or rows for an array of IDs), the store is extended if necessary.
+        """
+        if np.ndim(id) > 0:
+            if len(id) == 0:
+                return
+            max_id = int(np.max(id))
+        else:
+            max_id = id
+        self._reserve(max_id + 1)
+        self.size = max(self.size, max_id + 1)
+        self.array[id] = value
+
+    def clear(self, id):
+        self.array[id] = self.fill
+
+    @property
+    def data(self):
+        """
+        Rows of all IDs up to the max used ID, unused rows contains the fill value.
+        """
+        return self.array[:self.size]
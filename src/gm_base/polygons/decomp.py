@@ -1,5 +1,7 @@
 import enum
+import numpy as np
 import gm_base.polygons.idmap as idmap
+import gm_base.polygons.array_store as array_store
 from .point import Point
 from .segment import Segment, right_side, left_side, out_vtx, in_vtx
 from .polygon import Polygon, Wire
@@ -56,6 +58,10 @@ class Decomposition:
         # Points dictionary ID -> Point
         self.segments = idmap.IdMap()
         # Segmants dictionary ID - > Segmant
+        self.points_xy = array_store.ArrayStore((2,), float, np.nan)
+        # Coordinates of the points, row 'id' for the point with ID 'id', NaN for unused IDs.
+        self.segments_vtxs = array_store.ArrayStore((2,), int, -1)
+        # Point IDs of the segment ends (out_vtx, in_vtx), row 'id' for the segment with ID 'id', -1 for unused IDs.
         self.pt_to_seg = {}
         # dict (a.id, b.id) -> segment
         self.wires = idmap.IdMap()
@@ -161,15 +167,38 @@ class Decomposition:
         :return: Point instance
         """
 
-        pt = Point(point, poly)
+        if id is None:
+            id = self.points.get_new_id()
+        pt = Point(point, poly, xy_store=self.points_xy, row=id)
         self.points.append(pt, id)
         poly.free_points.add(pt)
         return pt
 
+    def add_free_points(self, points, poly):
+        """
+        Bulk version of add_free_point, the points get consecutive IDs following the last used ID.
+        :param points: Array (N, 2) of XY coordinates.
+        :return: List of Point instances.
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if len(points) == 0:
+            return []
+        first_id = self.points.get_new_id()
+        ids = np.arange(first_id, first_id + len(points))
+        self.points_xy[ids] = points
+        pts = []
+        for id in ids.tolist():
+            pt = Point(None, poly, xy_store=self.points_xy, row=id)
+            self.points.append(pt, id)
+            pts.append(pt)
+        poly.free_points.update(pts)
+        return pts
+
     def remove_free_point(self, point):
         assert point.poly is not None
         assert point.segment[0] is None
         point.poly.free_points.remove(point)
+        self.points_xy.clear(point.id)
         del self.points[point.id]
 
 
@@ -268,8 +297,7 @@ class Decomposition:
         self.pt_to_seg[(seg.vtxs[0].id, mid_pt.id)] = seg
 
         new_seg = self._make_segment((mid_pt, seg.vtxs[in_vtx]))
-        seg.vtxs[in_vtx] = mid_pt
-        seg._vector = seg.vtxs[in_vtx].xy - seg.vtxs[out_vtx].xy
+        self._set_segment_vtx(seg, in_vtx, mid_pt)
         new_seg.connect_vtx(out_vtx, seg_tip_insert)
         if b_seg_insert is None:
             assert seg.is_dendrite()
@@ -303,7 +331,7 @@ class Decomposition:
         seg1.disconnect_vtx(seg1_in_vtx)
         seg1.disconnect_vtx(seg1_out_vtx)
         seg0.disconnect_vtx(seg0_in_vtx)
-        seg0.vtxs[seg0_in_vtx] = seg1.vtxs[seg1_in_vtx]
+        self._set_segment_vtx(seg0, seg0_in_vtx, seg1.vtxs[seg1_in_vtx])
         if b_seg1_insert is None:
             assert seg0.is_dendrite()
             seg0.connect_free_vtx(seg0_in_vtx, seg0.wire[out_vtx])
@@ -640,19 +668,52 @@ class Decomposition:
 
         seg = Segment(points)
         self.segments.append(seg)
+        self.segments_vtxs[seg.id] = seg.point_ids()
         for vtx in [out_vtx, in_vtx]:
             seg.vtxs[vtx].join_segment(seg, vtx)
         self.pt_to_seg[seg.point_ids()] = seg
         return seg
 
+    def _make_segments(self, point_ids):
+        """
+        Bulk version of _make_segment, the segments get consecutive IDs following the last used ID.
+        Wires of the segments are not set.
+        :param point_ids: Array (N, 2) of IDs of the end points (out_vtx, in_vtx).
+        :return: List of Segment instances.
+        """
+        point_ids = np.asarray(point_ids, dtype=int).reshape(-1, 2)
+        if len(point_ids) == 0:
+            return []
+        assert np.all(point_ids[:, out_vtx] != point_ids[:, in_vtx])
+        first_id = self.segments.get_new_id()
+        ids = np.arange(first_id, first_id + len(point_ids))
+        self.segments_vtxs[ids] = point_ids
+        points = self.points
+        segs = []
+        for id, (a, b) in zip(ids.tolist(), point_ids.tolist()):
+            seg = Segment((points[a], points[b]))
+            self.segments.append(seg, id)
+            points[a].join_segment(seg, out_vtx)
+            points[b].join_segment(seg, in_vtx)
+            self.pt_to_seg[(a, b)] = seg
+            segs.append(seg)
+        return segs
+
     def _destroy_segment(self, seg):
         seg.vtxs[out_vtx].rm_segment(seg, out_vtx)
         seg.vtxs[in_vtx].rm_segment(seg, in_vtx)
         a, b = seg.point_ids()
         self.pt_to_seg.pop((a, b), None)
         self.pt_to_seg.pop((b, a), None)
+        self.segments_vtxs.clear(seg.id)
         del self.segments[seg.id]
 
+    def _set_segment_vtx(self, seg, vtx, point):
+        # Change end point of the segment.
+        seg.vtxs[vtx] = point
+        self.segments_vtxs.array[seg.id, vtx] = point.id
+        seg.update_vector()
+
 
 
 
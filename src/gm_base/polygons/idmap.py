@@ -6,6 +6,8 @@ TODO: Make auxiliary class for producing IDs and allow
 several IdMaps to source from common ID source
 """
 class IdObject:
+    __slots__ = ()
+
     def __hash__(self):
         return self.id
 
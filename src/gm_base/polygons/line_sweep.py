@@ -0,0 +1,346 @@
+"""
+Bulk construction of a planar subdivision from a set of line segments.
+Used by PolygonDecomposition.add_lines as an alternative to adding lines one by one.
+
+Algorithm:
+1. Sweep along X axis over sorted segment boxes to get candidate pairs with overlapping boxes,
+   compute intersections of all candidate pairs at once using numpy.
+2. Snap all end points and intersection points within the tolerance in a single pass
+   using a hash grid with cell size equal to the tolerance.
+3. Split segments by snapped nodes, make unique edges.
+4. Make the planar graph: sort edges around nodes by angle, link half edges into wires,
+   classify wires by signed area (outer wires of polygons vs. holes) and place holes
+   into polygons.
+
+The result is given in the same form as produced by polygons_io.serialize, so it can be passed
+to the same construction methods of PolygonDecomposition.
+"""
+import numpy as np
+import gm_base.polygons.aabb_lookup as aabb_lookup
+
+
+def line_boxes(lines, margin):
+    """
+    :param lines: array (N, 2, 2), lines[i] = [A, B]
+    :param margin: width of added margin
+    :return: boxes array (N, 4): [min_x, min_y, max_x, max_y]
+    """
+    boxes = np.concatenate((np.min(lines, axis=1), np.max(lines, axis=1)), axis=1)
+    boxes += margin * aabb_lookup._blow_box
+    return boxes
+
+
+def candidate_pairs(boxes, chunk_size=1024):
+    """
+    Sweep along X axis. Boxes are sorted by min X, for every box we take all following
+    boxes with min X within its X range and keep those overlapping in Y.
+    Processed in chunks to bound memory.
+    :param boxes: array (N, 4)
+    :return: array (K, 2) of pairs of indices i < j of intersecting boxes.
+    """
+    n_boxes = len(boxes)
+    order = np.argsort(boxes[:, 0], kind='mergesort')
+    sorted_min_x = boxes[order, 0]
+    ends = np.searchsorted(sorted_min_x, boxes[order, 2], side='right')
+    pairs = []
+    for chunk_start in range(0, n_boxes, chunk_size):
+        pos = np.arange(chunk_start, min(chunk_start + chunk_size, n_boxes))
+        counts = ends[pos] - pos - 1
+        counts = np.maximum(counts, 0)
+        first = np.repeat(pos, counts)
+        # offsets 1 .. counts[k] for every position
+        offsets = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+        second = first + offsets
+        i_box, j_box = order[first], order[second]
+        y_overlap = np.logical_and(boxes[i_box, 1] <= boxes[j_box, 3], boxes[j_box, 1] <= boxes[i_box, 3])
+        i_box, j_box = i_box[y_overlap], j_box[y_overlap]
+        pairs.append(np.stack((np.minimum(i_box, j_box), np.maximum(i_box, j_box)), axis=1))
+    if not pairs:
+        return np.zeros((0, 2), dtype=int)
+    return np.concatenate(pairs, axis=0)
+
+
+def _cross(a, b):
+    return a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0]
+
+
+def pair_splits(lines, pairs, tolerance):
+    """
+    Compute split points of all candidate pairs.
+    - intersection points of crossing segments
+    - projections of end points closer to other segment then tolerance (T-junctions, collinear overlaps)
+
+    :return: (seg_idx, t, points, point_idx)
+        split parameter 't' of the segment 'seg_idx' at the point 'points[point_idx]'.
+    """
+    i, j = pairs[:, 0], pairs[:, 1]
+    a_i, a_j = lines[i, 0], lines[j, 0]
+    d_i, d_j = lines[i, 1] - a_i, lines[j, 1] - a_j
+    eps = 1e-10
+
+    # Crossings.
+    denom = _cross(d_i, d_j)
+    ab = a_j - a_i
+    len_prod = np.linalg.norm(d_i, axis=1) * np.linalg.norm(d_j, axis=1)
+    non_parallel = np.abs(denom) > eps * len_prod
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t0 = np.where(non_parallel, _cross(ab, d_j) / denom, -1.0)
+        t1 = np.where(non_parallel, _cross(ab, d_i) / denom, -1.0)
+    cross = non_parallel & (-eps <= t0) & (t0 <= 1 + eps) & (-eps <= t1) & (t1 <= 1 + eps)
+    t0, t1 = np.clip(t0[cross], 0.0, 1.0), np.clip(t1[cross], 0.0, 1.0)
+    x_points = a_i[cross] + t0[:, None] * d_i[cross]
+    n_cross = len(x_points)
+    seg_idx = [i[cross], j[cross]]
+    params = [t0, t1]
+    pt_idx = [np.arange(n_cross), np.arange(n_cross)]
+    points = [x_points]
+    n_points = n_cross
+
+    # End points close to the other segment.
+    for seg, other in [(i, j), (j, i)]:
+        a, d = lines[seg, 0], lines[seg, 1] - lines[seg, 0]
+        d2 = np.sum(d * d, axis=1)
+        d2_safe = np.where(d2 > 0, d2, 1.0)
+        for vtx in [0, 1]:
+            pt = lines[other, vtx]
+            t = np.clip(np.sum((pt - a) * d, axis=1) / d2_safe, 0.0, 1.0)
+            proj = a + t[:, None] * d
+            near = (d2 > 0) & (np.linalg.norm(proj - pt, axis=1) < tolerance)
+            n_near = np.sum(near)
+            seg_idx.append(seg[near])
+            params.append(t[near])
+            pt_idx.append(np.arange(n_points, n_points + n_near))
+            points.append(proj[near])
+            n_points += n_near
+
+    return (np.concatenate(seg_idx), np.concatenate(params),
+            np.concatenate(points, axis=0), np.concatenate(pt_idx))
+
+
+def snap_points(points, tolerance):
+    """
+    Merge points closer then tolerance, using union-find over a hash grid.
+    Every cluster is represented by its point with the lowest index.
+    :param points: array (N, 2)
+    :return: (rep, node_of_point) rep - indices of representing points, sorted;
+        node_of_point - index of the cluster (into rep) for every point.
+    """
+    n_points = len(points)
+    parent = list(range(n_points))
+
+    def find(i):
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    if tolerance > 0:
+        cells = np.floor(points / tolerance).astype(int).tolist()
+        xy = points.tolist()
+        grid = {}
+        tol2 = tolerance * tolerance
+        for i_pt, (cx, cy) in enumerate(cells):
+            x, y = xy[i_pt]
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    for j_pt in grid.get((cx + dx, cy + dy), ()):
+                        ox, oy = xy[j_pt]
+                        if (ox - x) ** 2 + (oy - y) ** 2 < tol2:
+                            ri, rj = find(i_pt), find(j_pt)
+                            if ri != rj:
+                                parent[max(ri, rj)] = min(ri, rj)
+            grid.setdefault((cx, cy), []).append(i_pt)
+
+    else:
+        # Merge just identical points.
+        first_of = {}
+        for i_pt, xy in enumerate(map(tuple, points.tolist())):
+            parent[i_pt] = first_of.setdefault(xy, i_pt)
+
+    roots = np.array([find(i) for i in range(n_points)], dtype=int)
+    rep, node_of_point = np.unique(roots, return_inverse=True)
+    return rep, node_of_point
+
+
+def split_lines(lines, tolerance, stop_on_snap=False):
+    """
+    Compute all intersections and snapping of the lines.
+    :param lines: array (N, 2, 2)
+    :param tolerance: snapping distance
+    :param stop_on_snap: If True, return None when a snapping is detected, before the edges are made.
+    :return: (nodes, edges, line_edges, line_nodes, snapped)
+        nodes - array (M, 2) node coordinates
+        edges - array (K, 2) of node indices, unique edges
+        line_edges - for every line the list of (edge, reversed) pairs in the order from A to B
+        line_nodes - array (N, 2), nodes of the line end points
+        snapped - True if any snapping within tolerance happened: distinct points merged
+            or a split point closer then tolerance (in the segment parameter) to the segment end.
+            Result of the incremental construction (add_line) then depends on the order of the lines
+            and may differ.
+    """
+    n_lines = len(lines)
+    pairs = candidate_pairs(line_boxes(lines, tolerance))
+    x_seg, x_t, x_points, x_pt = pair_splits(lines, pairs, tolerance)
+
+    # End points first, in order of lines, then split points.
+    end_points = lines.reshape(-1, 2)
+    all_points = np.concatenate((end_points, x_points), axis=0)
+    rep, node_of_point = snap_points(all_points, tolerance)
+    nodes = all_points[rep]
+    eps_t = 1e-10
+    eps_dist = eps_t * max(1.0, float(np.max(np.abs(all_points)))) if len(all_points) else 0.0
+    snapped = bool(np.any(np.linalg.norm(all_points - nodes[node_of_point], axis=1) > eps_dist)
+                   or np.any((eps_t < x_t) & (x_t < tolerance)) or np.any((1 - tolerance < x_t) & (x_t < 1 - eps_t)))
+    if snapped and stop_on_snap:
+        return None
+
+    seg_idx = np.concatenate((np.repeat(np.arange(n_lines), 2), x_seg))
+    params = np.concatenate((np.tile([0.0, 1.0], n_lines), x_t))
+    seg_nodes = np.concatenate((node_of_point[:2 * n_lines], node_of_point[2 * n_lines + x_pt]))
+    order = np.lexsort((params, seg_idx))
+    seg_idx, seg_nodes = seg_idx[order], seg_nodes[order]
+    starts = np.searchsorted(seg_idx, np.arange(n_lines + 1))
+
+    edge_dict = {}
+    edges = []
+    line_edges = []
+    for i_line in range(n_lines):
+        line_div = []
+        last = None
+        for node in seg_nodes[starts[i_line]:starts[i_line + 1]].tolist():
+            if node == last:
+                continue
+            if last is not None:
+                key = (min(last, node), max(last, node))
+                edge = edge_dict.get(key, None)
+                if edge is None:
+                    edge = edge_dict[key] = len(edges)
+                    edges.append((last, node))
+                line_div.append((edge, edges[edge][0] != last))
+            last = node
+        line_edges.append(line_div)
+    line_nodes = node_of_point[:2 * n_lines].reshape(-1, 2)
+    return nodes, np.array(edges, dtype=int).reshape(-1, 2), line_edges, line_nodes, snapped
+
+
+def _wire_ray_crossings(xy, wire_xy):
+    """
+    Number of crossings of the horizontal half line starting at 'xy' with the closed wire.
+    Same rule as Segment.is_on_x_line.
+    """
+    a = wire_xy
+    b = np.roll(wire_xy, -1, axis=0)
+    x, y = xy
+    in_y = ((a[:, 1] <= y) & (y < b[:, 1])) | ((b[:, 1] <= y) & (y < a[:, 1]))
+    a, b = a[in_y], b[in_y]
+    x_isec = a[:, 0] + (y - a[:, 1]) * (b[:, 0] - a[:, 0]) / (b[:, 1] - a[:, 1])
+    return np.sum(x_isec > x)
+
+
+def make_polygons(nodes, edges, free_nodes=()):
+    """
+    Make wires and polygons of the planar graph.
+    :param nodes: array (M, 2)
+    :param edges: array (K, 2) of node indices, edge is oriented from out_vtx to in_vtx
+    :param free_nodes: nodes not connected to any edge
+    :return: List of polygons, polygon 0 is the outer polygon. Every polygon is a tuple
+        (outer_wire, holes, free_nodes), wires are lists of edge indices in the order of the wire.
+    """
+    n_edges = len(edges)
+    # Half edge h = 2 * edge + side, it ends in the vertex edges[edge][side],
+    # side 1 (left_side) goes from out_vtx to in_vtx.
+    h_edge = np.repeat(np.arange(n_edges), 2)
+    h_side = np.tile([0, 1], n_edges)
+    h_end = edges[h_edge, h_side]
+    h_origin = edges[h_edge, 1 - h_side]
+    vec = nodes[h_end] - nodes[h_origin]
+    angle = np.arctan2(vec[:, 1], vec[:, 0])
+
+    # Next half edge is the first outgoing half edge clock wise from the twin.
+    order = np.lexsort((angle, h_origin))
+    pos = np.empty_like(order)
+    pos[order] = np.arange(len(order))
+    block_start = np.searchsorted(h_origin[order], h_origin)
+    block_end = np.searchsorted(h_origin[order], h_origin, side='right')
+    twin = np.arange(2 * n_edges) ^ 1
+    twin_pos = pos[twin]
+    prev_pos = np.where(twin_pos == block_start[twin], block_end[twin] - 1, twin_pos - 1)
+    h_next = order[prev_pos].tolist()
+
+    # Trace wires.
+    visited = np.zeros(2 * n_edges, dtype=bool)
+    wires = []
+    for h_start in range(2 * n_edges):
+        if visited[h_start]:
+            continue
+        wire = []
+        h = h_start
+        while not visited[h]:
+            visited[h] = True
+            wire.append(h)
+            h = h_next[h]
+        wires.append(wire)
+
+    # Connected components.
+    comp_parent = list(range(len(nodes)))
+
+    def find(i):
+        while comp_parent[i] != i:
+            comp_parent[i] = comp_parent[comp_parent[i]]
+            i = comp_parent[i]
+        return i
+    for a, b in edges.tolist():
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            comp_parent[max(ra, rb)] = min(ra, rb)
+
+    polygons = [([], [], [])]
+    outer_wires = []
+    holes = []
+    for wire in wires:
+        wire_xy = nodes[h_end[wire]]
+        area = np.sum(_cross(np.roll(wire_xy, 1, axis=0), wire_xy))
+        component = find(int(h_end[wire[0]]))
+        edge_ids = _wire_edge_ids(h_edge[wire].tolist())
+        # Tree wire (all edges on both sides) has zero area up to rounding errors.
+        is_tree = 2 * len(set(edge_ids)) == len(edge_ids)
+        if area > 0 and not is_tree:
+            polygons.append((edge_ids, [], []))
+            outer_wires.append((len(polygons) - 1, component, wire_xy, area / 2))
+        else:
+            holes.append((edge_ids, component, wire_xy[0]))
+
+    # Place holes and free points into the smallest containing polygon.
+    lookup = aabb_lookup.AABB_Tree()
+    for i_outer, (i_poly, component, wire_xy, area) in enumerate(outer_wires):
+        lookup.add_object(i_outer, aabb_lookup.make_aabb(wire_xy))
+
+    def locate(xy, component):
+        best = (np.inf, 0)
+        for i_outer in lookup.intersect_candidates(np.concatenate((xy, xy))):
+            i_poly, w_component, wire_xy, area = outer_wires[i_outer]
+            if w_component == component or area >= best[0]:
+                continue
+            if _wire_ray_crossings(xy, wire_xy) % 2 == 1:
+                best = (area, i_poly)
+        return best[1]
+
+    for edge_ids, component, xy in holes:
+        polygons[locate(xy, component)][1].append(edge_ids)
+    for node in free_nodes:
+        polygons[locate(nodes[node], None)][2].append(node)
+    return polygons
+
+
+def _wire_edge_ids(edge_ids):
+    """
+    Rotate the wire so that first two segments differ, which is necessary for the
+    detection of the wire orientation in PolygonDecomposition.make_wire_from_segments.
+    """
+    n = len(edge_ids)
+    for i in range(n):
+        if edge_ids[i] != edge_ids[(i + 1) % n]:
+            return edge_ids[i:] + edge_ids[:i]
+    return edge_ids
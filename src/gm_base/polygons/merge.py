@@ -153,11 +153,12 @@ def intersect_single(decomp, other, merge_tol=1e-10):
 
 
 
-def intersect_decompositions(decomps):
+def intersect_decompositions(decomps, merge_tol=1e-10):
     """
     Intersection of a list of decompositions. Segments and polygons are subdivided.
 
     :param decomps: List of PolygonDecomposition objects to itersect.
+    :param merge_tol: Tolerance for merging points of different decompositions.
     :return: (common_decomp, poly_maps)
     common_decomp - resulting merged/intersected decomposition.
     poly_maps - List of maps, one for every input decomposition. For single decomp the map
@@ -165,8 +166,7 @@ def intersect_decompositions(decomps):
     map_Nd - is a dict mapping IDs of sommon_decomp objects to IDs of decomp objects.
     Objects of common_decomp that have no preimage in decomp are omitted.
 
-    TODO: For larger number of intersectiong decompositions, it would be better to
-    use a binary tree reduction instead of linear pass to have n log(n) complexity of map updating.
+    For larger number of intersectiong decompositions use overlay_decompositions.
     """
     common_decomp = polygons.PolygonDecomposition()
     all_maps = []
@@ -177,7 +177,7 @@ def intersect_decompositions(decomps):
             len(common_decomp.segments),
             len(common_decomp.decomp.wires),
             len(common_decomp.polygons)))
-        common_decomp, common_maps, decomp_maps = intersect_single(common_decomp, decomp)
+        common_decomp, common_maps, decomp_maps = intersect_single(common_decomp, decomp, merge_tol=merge_tol)
         decomp_maps = [ { key: val for key,val in map.items() if val is not None} for map in decomp_maps ]
         for one_decomp_maps in all_maps:
             for one_dim_map, common_map in zip(one_decomp_maps, common_maps):
@@ -195,3 +195,82 @@ def intersect_decompositions(decomps):
                 assert obj_id in orig_id_set, "dim:{} id:{}".format(dim, obj_id)
 
     return common_decomp, all_maps
+
+
+def overlay_decompositions(decomps, merge_tol=1e-10):
+    """
+    Intersection of a list of decompositions computed at once. Points and segments of all
+    decompositions are fed into a single sweep (PolygonDecomposition.add_lines), so the cost
+    does not grow with repeated copying and map updating of the pairwise intersect_single.
+
+    :param decomps: List of PolygonDecomposition objects to itersect.
+    :param merge_tol: Tolerance for merging points of different decompositions.
+    :return: (common_decomp, poly_maps), same as intersect_decompositions for the same merge_tol.
+
+    Algorithm:
+    - feed points (as degenerated lines) and segments of the decompositions to add_lines, in the order
+      of intersect_decompositions: points and then segments of every decomposition; so if any snapping
+      within merge_tol happens, add_lines adds the lines one by one with the same result as the pairwise path
+    - maps for points and segments follows directly from the subdivision of the input lines
+    - polygon maps are filled by a DFS from the outer polygon, crossing a segment
+      of the decomposition sets the polygon on its appropriate side, otherwise the polygon is inherited
+    """
+    points = []
+    segments = []
+    lines = []
+    for i_decomp, decomp in enumerate(decomps):
+        for pt in decomp.points.values():
+            points.append((i_decomp, pt, len(lines)))
+            lines.append((pt.xy, pt.xy))
+        for seg in decomp.segments.values():
+            segments.append((i_decomp, seg, len(lines)))
+            lines.append((seg.vtxs[out_vtx].xy, seg.vtxs[in_vtx].xy))
+
+    common_decomp = polygons.PolygonDecomposition()
+    save_tol = common_decomp.tolerance
+    common_decomp.tolerance = merge_tol
+    line_results = common_decomp.add_lines(lines)
+    common_decomp.tolerance = save_tol
+
+    all_maps = [ [{}, {}, {}] for decomp in decomps ]
+    # For every decomposition: common segment id -> (orig segment, is reversed)
+    seg_sources = [ {} for decomp in decomps ]
+    for i_decomp, pt, i_line in points:
+        all_maps[i_decomp][0][line_results[i_line].id] = pt.id
+
+    for i_decomp, seg, i_line in segments:
+        new_segs = line_results[i_line]
+        if not isinstance(new_segs, list):
+            # Segment degenerated to a point.
+            continue
+        seg_vector = seg.vector
+        for new_seg in new_segs:
+            all_maps[i_decomp][1][new_seg.id] = seg.id
+            reversed = seg_vector @ new_seg.vector < 0
+            seg_sources[i_decomp][new_seg.id] = (seg, reversed)
+
+    # Polygon adjacency: poly id -> list of (segment id, side, neighbour poly id)
+    adjacency = {}
+    for poly in common_decomp.polygons.values():
+        adjacency[poly.id] = [ (seg.id, side, seg.wire[1 - side].polygon.id)
+                               for wire in [poly.outer_wire] + list(poly.outer_wire.childs)
+                               for seg, side in wire.segments() ]
+    outer_id = common_decomp.outer_polygon.id
+    for decomp, maps, sources in zip(decomps, all_maps, seg_sources):
+        poly_map = maps[2]
+        poly_map[outer_id] = decomp.outer_polygon.id
+        stack = [outer_id]
+        while stack:
+            poly_id = stack.pop(-1)
+            for seg_id, side, ngh_id in adjacency[poly_id]:
+                if ngh_id in poly_map:
+                    continue
+                if seg_id in sources:
+                    orig_seg, reversed = sources[seg_id]
+                    orig_side = side if reversed else 1 - side
+                    poly_map[ngh_id] = orig_seg.wire[orig_side].polygon.id
+                else:
+                    poly_map[ngh_id] = poly_map[poly_id]
+                stack.append(ngh_id)
+
+    return common_decomp, all_maps
@@ -1,17 +1,43 @@
 import gm_base.polygons.idmap as idmap
+import gm_base.polygons.array_store as array_store
 from .segment import right_side, left_side, out_vtx, in_vtx
 import numpy as np
 
 
 class Point(idmap.IdObject):
+    """
+    Coordinates of the point are stored in a row of the coordinates array of the decomposition,
+    see Decomposition.points_xy.
+    """
+    __slots__ = ('id', 'index', '_xy_store', '_row', 'poly', 'segment')
 
-    def __init__(self, point, poly):
-        self.xy = np.array(point, dtype=float)
+    def __init__(self, point, poly, xy_store=None, row=0):
+        """
+        :param point: XY coordinates, None if the coordinates are already set in the 'xy_store'.
+        :param poly: Containing polygon.
+        :param xy_store: ArrayStore of coordinates, a private one is used if None
+        :param row: Row of the point in the 'xy_store', equal to ID for points of the decomposition.
+        """
+        if xy_store is None:
+            xy_store = array_store.ArrayStore((2,), float, np.nan, init_size=1)
+        self._xy_store = xy_store
+        self._row = row
+        if point is not None:
+            self.xy = point
         self.poly = poly
         # Containing polygon for free-nodes. None for others.
         self.segment = (None, None)
         # (seg, vtx_side) One of segments joined to the Point and local idx of the segment (out_vtx, in_vtx).
 
+    @property
+    def xy(self):
+        # View to the row of the coordinates array.
+        return self._xy_store.array[self._row]
+
+    @xy.setter
+    def xy(self, point):
+        self._xy_store[self._row] = point
+
     def __repr__(self):
         return "Pt({}) {}".format(self.id, self.xy)
 
@@ -1,26 +1,20 @@
+import collections
 import numpy as np
 import numpy.linalg as la
 import enum
 import gm_base.polygons.aabb_lookup as aabb_lookup
 import gm_base.polygons.decomp as decomp
+import gm_base.polygons.line_sweep as line_sweep
 from gm_base.polygons.decomp import PolygonChange
 # TODO: careful unification of tolerance usage.
 # - Snapping is consistent.
 # - Still we may get points closer then tolerance for an edge crossing very acute angle.
 # - not sure about wire.contains_point
 
-# TODO: Performance improvement
-# - O(n^2) complexity of intersections is due to: snap_point and _add_line_seg_intersections
-# The first needs to find closest edge to the point, in fact any edge _ahave potentialy very bad complexity O(Nlog(N)) with number of segments
-# - add_line linear with number of segments
+# Performance:
+# - snap_point and _add_line_seg_intersections use the spatial index (aabb_lookup.AABB_Tree by default)
+#   so the candidate search is logarithmic with number of segments
 # - other operations are at most linear with number of segments per wire or point
-#
-# Libraries:
-# - scipy.KDtree - only for points, problematic use for lines must use fixed division of lines
-# - smartquadtree - seems to be also point based but support iterationg over close pairs
-# See:
-# - http://blog.notdot.net/2009/11/Damn-Cool-Algorithms-Spatial-indexing-with-Quadtrees-and-Hilbert-Curves
-# - https://stackoverflow.com/questions/36135161/efficient-quadtree-implementation-in-python
 
 
 in_vtx = left_side = 1
@@ -28,6 +22,67 @@ in_vtx = left_side = 1
 out_vtx = right_side = 0
 # vertex where edge comes out; side where next segment is connected through the out_vtx
 
+_path_eps = 1e-10
+# Minimal path parameter of a collision, contacts at the start of the path are ignored.
+
+
+def _cross(a, b):
+    return a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+
+
+def _path_hits(starts, vector, seg_a, seg_b):
+    """
+    Intersections of the paths 'start + s * vector' with the segments (seg_a, seg_b), for all pairs.
+    :param starts: Array (n, 2) of path starts.
+    :param vector: Common path vector, shape (2,).
+    :param seg_a, seg_b: Arrays (m, 2) of segment ends.
+    :return: Array of path parameters 's' in (0, 1] of all intersections.
+    """
+    qp = seg_a[None, :, :] - starts[:, None, :]
+    seg_vec = (seg_b - seg_a)[None, :, :]
+    denom = _cross(vector, seg_vec)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s = _cross(qp, seg_vec) / denom
+        t = _cross(qp, vector) / denom
+        # TODO: Treat case of the path and the segment in line.
+        hit = (denom != 0) & (s > _path_eps) & (s <= 1) & (t >= 0) & (t <= 1)
+    return s[hit]
+
+
+def _wire_sides(wires, segments_vtxs):
+    """
+    Sides of the segments in the wires, resolved at once from the end point IDs of consecutive segments.
+    Side of a half segment is given by its end vertex, that is the vertex shared with the next segment.
+    For a dendrite tip (same segment twice) it is the vertex not shared with the previous segment.
+    :param wires: List of wires, every wire is a list of at least 2 segment IDs in the wire orientation.
+    :param segments_vtxs: Array of point IDs of the segment ends, see Decomposition.segments_vtxs.
+    :return: List of lists of the sides, one for every wire.
+    """
+    if len(wires) == 0:
+        return []
+    lengths = np.array([len(wire) for wire in wires], dtype=int)
+    assert np.all(lengths >= 2), "Wire with less then two segments."
+    starts = np.cumsum(lengths) - lengths
+    wire_start = np.repeat(starts, lengths)
+    wire_len = np.repeat(lengths, lengths)
+    pos = np.arange(np.sum(lengths)) - wire_start
+    next_pos = wire_start + (pos + 1) % wire_len
+    prev_pos = wire_start + (pos - 1) % wire_len
+
+    vtxs = segments_vtxs[np.concatenate(wires).astype(int)]
+    next_vtxs = vtxs[next_pos]
+    prev_vtxs = vtxs[prev_pos]
+    next_shared = (vtxs == next_vtxs[:, out_vtx, None]) | (vtxs == next_vtxs[:, in_vtx, None])
+    prev_shared = (vtxs == prev_vtxs[:, out_vtx, None]) | (vtxs == prev_vtxs[:, in_vtx, None])
+    assert np.all(next_shared.any(axis=1)), "Can not connect segments."
+    last_sides = np.where(next_shared[:, out_vtx], out_vtx, in_vtx)
+    tip = next_shared.all(axis=1)
+    last_sides[tip] = np.where(prev_shared[tip, out_vtx] & ~prev_shared[tip, in_vtx], in_vtx, out_vtx)
+    # Isolated segment, both sides form the wire.
+    isolated = tip & prev_shared.all(axis=1)
+    last_sides[isolated] = np.where(pos[isolated] == 0, out_vtx, in_vtx)
+    return [sides.tolist() for sides in np.split(last_sides, starts[1:])]
+
 
 
 class PolygonDecomposition:
@@ -55,12 +110,21 @@ class PolygonDecomposition:
 
     """
 
-    def __init__(self):
+    _seg_splits = None
+    """
+    Splits of segments logged by add_lines: segment id -> list of ids of the new segments split from it.
+    None if not logged.
+    """
+
+    def __init__(self, lookup_class=aabb_lookup.AABB_Tree):
         """
         Constructor.
+        :param lookup_class: Class of the spatial index used for points and segments,
+            aabb_lookup.AABB_Tree or aabb_lookup.AABB_Lookup (linear search).
         """
-        self.points_lookup = aabb_lookup.AABB_Lookup()
-        self.segments_lookup = aabb_lookup.AABB_Lookup()
+        self.lookup_class = lookup_class
+        self.points_lookup = lookup_class()
+        self.segments_lookup = lookup_class()
         self.decomp = decomp.Decomposition()
         self.tolerance = 0.01
 
@@ -105,7 +169,7 @@ class PolygonDecomposition:
 
         #print("add_free_point", point_id, xy, polygon_id)
         polygon = self.decomp.polygons[polygon_id]
-        assert polygon.contains_point(xy), "Point {} not in polygon: {}.\n{}".format(xy, polygon, self)
+        assert self.find_polygon(xy) == polygon, "Point {} not in polygon: {}.\n{}".format(xy, polygon, self)
         return self._add_point(xy, polygon, id = point_id)
 
 
@@ -146,55 +210,87 @@ class PolygonDecomposition:
         param: points: List of Points to move.
         param: displacement: Numpy array, 2D vector of displacement to add to the points,
                 identical for the whole displaced block.
-        TODO: Check fails for internal wires and nonconvex poygons.
+        Two moving segments can not collide, the displacement is the same for the whole block.
         :return: True for no, collision; False if any collision is detected.
         """
-
-
-        # Collect all sides of moving segments.
-        moving_segs = set()
         changed_polygons = set()
         for pt in points:
             for seg, side in pt.segments():
                 changed_polygons.add(seg.wire[out_vtx].polygon)
                 changed_polygons.add(seg.wire[in_vtx].polygon)
-                moving_segs.add( (seg, side) )
         self.decomp.last_polygon_change = (decomp.PolygonChange.shape, changed_polygons, None)
+        return self._first_collision(points, displacement) is None
 
-        # Todo: For the outer wire of the moving segments, add parent and its holes to the envelope.
-        # Outer wire is the maximal parent wire for the set of all wires connected to moving edges.
-        boundary_wires = [poly.outer_wire for poly in changed_polygons]
-        for wire in boundary_wires:
-            for child in wire.childs:
-                boundary_wires.append(child)
-        envelope=[]
-        for wire in boundary_wires:
-            for seg, side in wire.segments():
-                if (seg, side) not in moving_segs and (seg, 1 - side) not in moving_segs:
-                        envelope.append(seg)
-
-        for e_seg in envelope:
-            # Check collision of points with envelope.
-            for pt in points:
-                (t0, t1) = self.seg_intersection(e_seg, pt.xy, pt.xy + displacement)
-                # TODO: Treat case of vector and segment in line.
-                # TODO: Check bound checks in intersection.
-                if t0 is not None:
-                    return False
-
-            # Check collision of segments with envelope.
-            for (seg, side) in moving_segs:
-                a = seg.vtxs[side].xy + displacement
-
-                if (seg, 1-side) in moving_segs:
-                    b = seg.vtxs[1 - side].xy + displacement
-                else:
-                    b = seg.vtxs[1 - side].xy
-                (t0, t1) = self.seg_intersection(e_seg, a, b)
-                if t0 is not None:
-                    return False
-
-        return True
+    def max_displacement_step(self, points, displacement):
+        """
+        LAYERS
+        Maximal admissible fraction of the displacement, i.e. the points can be moved by
+        'step * displacement' for any step smaller then the returned one without any collision.
+        param: points: List of Points to move.
+        param: displacement: Numpy array, 2D vector of displacement.
+        :return: 1.0 if there is no collision for the whole displacement,
+                 the displacement parameter of the first collision otherwise.
+        """
+        step = self._first_collision(points, displacement)
+        return 1.0 if step is None else step
+
+    def _first_collision(self, points, displacement):
+        """
+        Vectorized collision check of the moving block. Static segments and points are collected by
+        single query to the lookups using the box of the area swept by the moving segments.
+        Detected collisions:
+        - moving points (ends of moving segments and free points) with static segments
+        - static points with moving segments, for the segments with both ends moving
+          and for the segments rotating around its static end
+        :return: Displacement parameter in (0, 1] of the first collision, None if there is no collision.
+        """
+        displacement = np.array(displacement, dtype=float)
+        if len(points) == 0 or not np.any(displacement):
+            return None
+        xy = self.decomp.points_xy.array
+        pt_ids = np.unique(np.array([pt.id for pt in points], dtype=int))
+        moving_segs = {seg.id for pt in points for seg, side in pt.segments()}
+        seg_ids = np.array(sorted(moving_segs), dtype=int)
+        seg_vtxs = self.decomp.segments_vtxs.array[seg_ids].reshape(-1, 2)
+        seg_moves = np.isin(seg_vtxs, pt_ids)
+
+        starts = xy[pt_ids]
+        swept = np.concatenate((starts, starts + displacement, xy[seg_vtxs.ravel()]))
+        box = np.concatenate((swept.min(axis=0), swept.max(axis=0)))
+        static_seg_ids = np.array([id for id in self.segments_lookup.intersect_candidates(box)
+                                   if id not in moving_segs], dtype=int)
+        static_pt_ids = np.setdiff1d(np.array(self.points_lookup.intersect_candidates(box), dtype=int), pt_ids)
+
+        hits = []
+        # Moving points hitting static segments.
+        static_vtxs = self.decomp.segments_vtxs.array[static_seg_ids].reshape(-1, 2)
+        hits.append(_path_hits(starts, displacement, xy[static_vtxs[:, 0]], xy[static_vtxs[:, 1]]))
+
+        # Static points hitting translated segments, relative movement of the points is '-displacement'.
+        q = xy[static_pt_ids]
+        rigid = seg_moves.all(axis=1)
+        hits.append(_path_hits(q, -displacement, xy[seg_vtxs[rigid, 0]], xy[seg_vtxs[rigid, 1]]))
+
+        # Static points hitting segments rotating around static end 'a', the moving end is 'b + s * displacement'.
+        rotating = ~rigid
+        fixed_vtx = np.where(seg_moves[rotating, 0], 1, 0)
+        fixed_ids = seg_vtxs[rotating][np.arange(len(fixed_vtx)), fixed_vtx]
+        moving_ids = seg_vtxs[rotating][np.arange(len(fixed_vtx)), 1 - fixed_vtx]
+        a = xy[fixed_ids][:, None, :]
+        qa = q[None, :, :] - a
+        ba = xy[moving_ids][:, None, :] - a
+        with np.errstate(divide='ignore', invalid='ignore'):
+            s = -_cross(ba, qa) / _cross(displacement, qa)
+            ba_s = ba + s[:, :, None] * displacement
+            t = np.sum(qa * ba_s, axis=2) / np.sum(ba_s * ba_s, axis=2)
+            hit = np.isfinite(s) & (s > _path_eps) & (s <= 1) & (t >= 0) & (t <= 1)
+        hit &= fixed_ids[:, None] != static_pt_ids[None, :]
+        hits.append(s[hit])
+
+        hits = np.concatenate(hits)
+        if len(hits) == 0:
+            return None
+        return float(np.min(hits))
 
     def move_points(self, points, displacement):
         """
@@ -204,8 +300,12 @@ class PolygonDecomposition:
         param: displacement: Numpy array, 2D vector of displacement to add to the points.
         :return: None
         """
-        for pt in points:
-            pt.move(displacement)
+        pt_ids = np.unique(np.array([pt.id for pt in points], dtype=int))
+        self.decomp.points_xy.array[pt_ids] += displacement
+        moved_segs = {seg for pt in points for seg, side in pt.segments()}
+        for seg in moved_segs:
+            seg.update_vector()
+        self._update_lookups(pt_ids, [seg.id for seg in moved_segs])
 
 
     def get_last_polygon_changes(self):
@@ -260,6 +360,8 @@ class PolygonDecomposition:
         :return: None
         """
         self.tolerance = tolerance
+        # Rebuild lookup boxes for the new margin.
+        self._update_lookups(list(self.points.keys()), list(self.segments.keys()))
 
 
 
@@ -348,15 +450,10 @@ class PolygonDecomposition:
 
         # Snap to polygon,
         # have to deal with nonconvex case
-        poly = None
         dist, seg, t = closest_seg
         if seg is None:
             return (2, self.decomp.outer_polygon, None)
-        if t == 0.0:
-            pt = seg.vtxs[out_vtx]
-        elif t == 1.0:
-            pt = seg.vtxs[in_vtx]
-        else:
+        if 0.0 < t < 1.0:
             # convex case
             tangent = seg.vector
             normal = np.array([tangent[1], -tangent[0]])
@@ -364,15 +461,47 @@ class PolygonDecomposition:
             assert point_n != 0.0
             side = right_side if point_n > 0 else left_side
             poly = seg.wire[side].polygon
-
-        if poly is None:
+        else:
             # non-convex case
-            prev, next, wire = pt.insert_vector(point - pt.xy)
-            poly = wire.polygon
-        if not poly.contains_point(point):
-            assert False
+            poly = self.find_polygon(point)
         return (2, poly, None)
 
+    def find_polygon(self, xy):
+        """
+        Find the polygon containing the given point.
+        The vertical ray going up from the point is shot using the segments lookup. The point is inside
+        the polygon below the first hit segment, or inside the outer polygon if there is no hit.
+        Points on the vertical line through a vertex are treated as slightly right of it.
+        :param xy: point (X, Y)
+        :return: Polygon instance
+        """
+        x, y = float(xy[0]), float(xy[1])
+        hit = (np.inf, 0.0, None)
+        # (Y of the hit, slope of the segment, segment)
+        for seg_id, box_min_y in self.segments_lookup.ray_candidates((x, y)):
+            if box_min_y > hit[0]:
+                break
+            seg = self.decomp.segments[seg_id]
+            (ax, ay), (bx, by) = seg.vtxs[out_vtx].xy, seg.vtxs[in_vtx].xy
+            if ax > bx:
+                ax, ay, bx, by = bx, by, ax, ay
+            if not ax <= x < bx:
+                # vertical segment or out of the segment range
+                continue
+            slope = (by - ay) / (bx - ax)
+            seg_y = ay + slope * (x - ax)
+            if y <= seg_y and (seg_y, slope) < hit[:2]:
+                hit = (seg_y, slope, seg)
+
+        seg = hit[2]
+        if seg is None:
+            return self.decomp.outer_polygon
+        # For the segment oriented to the right the right side is the lower one.
+        if seg.vtxs[out_vtx].xy[0] < seg.vtxs[in_vtx].xy[0]:
+            return seg.wire[right_side].polygon
+        else:
+            return seg.wire[left_side].polygon
+
 
     def add_line(self, a, b):
         """
@@ -392,6 +521,87 @@ class PolygonDecomposition:
         return self.add_line_for_points(a_point, b_point)
 
 
+    def add_lines(self, lines, exact=True):
+        """
+        Bulk version of add_line. All intersections are computed at once by a sweep
+        over the line boxes, points are snapped within tolerance in a single pass, and
+        wires and polygons are constructed at once (see line_sweep module).
+        The bulk construction is possible only for an empty decomposition, otherwise the lines
+        are added one by one by add_line.
+
+        Without snapping (no two features closer then tolerance) the bulk result is the same
+        decomposition as adding the lines one by one. Snapping of add_line depends on the order
+        of the lines and is parametric for segments, while the bulk snapping is order independent,
+        so with snapping the bulk result may have less points.
+        :param lines: array like (N, 2, 2), lines[i] = [A, B], A, B: X, Y
+        :param exact: If True, the result is always the same as for add_line called for
+            the lines in the given order: the lines are added one by one if the bulk construction
+            detects any snapping, the detection is done before the subdivision is constructed.
+            If False, the bulk construction with its own snapping is used.
+        :return: List of results for individual lines: list of segments of the final subdivision
+            of the line (including splits by later lines) ordered from A to B,
+            or the Point instance for a line degenerated to a point.
+        """
+        lines = np.array(lines, dtype=float).reshape(-1, 2, 2)
+        if len(self.points) > 0:
+            return self._add_lines_incremental(lines)
+
+        split = line_sweep.split_lines(lines, self.tolerance, stop_on_snap=exact)
+        if split is None:
+            return self._add_lines_incremental(lines)
+        nodes, edges, line_edges, line_nodes, snapped = split
+        is_free = np.ones(len(nodes), dtype=bool)
+        is_free[edges.ravel()] = False
+        free_nodes = np.nonzero(is_free)[0].tolist()
+        polygons = line_sweep.make_polygons(nodes, edges, free_nodes)
+
+        self.decomp.add_free_points(nodes, self.outer_polygon)
+        self.decomp._make_segments(edges)
+        self._update_lookups(np.arange(len(nodes)), np.arange(len(edges)))
+        self.make_polygons(polygons)
+        self.set_wire_parents()
+
+        result = []
+        for div, (a_node, b_node) in zip(line_edges, line_nodes):
+            if a_node == b_node and not div:
+                result.append(self.points[a_node])
+            else:
+                result.append([self.segments[edge_id] for edge_id, reversed in div])
+        return result
+
+    def _add_lines_incremental(self, lines):
+        """
+        Add lines one by one by add_line. Segments split by later lines are followed,
+        so the result is the final subdivision of every line as for the bulk construction.
+        """
+        self._seg_splits = {}
+        try:
+            results = [self.add_line(a, b) for a, b in lines]
+            splits = self._seg_splits
+        finally:
+            self._seg_splits = None
+
+        def pieces(seg_id):
+            # Later splits of a segment are closer to its start.
+            seg_ids = [seg_id]
+            for new_id in reversed(splits.get(seg_id, [])):
+                seg_ids.extend(pieces(new_id))
+            return seg_ids
+
+        result = []
+        for (a, b), res in zip(lines, results):
+            if not isinstance(res, list):
+                result.append(res)
+                continue
+            div = []
+            for seg in res:
+                seg_pieces = [self.segments[seg_id] for seg_id in pieces(seg.id)]
+                if seg.vector @ (b - a) < 0:
+                    seg_pieces.reverse()
+                div.extend(seg_pieces)
+            result.append(div)
+        return result
+
     def add_line_for_points(self, a_pt, b_pt):
         """
         Same as add_line, but for known end points.
@@ -414,6 +624,8 @@ class PolygonDecomposition:
             xy_point = seg.parametric(t)
             mid_pt = self._add_point(xy_point, self.decomp.outer_polygon)
             new_seg = self.decomp.split_segment(seg, mid_pt)
+            if self._seg_splits is not None:
+                self._seg_splits.setdefault(seg.id, []).append(new_seg.id)
             self.segments_lookup.add_object(new_seg.id,
                 aabb_lookup.make_aabb([new_seg.vtxs[0].xy, new_seg.vtxs[1].xy], margin=self.tolerance))
 
@@ -501,6 +713,22 @@ class PolygonDecomposition:
         self.segments_lookup.rm_object(seg.id)
         self.decomp.delete_segment(seg)
 
+    def _update_lookups(self, pt_ids, seg_ids):
+        """
+        Add or replace boxes of given points and segments in the lookups.
+        Boxes are computed at once from the coordinate arrays of the decomposition.
+        :param pt_ids: Array of point IDs.
+        :param seg_ids: Array of segment IDs.
+        """
+        xy = self.decomp.points_xy.array
+        pt_xy = xy[np.asarray(pt_ids, dtype=int)]
+        self.points_lookup.add_objects(pt_ids,
+            np.concatenate((pt_xy - self.tolerance, pt_xy + self.tolerance), axis=1))
+        seg_vtxs = self.decomp.segments_vtxs.array[np.asarray(seg_ids, dtype=int)]
+        a, b = xy[seg_vtxs[:, out_vtx]], xy[seg_vtxs[:, in_vtx]]
+        self.segments_lookup.add_objects(seg_ids,
+            np.concatenate((np.minimum(a, b) - self.tolerance, np.maximum(a, b) + self.tolerance), axis=1))
+
     #################################
     # Segment calculations.
 
@@ -557,41 +785,26 @@ class PolygonDecomposition:
         self.segments_lookup.add_object(seg.id, aabb_lookup.make_aabb([vtxs[0].xy, vtxs[1].xy], margin=self.tolerance))
         return seg
 
-    def make_wire_from_segments(self, seg_ids, polygon):
+    def make_wire_from_segments(self, seg_ids, polygon, last_sides=None):
         """
         Used in  deserialize.
 
         Set half segments of the wire, and the wire itself.
         :param seg_ids: Segment ids, at least 2 and listed in the orientation matching the wire (cc wise)
         :param polygon: Polygon the wire is part of.
+        :param last_sides: Sides of the segments in the wire, computed by _wire_sides if not given.
         :return: None
         """
-        assert len(seg_ids) >= 2, "segments: {}".format(seg_ids)
+        if last_sides is None:
+            last_sides, = _wire_sides([seg_ids], self.decomp.segments_vtxs.array)
         wire = decomp.Wire()
         self.decomp.wires.append(wire)
 
-        # detect orientation of the first segment
-        last_seg = self.decomp.segments[seg_ids[0]]
-        seg1 = self.decomp.segments[seg_ids[1]]
-        last_side = out_vtx
-        vtx0_side = seg1.point_side(last_seg.vtxs[last_side])
-        if vtx0_side is None:
-            last_side = in_vtx
-            assert seg1.point_side(last_seg.vtxs[last_side]) is not None, "Can not connect segments: {} {}".format(last_seg, seg1)
-        start_seg_side = (last_seg, last_side)
-
-        # set segment sides along the wire
-        for id in seg_ids[1:]:
-            seg = self.decomp.segments[id]
-            side = seg.point_side(last_seg.vtxs[last_side])
-            assert side is not None, "Can not connect segments: {} {}".format(last_seg, seg)
-            seg_side = (seg, 1 - side)
-            last_seg.next[last_side] = seg_side
-            last_seg.wire[last_side] = wire
-            last_seg, last_side = seg_side
-        last_seg.next[last_side] = start_seg_side
-        last_seg.wire[last_side] = wire
-        wire.segment = start_seg_side
+        seg_sides = [(self.decomp.segments[id], side) for id, side in zip(seg_ids, last_sides)]
+        for (seg, side), next_seg_side in zip(seg_sides, seg_sides[1:] + seg_sides[:1]):
+            seg.next[side] = next_seg_side
+            seg.wire[side] = wire
+        wire.segment = seg_sides[0]
         wire.polygon = polygon
         return wire
 
@@ -604,19 +817,38 @@ class PolygonDecomposition:
         :param free_points:
         :return:
         """
-        if len(outer_segments) != 0:
-            p = self.decomp.polygons.append(decomp.Polygon(None))
-            p.outer_wire = self.make_wire_from_segments(outer_segments, p)
-        else:
-            p = self.decomp.outer_polygon
+        return self.make_polygons([(outer_segments, holes, free_points)])[0]
+
+    def make_polygons(self, polygons):
+        """
+        Used in add_lines and deserialize.
+        Bulk version of make_polygon, sides of the segments are resolved for all wires at once.
+        :param polygons: List of (outer_segments, holes, free_points).
+        :return: List of polygons.
+        """
+        wires = []
+        for outer_segments, holes, free_points in polygons:
+            if len(outer_segments) != 0:
+                wires.append(outer_segments)
+            wires.extend(holes)
+        wire_sides = iter(_wire_sides(wires, self.decomp.segments_vtxs.array))
+
+        result = []
+        for outer_segments, holes, free_points in polygons:
+            if len(outer_segments) != 0:
+                p = self.decomp.polygons.append(decomp.Polygon(None))
+                p.outer_wire = self.make_wire_from_segments(outer_segments, p, next(wire_sides))
+            else:
+                p = self.decomp.outer_polygon
 
-        for hole in holes:
-            wire = self.make_wire_from_segments(hole, p)
-            wire.set_parent(p.outer_wire)
-        for free_pt_id in free_points:
-            pt = self.decomp.points[free_pt_id]
-            pt.set_polygon(p)
-        return p
+            for hole in holes:
+                wire = self.make_wire_from_segments(hole, p, next(wire_sides))
+                wire.set_parent(p.outer_wire)
+            for free_pt_id in free_points:
+                pt = self.decomp.points[free_pt_id]
+                pt.set_polygon(p)
+            result.append(p)
+        return result
 
 
 
@@ -628,12 +860,11 @@ class PolygonDecomposition:
         """
         for poly in self.decomp.polygons.values():
             for hole in poly.outer_wire.childs:
-                child_queue = hole.neighbors()
+                child_queue = collections.deque(hole.neighbors())
                 # BFS for inner wires of the hole
                 while child_queue:
-                    inner_wire = child_queue.pop(0)
+                    inner_wire = child_queue.popleft()
                     if inner_wire.parent == inner_wire:
                         inner_wire.set_parent(hole)
-                        for wire in inner_wire.neighbors():
-                            child_queue.append(wire)
+                        child_queue.extend(inner_wire.neighbors())
 
@@ -1,3 +1,4 @@
+import numpy as np
 import gm_base.geometry_files.format_last as gs
 import gm_base.polygons.polygons as polygons
 
@@ -7,6 +8,9 @@ from gm_base.polygons.decomp import Point
 TODO: Try to remove dependency on `decomp` module.
 """
 
+debug = False
+# Check consistency of every deserialized decomposition.
+
 
 def set_indices(decomp):
     """
@@ -35,13 +39,16 @@ def serialize(polydec):
     decomp = polydec.decomp
     decomp.check_consistency()
     set_indices(decomp)
-    nodes = [list(pt.xy) for pt in decomp.points.values()]
+    # Nodes and segments directly from the coordinate and end point arrays.
+    pt_ids = np.array(list(decomp.points.keys()), dtype=int)
+    nodes = decomp.points_xy.array[pt_ids].tolist()
+    pt_id_to_index = np.full(decomp.points_xy.size, -1, dtype=int)
+    pt_id_to_index[pt_ids] = np.arange(len(pt_ids))
+    seg_ids = np.array(list(decomp.segments.keys()), dtype=int)
+    seg_nodes = pt_id_to_index[decomp.segments_vtxs.array[seg_ids]].tolist()
     topology = gs.Topology()
 
-    topology.segments = []
-    for seg in decomp.segments.values():
-        segment = gs.Segment(dict(node_ids=(seg.vtxs[0].index, seg.vtxs[1].index)))
-        topology.segments.append(segment)
+    topology.segments = [ gs.Segment(dict(node_ids=tuple(node_ids))) for node_ids in seg_nodes ]
 
     topology.polygons = []
     for poly in decomp.polygons.values():
@@ -59,6 +66,8 @@ def serialize(polydec):
 def deserialize(nodes, topology):
     """
     Deserialize PolygonDecomposition, reconstruct all internal information.
+    Points and segments are created in bulk, wires directly from the segment lists of the polygons.
+    The full consistency check is performed only if the module attribute 'debug' is set.
     :param nodes: list of node coordinates, (x,y)
     :param topology: Geometry, Topology object, containing: nodes, segments and polygons
     produced by serialize function.
@@ -68,29 +77,29 @@ def deserialize(nodes, topology):
     polydec = polygons.PolygonDecomposition()
     decomp = polydec.decomp
 
-    for id, node in enumerate(nodes):
-        point = polydec._add_point(node, poly=polydec.outer_polygon, id=id)
+    for id, point in enumerate(decomp.add_free_points(nodes, polydec.outer_polygon)):
         point.index = id
 
     if len(topology.polygons) == 0 or len(topology.polygons[0].segment_ids) > 0:
+        polydec._update_lookups(np.arange(len(nodes)), [])
         reconstruction_from_old_input(polydec, topology)
         return polydec
 
-    for id, seg in enumerate(topology.segments):
-        vtxs_ids = seg.node_ids
-        s = polydec.make_segment(vtxs_ids)
+    seg_nodes = np.array([seg.node_ids for seg in topology.segments], dtype=int).reshape(-1, 2)
+    for id, s in enumerate(decomp._make_segments(seg_nodes)):
         s.index = id
-        assert s.id == id
+    polydec._update_lookups(np.arange(len(nodes)), np.arange(len(seg_nodes)))
 
-    for id, poly in enumerate(topology.polygons):
-        free_pt_ids = poly.free_points
-        p = polydec.make_polygon(poly.segment_ids, poly.holes, free_pt_ids)
+    new_polygons = polydec.make_polygons(
+        [(poly.segment_ids, poly.holes, poly.free_points) for poly in topology.polygons])
+    for id, p in enumerate(new_polygons):
         p.index = id
         assert p.id == id
 
     polydec.set_wire_parents()
 
-    decomp.check_consistency()
+    if debug:
+        decomp.check_consistency()
     return polydec
 
 
@@ -105,18 +114,22 @@ def reconstruction_from_old_input(polydec, topology):
         s.index = id
         assert s.id == id
 
+    # Outer wire segments of the polygons, every segment side belongs to a single polygon,
+    # so the candidates are only the polygons on the sides of the first segment.
+    outer_segments = {}
+    seg_polygons = {}
+    for p in polydec.polygons.values():
+        seg_set = outer_segments[p.id] = set()
+        for seg, side in p.outer_wire.segments():
+            seg_set.add(seg.index)
+            seg_polygons.setdefault(seg.index, {})[p.id] = p
+
     polydec.outer_polygon.index = 0
     for id, poly in enumerate(topology.polygons):
-        segments = {seg_id for seg_id in poly.segment_ids}
-        candidates = []
-        for p in polydec.polygons.values():
-            seg_set = set()
-            for seg, side in p.outer_wire.segments():
-                seg_set.add(seg.index)
-            if segments.issubset(seg_set):
-                candidates.append(p)
-
+        segments = set(poly.segment_ids)
+        candidates = [p for p in seg_polygons.get(poly.segment_ids[0], {}).values()
+                      if segments.issubset(outer_segments[p.id])]
         assert len(candidates) == 1
         candidates[0].index = id + 1
-    polydec.decomp.check_consistency()
-
+    if debug:
+        polydec.decomp.check_consistency()
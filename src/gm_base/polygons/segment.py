@@ -8,6 +8,11 @@ out_vtx = right_side = 0
 
 
 class Segment(idmap.IdObject):
+    """
+    IDs of the end points are also stored in the row 'id' of the decomposition array,
+    see Decomposition.segments_vtxs.
+    """
+    __slots__ = ('id', 'index', 'vtxs', 'wire', 'next', '_vector')
 
     def __init__(self, vtxs):
         self.vtxs = list(vtxs)
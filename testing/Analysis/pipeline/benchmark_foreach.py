@@ -0,0 +1,59 @@
+"""
+Benchmark of the Pipelineprocessor scheduling: ForEach over N items, every item is processed
+by a workflow with one internal FunctionAction. Internal actions take no time, so the run time
+is the scheduling overhead.
+
+Usage: python benchmark_foreach.py [N ...]    (default N = 10000)
+Run from the 'testing' directory or with 'src' in PYTHONPATH.
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "..", "..", "src"))
+
+from Analysis.pipeline import *
+from Analysis.pipeline.pipeline_processor import Pipelineprocessor
+import Analysis.pipeline.action_types as action_types
+
+
+def make_pipeline(n_items):
+    action_types.__action_counter__ = 0
+    items = [Struct(x=Float(float(i))) for i in range(n_items)]
+    gen = VariableGenerator(Variable=Sequence(Struct(x=Float()), *items))
+    workflow = Workflow()
+    function = FunctionAction(Inputs=[workflow.input()], Params=["x"], Expressions=["y = 2 * x + 1"])
+    workflow.set_config(OutputAction=function, InputAction=function)
+    foreach = ForEach(Inputs=[gen], WrappedAction=workflow)
+    return Pipeline(ResultActions=[foreach]), foreach
+
+
+def run(n_items, timeout=3600):
+    pipeline, foreach = make_pipeline(n_items)
+    pp = Pipelineprocessor(pipeline)
+    errs = pp.validate()
+    assert len(errs) == 0, errs
+    start = time.time()
+    pp.run()
+    while pp.is_run():
+        time.sleep(0.01)
+        assert time.time() - start < timeout, "Timeout"
+    wall_time = time.time() - start
+    assert foreach._is_state(action_types.ActionStateType.finished)
+    assert len(foreach._output._list) == n_items
+    return wall_time
+
+
+if __name__ == "__main__":
+    work_dir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        for n in [int(arg) for arg in sys.argv[1:]] or [10000]:
+            wall_time = run(n)
+            print("ForEach items: {:>8}  time: {:>10.3f} s  per action: {:>10.6f} s".format(n, wall_time, wall_time / n))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
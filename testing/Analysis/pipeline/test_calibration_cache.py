@@ -0,0 +1,103 @@
+from Analysis.pipeline.parametrized_actions import *
+from Analysis.pipeline.generator_actions import *
+from Analysis.pipeline.wrapper_actions import *
+from Analysis.pipeline.data_types_tree import *
+from Analysis.pipeline.workflow_actions import *
+from Analysis.pipeline.pipeline import *
+from Analysis.pipeline.pipeline_processor import *
+from Analysis.pipeline.calibration_cache import *
+import Analysis.pipeline.action_types as action
+import numpy as np
+import shutil
+import time
+
+
+def test_evaluation_cache(tmpdir):
+    cache_file = str(tmpdir.join("cache", "cache.json"))
+    cache = EvaluationCache(cache_file)
+    assert len(cache) == 0
+    cache.add(np.array([1.0, 2.0]), {"y": 3.0})
+    assert cache.get(np.array([1.0, 2.0])) == {"y": 3.0}
+    # quantized key
+    assert cache.get(np.array([1.0 + 1e-15, 2.0])) == {"y": 3.0}
+    assert cache.get(np.array([1.0 + 1e-6, 2.0])) is None
+
+    # incomplete last line is skipped
+    with open(cache_file, "a") as fd:
+        fd.write('{"x": [5.0, ')
+    cache = EvaluationCache(cache_file)
+    assert len(cache) == 1
+    assert cache.get([1.0, 2.0]) == {"y": 3.0}
+
+
+def run_calibration(save_path, observations=("y1", "y2")):
+    action.__action_counter__ = 0
+    gen = VariableGenerator(
+        Variable=Struct(observations=Struct(y1=Float(1.0), y2=Float(5.0))))
+    w = Workflow()
+    f = FunctionAction(
+        Inputs=[w.input()],
+        Params=["x1", "x2"],
+        Expressions=["y1 = 2 * x1 + 2", "y2 = 2 * x2 + 3"])
+    w.set_config(OutputAction=f, InputAction=f)
+    cal = Calibration(
+        Inputs=[gen],
+        WrappedAction=w,
+        Parameters=[CalibrationParameter(name=name, group="pokus", bounds=(-1e+10, 1e+10), init_value=1.0)
+                    for name in ["x1", "x2"]],
+        Observations=[CalibrationObservation(name=name, group="tunel", weight=1.0)
+                      for name in observations],
+        AlgorithmParameters=[CalibrationAlgorithmParameter(group="pokus", diff_inc_rel=0.01, diff_inc_abs=0.0)],
+        TerminationCriteria=CalibrationTerminationCriteria(n_max_steps=100),
+        MinimizationMethod="L-BFGS-B",
+        PersistentCache=True
+    )
+    pp = Pipelineprocessor(Pipeline(ResultActions=[cal]), save_path=save_path)
+    err = pp.validate()
+    assert len(err) == 0
+
+    pp.run()
+    i = 0
+    while pp.is_run():
+        time.sleep(0.1)
+        i += 1
+        assert i < 1000, "Timeout"
+    return cal
+
+
+def test_calibration_restart(tmpdir):
+    save_path = str(tmpdir)
+    cal = run_calibration(save_path)
+    assert cal._output.result.residual.value < 0.01
+    assert cal._scipy_model_eval_num > 0
+    assert cal._scipy_cache_hits == 0
+    assert len(os.listdir(os.path.join(save_path, "calibration_cache"))) == 1
+
+    # restarted calibration doesn't evaluate model
+    cal2 = run_calibration(save_path)
+    assert cal2._scipy_model_eval_num == 0
+    assert cal2._scipy_cache_hits == cal._scipy_model_eval_num
+    assert cal2._output.result.residual.value == cal._output.result.residual.value
+    assert len(cal2._output.optimisation._list) == len(cal._output.optimisation._list)
+
+
+def test_calibration_restart_observations(tmpdir):
+    save_path = str(tmpdir)
+    cache_dir = os.path.join(save_path, "calibration_cache")
+    cal = run_calibration(save_path, ["y1"])
+    assert cal._output.result.residual.value < 0.01
+
+    # added observation, cache of previous run is not used
+    cal2 = run_calibration(save_path, ["y1", "y2"])
+    assert cal2._scipy_cache_hits == 0
+    assert cal2._output.result.residual.value < 0.01
+    assert len(os.listdir(cache_dir)) == 2
+
+    # records without some observation are not used
+    cache_file = cal2._scipy_cache.file
+    old_file = [os.path.join(cache_dir, f) for f in os.listdir(cache_dir) if os.path.join(cache_dir, f) != cache_file]
+    shutil.copyfile(old_file[0], cache_file)
+    cal3 = run_calibration(save_path, ["y1", "y2"])
+    assert cal3._scipy_cache_hits == 0
+    assert cal3._scipy_model_eval_num == cal2._scipy_model_eval_num
+    assert cal3._output.result.residual.value == cal2._output.result.residual.value
@@ -0,0 +1,45 @@
+from Analysis.pipeline.calibration_diff_evolution import *
+import numpy as np
+import pytest
+
+
+def quadratic(x):
+    return (x[0] - 1.0) ** 2 + 2.0 * (x[1] + 0.5) ** 2
+
+
+def test_min_diff_evolution():
+    batches = []
+    generations = []
+
+    def fun_batch(xs):
+        batches.append(len(xs))
+        for x in xs:
+            assert np.all(x >= [-5.0, -5.0]) and np.all(x <= [5.0, 5.0])
+        return [quadratic(x) for x in xs]
+
+    def callback(xk, convergence):
+        generations.append(xk)
+
+    res = min_diff_evolution(fun_batch, [-5.0, -5.0], [5.0, 5.0], callback=callback, popsize=5, tol=1e-6, seed=1)
+    assert res.success
+    assert np.allclose(res.x, [1.0, -0.5], atol=1e-2)
+    # initial population and every generation is evaluated as one batch
+    assert batches == [10] * (res.nit + 1)
+    assert res.nfev == sum(batches)
+    assert len(generations) == res.nit
+
+    # same seed, same result
+    res2 = min_diff_evolution(lambda xs: [quadratic(x) for x in xs], [-5.0, -5.0], [5.0, 5.0],
+                              popsize=5, tol=1e-6, seed=1)
+    assert np.all(res2.x == res.x)
+
+
+def test_min_diff_evolution_stop():
+    res = min_diff_evolution(lambda xs: [quadratic(x) for x in xs], [-5.0, -5.0], [5.0, 5.0],
+                             callback=lambda xk, convergence: True, seed=1)
+    assert not res.success
+    assert res.nit == 1
+
+    res = min_diff_evolution(lambda xs: [quadratic(x) for x in xs], [-5.0, -5.0], [5.0, 5.0], maxiter=3, seed=1)
+    assert not res.success
+    assert res.nit == 3
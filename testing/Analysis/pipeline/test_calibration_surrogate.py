@@ -0,0 +1,81 @@
+from Analysis.pipeline.calibration_surrogate import *
+from scipy.optimize import check_grad
+import numpy as np
+import pytest
+
+
+def quadratic(x):
+    return (x[0] - 1.0) ** 2 + 2.0 * (x[1] + 0.5) ** 2 + 0.5 * x[0] * x[1]
+
+
+def quadratic_min():
+    # minimum of quadratic, zero gradient
+    return np.linalg.solve([[2.0, 0.5], [0.5, 4.0]], [2.0, -2.0])
+
+
+@pytest.mark.parametrize("n_points", [6, 30])
+def test_rbf_interpolation(n_points):
+    np.random.seed(0)
+    points = np.random.rand(n_points, 2) * 4 - 2
+    values = np.sin(points[:, 0]) * np.cos(points[:, 1])
+    surrogate = RBFSurrogate(points, values)
+    # linear tail for few points, quadratic for enough points
+    assert surrogate.quadratic == (n_points >= 12)
+    assert np.allclose(surrogate(points), values, atol=1e-8)
+    assert surrogate.n_eval == n_points
+    assert np.isscalar(surrogate(points[0]))
+    assert surrogate(points[0]) == pytest.approx(values[0], abs=1e-8)
+    assert surrogate.n_eval == n_points + 2
+
+    # gradient in points between the data points
+    for u in np.random.rand(10, 2) * 4 - 2:
+        assert check_grad(surrogate, surrogate.grad, u) < 1e-5 * max(1.0, np.linalg.norm(surrogate.grad(u)))
+
+
+def test_rbf_reproduces_quadratic():
+    np.random.seed(1)
+    points = np.random.rand(15, 2) * 4 - 2
+    surrogate = RBFSurrogate(points, [quadratic(u) for u in points])
+    assert surrogate.quadratic
+    for u in np.random.rand(10, 2) * 4 - 2:
+        assert surrogate(u) == pytest.approx(quadratic(u), abs=1e-8)
+    assert np.allclose(surrogate.grad(quadratic_min()), 0.0, atol=1e-6)
+
+
+@pytest.mark.parametrize("n_candidates", [1, 3])
+def test_min_surrogate(n_candidates):
+    batches = []
+    iterations = []
+
+    def fun_batch(xs):
+        assert 0 < len(xs) <= max(n_candidates, 5)
+        batches.append(len(xs))
+        return [quadratic(x) for x in xs]
+
+    res = min_surrogate(fun_batch, [0.0, 0.0], [-5.0, -5.0], [5.0, 5.0], callback=iterations.append,
+                        n_candidates=n_candidates)
+    assert res.success
+    assert np.allclose(res.x, quadratic_min(), atol=1e-4)
+    assert res.fun == pytest.approx(quadratic(quadratic_min()), abs=1e-8)
+    assert res.nfev == sum(batches)
+    assert res.nit == len(iterations) == len(batches) - 1
+    assert res.n_surrogate_eval > res.nfev
+
+
+def test_min_surrogate_bounds():
+    # minimum on the bound
+    res = min_surrogate(lambda xs: [quadratic(x) for x in xs], [0.0, 0.0], [-5.0, 0.0], [5.0, 5.0])
+    assert res.success
+    assert np.all(res.x >= [-5.0, 0.0])
+    assert np.allclose(res.x, [1.0, 0.0], atol=1e-4)
+
+
+def test_min_surrogate_stall():
+    # no improvement of the best point, not converged
+    def fun_batch(xs):
+        return [0.0 if np.all(x == 0.0) else 1.0 for x in xs]
+
+    res = min_surrogate(fun_batch, [0.0, 0.0], [-5.0, -5.0], [5.0, 5.0], n_stall=2)
+    assert not res.success
+    assert res.message == "No improvement in 2 iterations"
+    assert np.all(res.x == 0.0)
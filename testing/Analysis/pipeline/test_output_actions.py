@@ -7,6 +7,7 @@ from Analysis.pipeline.pipeline import *
 
 import shutil
 import os
+import time
 
 
 TEST_FILES = "test_files"
@@ -3,10 +3,13 @@ from Analysis.pipeline.generator_actions import *
 from Analysis.pipeline.data_types_tree import *
 from Analysis.pipeline.pipeline_processor import *
 from Analysis.pipeline.pipeline import *
+from Analysis.pipeline.workflow_actions import *
+from Analysis.pipeline.wrapper_actions import *
 from .pomfce import *
 import Analysis.pipeline.action_types as action
 import os
 import math
+import time
 
 
 this_source_dir = os.path.dirname(os.path.realpath(__file__))
@@ -91,3 +94,44 @@ def test_function_action(request):
     # check result
     assert fun._output.y1 == 8.0
     assert fun._output.y2 == 1.0
+
+
+def test_function_action_process_pool(request):
+    def clear_test_files():
+        shutil.rmtree("backup", ignore_errors=True)
+    request.addfinalizer(clear_test_files)
+
+    # pipeline
+    items = [Struct(x1=Float(float(i)), x2=Float(math.pi / 2)) for i in range(8)]
+    gen = VariableGenerator(Variable=Sequence(Struct(x1=Float(), x2=Float()), *items))
+    workflow = Workflow()
+    fun = FunctionAction(
+        Inputs=[workflow.input()],
+        Params=["x1", "x2"],
+        Expressions=["y1 = 2 * x1 + 1", "y2 = sin(x2)"])
+    workflow.set_config(OutputAction=fun, InputAction=fun)
+    foreach = ForEach(Inputs=[gen], WrappedAction=workflow)
+    pipeline = Pipeline(ResultActions=[foreach])
+
+    # pipeline processor with pool of processes
+    pp = Pipelineprocessor(pipeline, process_pool_size=2)
+
+    # validation
+    err = pp.validate()
+    assert len(err) == 0
+
+    # run pipeline
+    pp.run()
+    i = 0
+
+    while pp.is_run():
+        time.sleep(0.1)
+        i += 1
+        assert i < 1000, "Timeout"
+
+    # check result
+    assert isinstance(pp._executor, ProcessExecutor)
+    assert len(foreach._output._list) == 8
+    for i, item in enumerate(foreach._output._list):
+        assert item.y1 == 2 * i + 1
+        assert item.y2 == 1.0
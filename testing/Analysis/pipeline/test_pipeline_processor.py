@@ -202,3 +202,79 @@ def test_hashes_and_store_restore(request, change_dir_back):
 
     assert flow._restore_id is not None
     assert side._restore_id is not None
+
+
+def wait_for_end(pp):
+    i = 0
+    while pp.is_run():
+        time.sleep(0.1)
+        i += 1
+        assert i < 100, "Timeout"
+
+
+def test_worker_error(request, change_dir_back):
+    def clear_backup():
+        shutil.rmtree("backup", ignore_errors=True)
+    request.addfinalizer(clear_backup)
+
+    os.chdir(this_source_dir)
+
+    # exception in action processing ends the run with error, pipeline does not hang
+    action.__action_counter__ = 0
+    gen = VariableGenerator(Variable=Struct(x1=Float(0.0)))
+    fun = FunctionAction(Inputs=[gen], Params=["x1"], Expressions=["y1 = 1 / x1"])
+    pp = Pipelineprocessor(Pipeline(ResultActions=[fun]))
+    assert len(pp.validate()) == 0
+    pp.run()
+    wait_for_end(pp)
+
+    assert not pp._is_finished
+    assert len(pp._run_errs) == 1
+    assert pp._run_errs[0].startswith("Action {0} processing fails".format(fun._get_instance_name()))
+
+
+def run_single_job(request):
+    def clear_backup():
+        shutil.rmtree("backup", ignore_errors=True)
+        shutil.rmtree("action_2", ignore_errors=True)
+    request.addfinalizer(clear_backup)
+
+    os.chdir(this_source_dir)
+
+    action.__action_counter__ = 0
+    vg = VariableGenerator(Variable=Struct(a=String("test"), b=Int(3)))
+    flow = Flow123dAction(Inputs=[vg], YAMLFile="resources/test2.yaml")
+    pp = Pipelineprocessor(Pipeline(ResultActions=[flow]))
+    assert len(pp.validate()) == 0
+    pp.run()
+    i = 0
+    runner = pp.get_next_job()
+    while runner is None:
+        time.sleep(0.1)
+        i += 1
+        assert i < 100, "Timeout"
+        runner = pp.get_next_job()
+    return pp, runner
+
+
+def test_stop(request, change_dir_back):
+    pp, runner = run_single_job(request)
+    pp.stop()
+    wait_for_end(pp)
+    assert not pp._is_finished
+    assert len(pp._run_errs) == 0
+
+
+def test_pause(request, change_dir_back):
+    pp, runner = run_single_job(request)
+    pp.pause(True)
+    pp.set_job_finished(runner.id)
+    # finished job is not processed during pause
+    time.sleep(0.5)
+    assert pp.is_run()
+    assert not pp._is_finished
+
+    pp.pause(False)
+    wait_for_end(pp)
+    assert pp._is_finished
+    assert len(pp._run_errs) == 0
@@ -8,6 +8,7 @@ from Analysis.pipeline.pipeline_processor import *
 import Analysis.pipeline.action_types as action
 from .pomfce import *
 import shutil
+import time
 
 
 this_source_dir = os.path.dirname(os.path.realpath(__file__))
@@ -188,3 +189,173 @@ def test_calibration(request, change_dir_back):
 
     # test residual
     assert cal._output.result.residual.value < 0.01
+
+
+def test_calibration_diff_evolution(request, change_dir_back):
+    def clear_backup():
+        shutil.rmtree("backup", ignore_errors=True)
+    request.addfinalizer(clear_backup)
+
+    os.chdir(this_source_dir)
+
+    action.__action_counter__ = 0
+    gen = VariableGenerator(
+        Variable=Struct(observations=Struct(y1=Float(1.0), y2=Float(5.0))))
+    w = Workflow()
+    f = FunctionAction(
+        Inputs=[w.input()],
+        Params=["x1", "x2"],
+        Expressions=["y1 = 2 * x1 + 2", "y2 = 2 * x2 + 3"])
+    w.set_config(OutputAction=f, InputAction=f)
+    cal = Calibration(
+        Inputs=[gen],
+        WrappedAction=w,
+        Parameters=[CalibrationParameter(name=name, group="pokus", bounds=(-5.0, 5.0), init_value=1.0)
+                    for name in ["x1", "x2"]],
+        Observations=[CalibrationObservation(name=name, group="tunel", weight=1.0)
+                      for name in ["y1", "y2"]],
+        AlgorithmParameters=[CalibrationAlgorithmParameter(group="pokus", diff_inc_rel=0.01, diff_inc_abs=0.0)],
+        TerminationCriteria=CalibrationTerminationCriteria(n_max_steps=10),
+        MinimizationMethod="DIFF",
+        MaxConcurrency=4
+    )
+    p = Pipeline(ResultActions=[cal])
+
+    # record sizes of evaluated batches and number of concurrently processed workflows
+    batches = []
+    model_eval_batch = cal._scipy_model_eval_batch
+
+    def recording_model_eval_batch(xs):
+        batches.append(len(xs))
+        return model_eval_batch(xs)
+    cal._scipy_model_eval_batch = recording_model_eval_batch
+    concurrent = []
+    create_tmp_action = cal._create_tmp_action
+
+    def recording_create_tmp_action(input):
+        concurrent.append(len(cal._tmp_actions) + 1)
+        return create_tmp_action(input)
+    cal._create_tmp_action = recording_create_tmp_action
+
+    pp = Pipelineprocessor(p)
+    err = pp.validate()
+    assert len(err) == 0
+
+    pp.run()
+    i = 0
+    while pp.is_run():
+        time.sleep(0.1)
+        i += 1
+        assert i < 1000, "Timeout"
+
+    # whole population (5 * number of parameters) in one batch
+    assert batches[0] == 10
+    assert max(concurrent) == 4
+    assert cal._output.result.residual.value < cal._scipy_iterations[0][1]
+
+
+def test_calibration_concurrent_jacobian(request, change_dir_back):
+    def clear_backup():
+        shutil.rmtree("backup", ignore_errors=True)
+    request.addfinalizer(clear_backup)
+
+    os.chdir(this_source_dir)
+
+    action.__action_counter__ = 0
+    gen = VariableGenerator(
+        Variable=Struct(observations=Struct(y1=Float(1.0), y2=Float(5.0), y3=Float(-1.0))))
+    w = Workflow()
+    f = FunctionAction(
+        Inputs=[w.input()],
+        Params=["x1", "x2", "x3"],
+        Expressions=["y1 = 2 * x1 + 2", "y2 = 2 * x2 + 3", "y3 = x3 - 2"])
+    w.set_config(OutputAction=f, InputAction=f)
+    cal = Calibration(
+        Inputs=[gen],
+        WrappedAction=w,
+        Parameters=[CalibrationParameter(name=name, group="pokus", bounds=(-1e+10, 1e+10), init_value=1.0)
+                    for name in ["x1", "x2", "x3"]],
+        Observations=[CalibrationObservation(name=name, group="tunel", weight=1.0)
+                      for name in ["y1", "y2", "y3"]],
+        AlgorithmParameters=[CalibrationAlgorithmParameter(group="pokus", diff_inc_rel=0.01, diff_inc_abs=0.0)],
+        TerminationCriteria=CalibrationTerminationCriteria(n_max_steps=100),
+        MinimizationMethod="SLSQP",
+        BoundsType=CalibrationBoundsType.hard,
+        MaxConcurrency=2
+    )
+    p = Pipeline(ResultActions=[cal])
+
+    # record number of concurrently processed workflows
+    concurrent = []
+    create_tmp_action = cal._create_tmp_action
+
+    def recording_create_tmp_action(input):
+        concurrent.append(len(cal._tmp_actions) + 1)
+        return create_tmp_action(input)
+    cal._create_tmp_action = recording_create_tmp_action
+
+    pp = Pipelineprocessor(p)
+    err = pp.validate()
+    assert len(err) == 0
+    assert "    MaxConcurrency=2" in cal._get_settings_script()
+
+    pp.run()
+    i = 0
+    while pp.is_run():
+        time.sleep(0.1)
+        i += 1
+        assert i < 1000, "Timeout"
+
+    assert cal._output.result.residual.value < 0.01
+    assert max(concurrent) == 2
+    assert cal._scipy_model_eval_num == len(concurrent)
+
+    # invalid concurrency
+    cal._variables['MaxConcurrency'] = 0
+    err = cal._check_params()
+    assert len(err) == 1 and err[0].endswith("Parameter 'MaxConcurrency' must be positive integer")
+
+
+def test_calibration_surrogate(request, change_dir_back):
+    def clear_backup():
+        shutil.rmtree("backup", ignore_errors=True)
+    request.addfinalizer(clear_backup)
+
+    os.chdir(this_source_dir)
+
+    action.__action_counter__ = 0
+    gen = VariableGenerator(
+        Variable=Struct(observations=Struct(y1=Float(1.0), y2=Float(5.0))))
+    w = Workflow()
+    f = FunctionAction(
+        Inputs=[w.input()],
+        Params=["x1", "x2"],
+        Expressions=["y1 = 2 * x1 + 2", "y2 = 2 * x2 + 3"])
+    w.set_config(OutputAction=f, InputAction=f)
+    cal = Calibration(
+        Inputs=[gen],
+        WrappedAction=w,
+        Parameters=[CalibrationParameter(name=name, group="pokus", bounds=(-10.0, 10.0), init_value=1.0)
+                    for name in ["x1", "x2"]],
+        Observations=[CalibrationObservation(name=name, group="tunel", weight=1.0)
+                      for name in ["y1", "y2"]],
+        AlgorithmParameters=[CalibrationAlgorithmParameter(group="pokus", diff_inc_rel=0.01, diff_inc_abs=0.0)],
+        TerminationCriteria=CalibrationTerminationCriteria(n_max_steps=100),
+        MinimizationMethod="SURROGATE"
+    )
+    pp = Pipelineprocessor(Pipeline(ResultActions=[cal]))
+    err = pp.validate()
+    assert len(err) == 0
+
+    pp.run()
+    i = 0
+    while pp.is_run():
+        time.sleep(0.1)
+        i += 1
+        assert i < 1000, "Timeout"
+
+    result = cal._output.result
+    assert result.residual.value < 0.01
+    assert result.n_real_evaluation.value == cal._scipy_model_eval_num
+    assert result.n_cached_evaluation.value == 0
+    assert result.n_surrogate_evaluation.value > result.n_real_evaluation.value
@@ -0,0 +1,61 @@
+import os
+import numpy as np
+import gm_base.polygons.polygons as polygons
+import gm_base.polygons.polygons_io as polygons_io
+import gm_base.polygons.merge as merge
+import Geometry.decomp_cache as decomp_cache
+
+
+def make_decomp(lines):
+    decomp = polygons.PolygonDecomposition()
+    for a, b in lines:
+        decomp.add_line(a, b)
+    return decomp
+
+
+def subobj_lists(all_maps):
+    # Same structure as Interface.subobj_lists, without sorting of the segments.
+    lists = {}
+    for decomp_id, one_decomp_maps in enumerate(all_maps):
+        subobjs = [{}, {}, {}]
+        for dim, one_dim_map in enumerate(one_decomp_maps):
+            for new_id, orig_id in one_dim_map.items():
+                subobjs[dim].setdefault(orig_id, []).append(new_id)
+        lists[decomp_id] = subobjs
+    return lists
+
+
+def test_decomp_cache(tmpdir):
+    square = [((0, 0), (2, 0)), ((2, 0), (2, 2)), ((2, 2), (0, 2)), ((0, 2), (0, 0))]
+    decomps = [make_decomp(square), make_decomp(square + [((1, -1), (1, 3))])]
+    hashes = [decomp_cache.decomposition_hash(*polygons_io.serialize(d)) for d in decomps]
+    assert hashes[0] != hashes[1]
+    assert hashes[0] == decomp_cache.decomposition_hash(*polygons_io.serialize(decomps[0]))
+    key = decomp_cache.DecompCache.key(hashes)
+    assert key != decomp_cache.DecompCache.key(hashes[::-1])
+
+    cache = decomp_cache.DecompCache(str(tmpdir.join("cache")))
+    assert cache.load(key) is None
+    common_decomp, all_maps = merge.intersect_decompositions(decomps)
+    lists = subobj_lists(all_maps)
+    cache.store(key, common_decomp, lists)
+    assert os.listdir(cache.cache_dir) == [key + ".pickle"]
+
+    cached_decomp, cached_lists = cache.load(key)
+    assert (cache.n_hits, cache.n_misses) == (1, 1)
+    assert cache.report() == "Decomposition cache: 1 hits, 1 misses"
+    for dim in range(3):
+        assert len(cached_decomp.decomp.shapes[dim]) == len(common_decomp.decomp.shapes[dim])
+    for decomp_id, subobjs in lists.items():
+        # Points and segments of the maps have same coordinates.
+        for orig_id, new_ids in subobjs[0].items():
+            cached_ids = cached_lists[decomp_id][0][orig_id]
+            for new_id, cached_id in zip(new_ids, cached_ids):
+                assert np.allclose(common_decomp.points[new_id].xy, cached_decomp.points[cached_id].xy)
+        for orig_id, new_ids in subobjs[1].items():
+            cached_ids = cached_lists[decomp_id][1][orig_id]
+            for new_id, cached_id in zip(new_ids, cached_ids):
+                a = [tuple(pt.xy) for pt in common_decomp.segments[new_id].vtxs]
+                b = [tuple(pt.xy) for pt in cached_decomp.segments[cached_id].vtxs]
+                assert a == b
+        assert {k: len(v) for k, v in subobjs[2].items()} == {k: len(v) for k, v in cached_lists[decomp_id][2].items()}
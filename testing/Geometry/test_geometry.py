@@ -4,6 +4,7 @@ import filecmp
 from shutil import copyfile
 import sys
 import os.path
+import types
 
 this_source_dir = os.path.dirname(os.path.realpath(__file__))
 
@@ -54,3 +55,82 @@ def test_run_geometry(in_file, mesh_step):
     msh_file = filename_base + '.msh'
     assert check_files(geom_file, msh_file)
 
+
+
+@pytest.mark.parametrize("in_file", [
+       '04_flat_fracture.json',
+       '05_split_square.json'
+       ])
+def test_parallel_brep(in_file, tmpdir):
+    # Interface shapes made with a process pool give the same BREP as the serial path.
+    full_in_file = os.path.join(this_source_dir, 'test_data', in_file)
+    brep = {}
+    for n_jobs in [1, 2]:
+        scratch_dir = str(tmpdir.mkdir("jobs_{}".format(n_jobs)))
+        lg = geometry.construct_geometry(layers_file=full_in_file, n_jobs=n_jobs, scratch_dir=scratch_dir)
+        with open(lg.brep_file) as f:
+            brep[n_jobs] = f.read()
+    assert brep[2] == brep[1]
+
+
+class GmshStub:
+    """
+    Minimal stand-in of the gmsh Python module: a mesh of two shapes, log lines for every generated dimension.
+    """
+    def __init__(self):
+        self.calls = []
+        self.messages = []
+        ns = types.SimpleNamespace
+        self.option = ns(setNumber=lambda name, value: self.calls.append(("option", name, value)))
+        self.logger = ns(start=lambda: None, stop=lambda: None, get=self._get_log)
+        mesh = ns(setSize=lambda dim_tags, size: self.calls.append(("size", dim_tags, size)),
+                  generate=self._generate,
+                  getNodes=lambda: ([1, 2, 3, 4], [0, 0, 0, 1, 0, 0, 1, 1, 0, 0, 1, 0], []),
+                  getElements=self._get_elements)
+        occ = ns(importShapes=lambda f: self.calls.append(("import", f)), synchronize=lambda: None)
+        self.model = ns(add=lambda name: None, occ=occ, mesh=mesh, getEntities=lambda: [(1, 5), (2, 7)])
+
+    def initialize(self):
+        self.calls.append("initialize")
+
+    def finalize(self):
+        self.calls.append("finalize")
+
+    def _generate(self, dim):
+        self.messages.append("Meshing {}D".format(dim))
+
+    def _get_log(self):
+        messages, self.messages = self.messages, []
+        return messages
+
+    def _get_elements(self, dim, tag):
+        if dim == 1:
+            return [1], [[10, 11]], [[1, 2, 2, 3]]
+        return [2, 3], [[20], []], [[1, 2, 3], []]
+
+
+def test_call_gmsh_api(monkeypatch):
+    stub = GmshStub()
+    monkeypatch.setattr(geometry, "gmsh", stub)
+    lg = types.SimpleNamespace(filename_base="geom", brep_file="geom.brep", min_step=0.1, max_step=1.0,
+                               vtx_char_length=[(1, 0.5)], gmsh_rand_factor=lambda: 1e-14)
+    progress = []
+    log, err = geometry.LayerGeometry._call_gmsh_api(lg, progress.append)
+    assert progress == ["Meshing 1D", "Meshing 2D", "Meshing 3D"]
+    assert log == "\n".join(progress)
+    assert stub.calls[0] == "initialize" and stub.calls[-1] == "finalize"
+    assert ("import", "geom.brep") in stub.calls
+    assert ("size", [(0, 1)], 0.5) in stub.calls
+
+    mesh = lg.gmsh_mesh
+    assert mesh.node_ids.tolist() == [1, 2, 3, 4]
+    assert mesh.node_xyz.tolist() == [[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0]]
+    # element types without elements are skipped
+    assert [block.el_type for block in mesh.element_blocks] == [1, 2]
+    line, triangle = mesh.element_blocks
+    assert line.ids.tolist() == [10, 11]
+    assert line.nodes.tolist() == [[1, 2], [2, 3]]
+    assert line.tags.tolist() == [[0, 5], [0, 5]]
+    assert triangle.ids.tolist() == [20]
+    assert triangle.nodes.tolist() == [[1, 2, 3]]
+    assert triangle.tags.tolist() == [[0, 7]]
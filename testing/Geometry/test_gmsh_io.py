@@ -0,0 +1,156 @@
+import os
+import io
+import gzip
+import shutil
+import numpy as np
+import Geometry.gmsh_io as gmsh_io
+
+
+this_source_dir = os.path.dirname(os.path.realpath(__file__))
+ref_msh = os.path.join(this_source_dir, "test_data", "ref", "05_split_square.msh")
+
+
+def test_read_write_ascii():
+    mesh = gmsh_io.GmshIO(ref_msh)
+    assert len(mesh.nodes) == len(mesh.node_ids)
+    assert len(mesh.elements) == sum(len(block) for block in mesh.element_blocks)
+
+    out = io.StringIO()
+    mesh.write_ascii(out)
+    with open(ref_msh) as f:
+        ref_text = f.read()
+    # PhysicalNames are read.
+    assert out.getvalue() == ref_text
+
+
+def test_binary_round_trip(tmpdir):
+    mesh = gmsh_io.GmshIO(ref_msh)
+    bin_file = str(tmpdir.join("mesh.msh"))
+    mesh.write_binary(bin_file)
+    bin_mesh = gmsh_io.GmshIO(bin_file)
+    assert bin_mesh.physical == mesh.physical
+    assert np.all(bin_mesh.node_ids == mesh.node_ids)
+    assert np.all(bin_mesh.node_xyz == mesh.node_xyz)
+    assert list(bin_mesh.elements.keys()) == list(mesh.elements.keys())
+    for (id_a, (type_a, tags_a, nodes_a)), (id_b, (type_b, tags_b, nodes_b)) \
+            in zip(bin_mesh.elements.items(), mesh.elements.items()):
+        assert (id_a, type_a, list(tags_a), list(nodes_a)) == (id_b, type_b, list(tags_b), list(nodes_b))
+
+
+
+def test_binary_memory_map(tmpdir):
+    mesh = gmsh_io.GmshIO(ref_msh)
+    bin_file = str(tmpdir.join("mesh.msh"))
+    mesh.write_binary(bin_file)
+    bin_mesh = gmsh_io.GmshIO(bin_file)
+    # Arrays are read-only views to the file.
+    assert not bin_mesh.node_xyz.flags.writeable
+    assert not bin_mesh.element_blocks[0].nodes.flags.writeable
+
+    node_id = int(mesh.node_ids[0])
+    bin_mesh.nodes[node_id] = [1.0, 2.0, 3.0]
+    assert bin_mesh.node_xyz.flags.writeable
+    assert list(bin_mesh.nodes[node_id]) == [1.0, 2.0, 3.0]
+    assert list(gmsh_io.GmshIO(bin_file).nodes[node_id]) == list(mesh.nodes[node_id])
+
+
+def test_write_back_memory_map(tmpdir):
+    # Mesh read through the memory map is written back to its own file.
+    mesh = gmsh_io.GmshIO(ref_msh)
+    bin_file = str(tmpdir.join("mesh.msh"))
+    mesh.write_binary(bin_file)
+    bin_mesh = gmsh_io.GmshIO(bin_file)
+    assert not bin_mesh.node_xyz.flags.writeable
+    bin_mesh.write_binary()
+    bin_mesh.write_binary(bin_file)
+    bin_mesh.filename = bin_file
+    bin_mesh.write_ascii()
+    assert os.listdir(str(tmpdir)) == ["mesh.msh"]
+    with open(bin_file) as f, open(ref_msh) as ref_f:
+        assert f.read() == ref_f.read()
+    assert np.all(bin_mesh.node_xyz == mesh.node_xyz)
+    assert list(bin_mesh.elements.keys()) == list(mesh.elements.keys())
+
+
+def test_gzip(tmpdir):
+    mesh = gmsh_io.GmshIO(ref_msh)
+    gz_file = str(tmpdir.join("mesh.msh.gz"))
+    with gmsh_io.open_mesh_file(gz_file, "wt") as f:
+        mesh.write_ascii(f)
+    with gzip.open(gz_file, "rt") as f, open(ref_msh) as ref_f:
+        assert f.read() == ref_f.read()
+    gz_mesh = gmsh_io.GmshIO(gz_file)
+    assert np.all(gz_mesh.node_xyz == mesh.node_xyz)
+    assert list(gz_mesh.elements.keys()) == list(mesh.elements.keys())
+
+    # written back compressed
+    gz_mesh.write_ascii()
+    with gzip.open(gz_file, "rt") as f, open(ref_msh) as ref_f:
+        assert f.read() == ref_f.read()
+
+
+def test_read_version_1():
+    text = ("$NOD\n3\n1 0 0 0\n2 1 0 0\n3 0 1 0.5\n$ENDNOD\n"
+            "$ELM\n3\n1 1 5 1 2 1 2\n2 1 5 1 2 2 3\n3 2 7 2 3 1 2 3\n$ENDELM\n")
+    mesh = gmsh_io.GmshIO()
+    mesh.read(io.BytesIO(text.encode()))
+    assert list(mesh.nodes[3]) == [0, 1, 0.5]
+    assert [(b.el_type, len(b)) for b in mesh.element_blocks] == [(1, 2), (2, 1)]
+    el_type, tags, nodes = mesh.elements[3]
+    assert (el_type, list(tags), list(nodes)) == (2, [7, 2], [1, 2, 3])
+
+
+def test_dict_views():
+    mesh = gmsh_io.GmshIO()
+    mesh.nodes = {1: [0, 0, 0], 2: [1, 0, 0], 3: [0, 1, 0]}
+    mesh.elements = {10: (1, [5, 1], [1, 2]), 11: (1, [5, 1], [2, 3]), 12: (2, [6, 2], [1, 2, 3])}
+    assert len(mesh.element_blocks) == 2
+
+    # Values are views, changes are stored in the arrays.
+    mesh.nodes[2][2] += 1.0
+    assert mesh.node_xyz[1, 2] == 1.0
+    el_type, tags, nodes = mesh.elements[11]
+    tags[0] = 7
+    assert mesh.element_blocks[0].tags[1, 0] == 7
+
+    mesh.nodes[4] = [1, 1, 1]
+    del mesh.nodes[1]
+    assert list(mesh.nodes.keys()) == [2, 3, 4]
+    del mesh.elements[10]
+    mesh.elements[13] = (2, [6, 2], [2, 3, 4])
+    assert list(mesh.elements.keys()) == [11, 12, 13]
+    assert 10 not in mesh.elements
+
+
+def test_modify_elements_stream(tmpdir):
+    def modify_block(block):
+        # Keep elements of the odd shapes, tag them by the shape.
+        keep = block.tags[:, 1] % 2 == 1
+        block = gmsh_io.ElementBlock(block.el_type, block.ids[keep], block.tags[keep], block.nodes[keep])
+        block.tags[:, 0] = block.tags[:, 1]
+        physical["odd"] = (1, 3)
+        return block
+
+    physical = {}
+    out_file = str(tmpdir.join("stream.msh"))
+    result_physical, n_elements = gmsh_io.modify_elements_stream(ref_msh, out_file, modify_block,
+                                                                 physical=physical, chunk_size=7)
+    assert result_physical is physical
+    assert "odd" in physical
+
+    mesh = gmsh_io.GmshIO(ref_msh)
+    mesh.physical["odd"] = (1, 3)
+    mesh.set_element_blocks([modify_block(block) for block in mesh.element_blocks])
+    stream_mesh = gmsh_io.GmshIO(out_file)
+    assert stream_mesh.physical == mesh.physical
+    assert np.all(stream_mesh.node_xyz == mesh.node_xyz)
+    assert n_elements == len(stream_mesh.elements) == len(mesh.elements)
+    assert dict((k, (t, list(a), list(b))) for k, (t, a, b) in stream_mesh.elements.items()) == \
+        dict((k, (t, list(a), list(b))) for k, (t, a, b) in mesh.elements.items())
+
+    # in place
+    in_place_file = str(tmpdir.join("in_place.msh"))
+    shutil.copy(ref_msh, in_place_file)
+    gmsh_io.modify_elements_stream(in_place_file, in_place_file, modify_block, physical=physical, chunk_size=7)
+    assert open(in_place_file).read() == open(out_file).read()
+    assert [name for name in os.listdir(str(tmpdir)) if name.endswith('.tmp')] == []
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+import Geometry.mesh_deform as mesh_deform
+
+
+def test_bih_find_points():
+    np.random.seed(1)
+    corners = np.random.rand(500, 2)
+    boxes = np.concatenate((corners, corners + 0.1 * np.random.rand(500, 2)), axis=1)
+    points = np.random.rand(300, 2)
+    i_pt, i_box = mesh_deform.BIH(boxes, leaf_size=4).find_points(points)
+
+    inside = np.all(boxes[None, :, 0:2] <= points[:, None, :], axis=2) \
+             & np.all(points[:, None, :] <= boxes[None, :, 2:4], axis=2)
+    assert set(zip(i_pt.tolist(), i_box.tolist())) == set(zip(*[a.tolist() for a in np.nonzero(inside)]))
+
+
+def test_node_rows():
+    node_ids = np.array([7, 3, 10, 1])
+    ids = np.array([[1, 10], [3, 3]])
+    assert np.all(mesh_deform.node_rows(node_ids, ids) == [[3, 2], [1, 1]])
+    sorted_nodes = mesh_deform.sort_node_ids(node_ids)
+    assert np.all(mesh_deform.node_rows(node_ids, ids, sorted_nodes) == [[3, 2], [1, 1]])
+    with pytest.raises(KeyError):
+        mesh_deform.node_rows(node_ids, [2], sorted_nodes)
+
+
+def grid_triangles(n, z_func):
+    grid = np.linspace(0, 1, n + 1)
+    x, y = np.meshgrid(grid, grid)
+    pts = np.stack((x, y, z_func(x, y)), axis=-1)
+    triangles = []
+    for i in range(n):
+        for j in range(n):
+            triangles.append([pts[i, j], pts[i, j + 1], pts[i + 1, j + 1]])
+            triangles.append([pts[i, j], pts[i + 1, j + 1], pts[i + 1, j]])
+    return np.array(triangles)
+
+
+def test_discrete_surface():
+    surface = mesh_deform.DiscreteSurface(grid_triangles(10, lambda x, y: x + 2 * y))
+    xy = np.array([[0.5, 0.5], [0.0, 0.0], [1.0, 0.33], [0.123, 0.877], [1.5, 0.5]])
+    z = surface.eval_z(xy)
+    assert np.allclose(z[:4], xy[:4, 0] + 2 * xy[:4, 1])
+    assert np.isnan(z[4])
+
+
+def test_deform_z():
+    # Two layers between flat interfaces at Z = 2, 1, 0, nodes on three levels, one fracture element.
+    xy = np.array([[0, 0], [1, 0], [0, 1], [1, 1]], dtype=float)
+    node_xyz = np.concatenate([np.concatenate((xy, np.full((4, 1), z)), axis=1) for z in (2.0, 1.5, 1.0, 0.0)])
+    free_node = [[5, 5, 5]]
+    node_xyz = np.concatenate((node_xyz, free_node))
+    ifaces = [2.0, 1.0, 0.0]
+    targets = [lambda xy: 3 + xy[:, 0], lambda xy: 1 + xy[:, 1], lambda xy: np.full(len(xy), -1.0)]
+    ref_z = [lambda xy, z=z: np.full(len(xy), z) for z in ifaces]
+    # upper layer: nodes 0..11, lower layer: nodes 8..15, fracture on the middle interface: 8..11
+    rows = [np.arange(0, 12), np.arange(8, 16), np.arange(8, 12)]
+    top = [np.full(12, 0), np.full(8, 1), np.full(4, 1)]
+    bot = [np.full(12, 1), np.full(8, 2), np.full(4, 1)]
+    z = mesh_deform.deform_z(node_xyz, np.concatenate(rows), np.concatenate(top), np.concatenate(bot),
+                             ref_z, targets)
+
+    x, y = node_xyz[:, 0], node_xyz[:, 1]
+    assert np.allclose(z[0:4], 3 + x[0:4])
+    assert np.allclose(z[4:8], 0.5 * (3 + x[4:8]) + 0.5 * (1 + y[4:8]))
+    assert np.allclose(z[8:12], 1 + y[8:12])
+    assert np.allclose(z[12:16], -1)
+    assert z[16] == 5
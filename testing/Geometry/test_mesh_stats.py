@@ -0,0 +1,64 @@
+import os
+import json
+import numpy as np
+import Geometry.gmsh_io as gmsh_io
+import Geometry.mesh_stats as mesh_stats
+
+
+this_source_dir = os.path.dirname(os.path.realpath(__file__))
+ref_msh = os.path.join(this_source_dir, "test_data", "ref", "05_split_square.msh")
+
+
+def test_simplex_measures():
+    tri = np.array([[[0, 0, 0], [1, 0, 0], [0.5, np.sqrt(3) / 2, 0]],
+                    [[0, 0, 0], [2, 0, 0], [0, 1, 0]],
+                    [[0, 0, 0], [1, 0, 0], [2, 0, 0]]])
+    area, edges, aspect = mesh_stats.simplex_measures(tri)
+    assert np.allclose(area, [np.sqrt(3) / 4, 1.0, 0.0])
+    assert np.allclose(np.max(edges, axis=1), [1.0, np.sqrt(5), 2.0])
+    assert np.isclose(aspect[0], 1.0)
+    assert aspect[1] > 1.0
+    assert np.isinf(aspect[2])
+
+    tet = np.array([[[1, 1, 1], [1, -1, -1], [-1, 1, -1], [-1, -1, 1]],
+                    [[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1]]], dtype=float)
+    volume, edges, aspect = mesh_stats.simplex_measures(tet)
+    assert np.allclose(volume, [8 / 3, 1 / 6])
+    assert np.isclose(aspect[0], 1.0)
+    assert aspect[1] > 1.0
+
+
+def test_mesh_statistics(tmpdir):
+    mesh = gmsh_io.GmshIO(ref_msh)
+    stats = mesh_stats.mesh_statistics(mesh)
+    # Small chunks give the same result, up to the summation order.
+    chunk_stats = mesh_stats.mesh_statistics(mesh, chunk_size=7)
+    assert chunk_stats['node_valence'] == stats['node_valence']
+    for name, reg in stats['regions'].items():
+        chunk_reg = chunk_stats['regions'][name]
+        assert chunk_reg['n_elements'] == reg['n_elements']
+        assert np.isclose(chunk_reg['measure'], reg['measure'])
+        assert chunk_reg['aspect_ratio']['counts'] == reg['aspect_ratio']['counts']
+        assert np.isclose(chunk_reg['aspect_ratio']['mean'], reg['aspect_ratio']['mean'])
+
+    assert stats['n_nodes'] == len(mesh.node_ids)
+    assert stats['n_elements'] == len(mesh.elements)
+    assert sum(reg['n_elements'] for reg in stats['regions'].values()) == stats['n_elements']
+    for name, (region_id, dim) in mesh.physical.items():
+        reg = stats['regions'][name]
+        assert reg['id'] == region_id
+        assert reg['dim'] == dim
+        if dim > 0:
+            assert 0 < reg['min_edge'] <= reg['max_edge']
+            assert reg['measure'] > 0
+        if dim > 1:
+            assert sum(reg['aspect_ratio']['counts']) == reg['n_elements']
+            assert 1.0 <= reg['aspect_ratio']['min'] <= reg['aspect_ratio']['max']
+    valence = stats['node_valence']
+    assert sum(valence['counts']) + valence['n_free_nodes'] == stats['n_nodes']
+
+    msh_file = str(tmpdir.join("mesh.msh"))
+    stats_file = mesh_stats.write_statistics(stats, msh_file)
+    assert stats_file == str(tmpdir.join("mesh.stats.json"))
+    with open(stats_file) as f:
+        assert json.load(f) == stats
@@ -0,0 +1,30 @@
+import os
+import json
+import Geometry.profiling as profiling
+
+
+def test_profiler(tmpdir):
+    profiler = profiling.Profiler(cprofile_stage="inner")
+    with profiler.stage("outer"):
+        for i in range(2):
+            with profiler.stage("inner") as record:
+                data = [list(range(10)) for j in range(1000)]
+            assert record['stage'] == "outer/inner"
+    assert [s['stage'] for s in profiler.stages] == ["outer", "outer/inner", "outer/inner"]
+    assert [s['depth'] for s in profiler.stages] == [0, 1, 1]
+    outer = profiler.stages[0]
+    assert outer['wall_time'] >= profiler.stages[1]['wall_time'] + profiler.stages[2]['wall_time']
+    assert profiler.stages[1]["objects_delta"] > 500
+
+    report_file = str(tmpdir.join("profile.json"))
+    profiler.write_report(report_file)
+    with open(report_file) as f:
+        report = json.load(f)
+    assert len(report['stages']) == 3
+    assert report['total_time'] == outer['wall_time']
+    assert os.path.isfile(report['cprofile']["outer/inner"])
+
+
+def test_no_profiler():
+    with profiling.NoProfiler().stage("any") as record:
+        assert record is None
@@ -0,0 +1,45 @@
+import os
+import types
+import numpy as np
+import gm_base.geometry_files.layers_io as layers_io
+import Geometry.rebuild_state as rebuild_state
+
+this_source_dir = os.path.dirname(os.path.realpath(__file__))
+
+
+def test_brep_key():
+    geometry = layers_io.read_geometry(os.path.join(this_source_dir, "test_data", "11_tectonics.json"))
+    key = rebuild_state.brep_key(geometry)
+    assert rebuild_state.brep_key(geometry, flat_mesh=True) != key
+
+    # Region properties not affecting the BREP.
+    geometry.regions[1].mesh_step = 5.0
+    geometry.regions[1].name = "renamed"
+    assert rebuild_state.brep_key(geometry) == key
+
+    # Used objects changed.
+    geometry.regions[2].not_used = not geometry.regions[2].not_used
+    assert rebuild_state.brep_key(geometry) != key
+
+
+def test_state_file(tmpdir):
+    brep_file = str(tmpdir.join("geom.brep"))
+    open(brep_file, "w").close()
+    lg = types.SimpleNamespace(brep_file=brep_file, aabb=[np.zeros(3), np.ones(3)], min_step=0.2, max_step=1.0,
+                               vtx_char_length=[(1, 1.0), (2, 0.5)], n_gmsh_shapes=[2, 1, 0, 0],
+                               free_origins={(1, 1): (0, 1, 0)}, vertex_origins={1: [(0, 1, 0)], 2: [(0, 1, 0)]})
+    state_file = str(tmpdir.join("geom.state.pickle"))
+    assert rebuild_state.RebuildState.load(state_file) is None
+    rebuild_state.RebuildState("key", lg).save(state_file)
+
+    state = rebuild_state.RebuildState.load(state_file)
+    assert state.is_valid("key")
+    assert not state.is_valid("other_key")
+    assert state.mesh_key == rebuild_state.mesh_key(lg)
+    restored = types.SimpleNamespace()
+    state.restore(restored)
+    assert restored.vertex_origins == lg.vertex_origins
+    assert restored.free_origins == lg.free_origins
+
+    lg.vtx_char_length = [(1, 1.0), (2, 0.25)]
+    assert state.mesh_key != rebuild_state.mesh_key(lg)
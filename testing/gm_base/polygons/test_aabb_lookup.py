@@ -11,8 +11,11 @@ def test_make_aabb():
     box = make_aabb(points, margin=0.1)
     assert np.all(box == np.array([-0.1, -4.1, 4.1, 5.1]))
 
-def test_intersect_candidates():
-    al = AABB_Lookup()
+lookup_classes = [AABB_Lookup, AABB_Tree]
+
+@pytest.mark.parametrize("lookup_class", lookup_classes)
+def test_intersect_candidates(lookup_class):
+    al = lookup_class()
     box = make_aabb([[-1,-1],[1,1]], margin = 0.1)
 
     def add_box(*pts):
@@ -32,6 +35,20 @@ def test_intersect_candidates():
     assert candidates.tolist() == [0,1,2,3]
 
 
+@pytest.mark.parametrize("lookup_class", lookup_classes)
+def test_ray_candidates(lookup_class):
+    al = lookup_class()
+    al.add_object(0, make_aabb([[0, 2], [2, 3]]))
+    al.add_object(1, make_aabb([[0, 1], [2, 1]]))
+    al.add_object(2, make_aabb([[3, 0], [4, 5]]))
+    al.add_object(3, make_aabb([[0, -2], [2, -1]]))
+    al.add_object(4, make_aabb([[0, -1], [2, 4]]))
+    assert list(al.ray_candidates(np.array([1, 0]))) == [(4, 0.0), (1, 1.0), (0, 2.0)]
+    al.rm_object(4)
+    assert list(al.ray_candidates(np.array([1, 0]))) == [(1, 1.0), (0, 2.0)]
+    assert list(al.ray_candidates(np.array([5, 0]))) == []
+
+
 def min_distance(point, box_list):
     min_dist = (np.inf, None)
     for i, box in enumerate(box_list):
@@ -40,9 +57,10 @@ def min_distance(point, box_list):
             min_dist = (dist, i)
     return min_dist
 
+@pytest.mark.parametrize("lookup_class", lookup_classes)
 @pytest.mark.parametrize("seed", list(range(40)))
-def test_closest_candidates(seed):
-    al = AABB_Lookup(init_size=10)
+def test_closest_candidates(lookup_class, seed):
+    al = lookup_class(init_size=10)
 
     def add_box(*pts):
         al.add_object(add_box.ibox, make_aabb(pts) )
@@ -69,3 +87,77 @@ def test_closest_candidates(seed):
     min_dist = (min_dist[0], candidates[min_dist[1]])
     assert ref_min_dist == min_dist
 
+
+
+
+def random_boxes(n_boxes, size, margin=0.01):
+    points = np.random.rand(n_boxes, 2)
+    ends = points + size * (np.random.rand(n_boxes, 2) - 0.5)
+    return np.array([make_aabb([a, b], margin=margin) for a, b in zip(points, ends)])
+
+
+@pytest.mark.parametrize("seed", list(range(10)))
+def test_tree_match_linear(seed):
+    np.random.seed(seed)
+    linear = AABB_Lookup()
+    tree = AABB_Tree()
+    boxes = random_boxes(500, 0.2)
+    for i, box in enumerate(boxes):
+        linear.add_object(i, box)
+        tree.add_object(i, box)
+    # remove and replace some boxes
+    for i in np.random.choice(len(boxes), 100, replace=False):
+        linear.rm_object(i)
+        tree.rm_object(i)
+    for i, box in zip(np.random.choice(len(boxes), 50, replace=False), random_boxes(50, 0.2)):
+        linear.add_object(i, box)
+        tree.add_object(i, box)
+    assert tree.height[tree.root] < 20
+
+    for point in np.random.rand(50, 2):
+        assert tree.closest_candidates(point).tolist() == linear.closest_candidates(point).tolist()
+    for box in random_boxes(50, 0.3):
+        assert tree.intersect_candidates(box).tolist() == linear.intersect_candidates(box).tolist()
+    # bulk build
+    bulk_tree = AABB_Tree()
+    ids = list(tree.leafs.keys())
+    bulk_tree.add_objects(ids, [tree.box[tree.leafs[id]] for id in ids])
+    assert bulk_tree.height[bulk_tree.root] <= int(np.ceil(np.log2(len(ids))))
+
+    for point in np.random.rand(50, 2):
+        assert bulk_tree.closest_candidates(point).tolist() == linear.closest_candidates(point).tolist()
+    for box in random_boxes(50, 0.3):
+        assert bulk_tree.intersect_candidates(box).tolist() == linear.intersect_candidates(box).tolist()
+    for point in np.random.rand(50, 2):
+        tree_ray = list(tree.ray_candidates(point))
+        linear_ray = list(linear.ray_candidates(point))
+        assert sorted(tree_ray) == sorted(linear_ray)
+        assert [y for id, y in tree_ray] == sorted(y for id, y in tree_ray)
+
+
+@pytest.mark.slow
+def test_lookup_benchmark():
+    """
+    Insert/query cost vs. number of segments for both implementations.
+    Segments of length about sqrt(1/N) in the unit square, i.e. a fracture network of fixed density.
+    """
+    import time
+    print("\n{:>8} {:>14} {:>14} {:>14}".format("N", "class", "insert [us]", "query [us]"))
+    for n_boxes in [1000, 4000, 16000, 64000]:
+        np.random.seed(0)
+        seg_length = 1 / np.sqrt(n_boxes)
+        boxes = random_boxes(n_boxes, seg_length, margin=0.1 * seg_length)
+        points = np.random.rand(1000, 2)
+        for lookup_class in lookup_classes:
+            al = lookup_class()
+            start = time.perf_counter()
+            for i, box in enumerate(boxes):
+                al.add_object(i, box)
+            insert_time = (time.perf_counter() - start) / n_boxes
+            start = time.perf_counter()
+            for pt, box in zip(points, boxes):
+                al.closest_candidates(pt)
+                al.intersect_candidates(box)
+            query_time = (time.perf_counter() - start) / len(points)
+            print("{:8d} {:>14} {:14.1f} {:14.1f}".format(
+                n_boxes, lookup_class.__name__, insert_time * 1e6, query_time * 1e6))
@@ -1,7 +1,15 @@
+import os
 from gm_base.polygons.polygons import PolygonDecomposition
 import gm_base.polygons.merge as merge
+import gm_base.polygons.polygons_io as polygons_io
+import gm_base.geometry_files.layers_io as layers_io
+import gm_base.geometry_files.format_last as gs
+from gm_base.polygons.decomp import out_vtx, in_vtx
 import numpy as np
 import pytest
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+geometry_test_data = os.path.join(script_dir, "..", "..", "Geometry", "test_data")
 # def test_deep_copy(self):
 #     print("===== test deep_copy")
 #     da = PolygonDecomposition()
@@ -107,4 +115,170 @@ def test_frac_intersections():
     #######
     # Test merge with empty decomp.
     # Test fix for split points under tolerance.
-    copy_decomp, maps = merge.intersect_decompositions([ decomp ])
\ No newline at end of file
+    copy_decomp, maps = merge.intersect_decompositions([ decomp ])
+
+
+def maps_canonical(common_decomp, all_maps, n_digits=6):
+    """
+    Decomposition and maps description independent of object IDs of the common decomposition.
+    Common objects are identified by coordinates, original objects by IDs.
+    """
+    def xy(pt):
+        return tuple(np.round(pt.xy, n_digits))
+
+    def seg_key(seg):
+        return tuple(sorted((xy(seg.vtxs[out_vtx]), xy(seg.vtxs[in_vtx]))))
+
+    def poly_key(poly):
+        if poly.outer_wire.is_root():
+            return ()
+        return tuple(sorted(seg_key(seg) + (xy(seg.vtxs[side]),) for seg, side in poly.outer_wire.segments()))
+
+    obj_keys = [
+        {pt.id: xy(pt) for pt in common_decomp.points.values()},
+        {seg.id: seg_key(seg) for seg in common_decomp.segments.values()},
+        {poly.id: poly_key(poly) for poly in common_decomp.polygons.values()}]
+    result = []
+    for maps in all_maps:
+        result.append([ sorted((keys[new_id], orig_id) for new_id, orig_id in one_dim_map.items())
+                        for keys, one_dim_map in zip(obj_keys, maps)])
+    return [sorted(keys.values()) for keys in obj_keys], result
+
+
+def check_overlay(decomps, merge_tol=1e-10):
+    ref_decomp, ref_maps = merge.intersect_decompositions(decomps, merge_tol=merge_tol)
+    decomp, maps = merge.overlay_decompositions(decomps, merge_tol=merge_tol)
+    assert decomp.decomp.check_consistency()
+    objs, canonical = maps_canonical(decomp, maps)
+    ref_objs, ref_canonical = maps_canonical(ref_decomp, ref_maps)
+    assert objs == ref_objs
+    for one_maps, ref_one_maps in zip(canonical, ref_canonical):
+        assert one_maps[0] == ref_one_maps[0]
+        assert one_maps[1] == ref_one_maps[1]
+        # Pairwise path leaves unmapped some polygons inside holes.
+        assert set(ref_one_maps[2]) <= set(one_maps[2])
+    for one_maps in maps:
+        assert set(one_maps[2].keys()) == set(decomp.polygons.keys())
+
+
+def test_overlay_simple():
+    da = PolygonDecomposition()
+    da.add_line((0, 0), (1, 0))
+    da.add_line((0, 0), (0, 1))
+    da.add_line((1, 1), (1, 0))
+    da.add_line((1, 1), (0, 1))
+    da.add_line((0, 0), (1, 1))
+
+    db = PolygonDecomposition()
+    db.add_line((0, 0), (1, 0))
+    db.add_line((0, 0), (0, 1))
+    db.add_line((1, 1), (1, 0))
+    db.add_line((1, 1), (0, 1))
+    db.add_line((1, 0), (0, 1))
+
+    # hole, free point
+    dc = PolygonDecomposition()
+    dc.add_line((0.6, 0.2), (0.8, 0.2))
+    dc.add_line((0.8, 0.2), (0.8, 0.4))
+    dc.add_line((0.8, 0.4), (0.6, 0.2))
+    dc.add_point((0.1, 0.5))
+    check_overlay([da, db, dc])
+    check_overlay([dc, da])
+    check_overlay([da])
+
+
+def test_overlay_near_coincident():
+    da = PolygonDecomposition()
+    da.add_line((0, 0), (1, 0))
+    da.add_line((1, 0), (1, 1))
+    da.add_line((1, 1), (0, 1))
+    da.add_line((0, 1), (0, 0))
+    da.add_line((0.5, 0), (0.5, 1))
+
+    # points and segments closer then the decomposition tolerance to the objects of da
+    db = PolygonDecomposition()
+    db.add_line((0.003, 0.002), (1.002, 0.004))
+    db.add_line((0.2, -1), (0.2, 2))
+
+    dc = PolygonDecomposition()
+    dc.add_line((0.505, 0.3), (0.9, 0.3))
+    dc.add_point((0.7, 0.996))
+
+    for merge_tol in [1e-10, da.tolerance]:
+        check_overlay([da, db, dc], merge_tol)
+        check_overlay([dc, db, da], merge_tol)
+    decomp, maps = merge.overlay_decompositions([da, db, dc], merge_tol=da.tolerance)
+    assert len(decomp.points) < len(merge.overlay_decompositions([da, db, dc])[0].points)
+
+
+def test_overlay_fractures():
+    da = PolygonDecomposition()
+    da.add_line((0, 0), (0, 3))
+    da.add_line((0, 3), (2, 3))
+    da.add_line((2, 3), (2, 0))
+    da.add_line((2, 0), (0, 0))
+    decomps = [da]
+    np.random.seed(1)
+    for pa, pb in np.random.rand(30, 2, 2) * [2, 3]:
+        dd = PolygonDecomposition()
+        dd.add_line(pa, pb)
+        decomps.append(dd)
+    check_overlay(decomps)
+
+
+def interface_decompositions(lg):
+    """
+    Decompositions of the interfaces of the layer geometry in the same order as they are
+    added to the interfaces in Geometry.geometry.
+    """
+    interfaces = {}
+    def add(iface_nodeset):
+        interface_id = iface_nodeset.interface_id
+        if isinstance(iface_nodeset, gs.InterpolatedNodeSet):
+            iface_nodeset = iface_nodeset.surf_nodesets[0]
+        nodeset = lg.node_sets[iface_nodeset.nodeset_id]
+        decomps = interfaces.setdefault(interface_id, {})
+        if nodeset.topology_id not in decomps:
+            topology = lg.topologies[nodeset.topology_id]
+            decomps[nodeset.topology_id] = polygons_io.deserialize(nodeset.nodes, topology)
+
+    for layer in lg.layers:
+        add(layer.top)
+        if getattr(layer, 'bottom', None) is not None:
+            add(layer.bottom)
+    return [list(decomps.values()) for decomps in interfaces.values()]
+
+
+@pytest.mark.parametrize("in_file", [
+       '01_flat_top_side_bc.json',
+       '02_bump_top_side_bc.json',
+       '03_flat_real_extension.json',
+       '04_flat_fracture.json',
+       '05_split_square.json',
+       '06_bump_split.json',
+       '10_bump_step.json',
+       '11_tectonics.json'
+       ])
+def test_overlay_geometry_data(in_file):
+    lg = layers_io.read_geometry(os.path.join(geometry_test_data, in_file))
+    for decomps in interface_decompositions(lg):
+        check_overlay(decomps)
+
+
+@pytest.mark.parametrize("in_file", [
+       '01_flat_top_side_bc.json',
+       '03_flat_real_extension.json',
+       '04_flat_fracture.json',
+       '05_split_square.json',
+       '10_bump_step.json',
+       '11_tectonics.json'
+       ])
+def test_overlay_geometry_data_bulk(in_file, monkeypatch):
+    # no snapping at the merge tolerance of Geometry, lines are never added one by one
+    def add_lines_incremental(self, lines):
+        assert False, "incremental construction"
+    monkeypatch.setattr(PolygonDecomposition, "_add_lines_incremental", add_lines_incremental)
+    lg = layers_io.read_geometry(os.path.join(geometry_test_data, in_file))
+    for decomps in interface_decompositions(lg):
+        decomp, maps = merge.overlay_decompositions(decomps)
+        assert decomp.decomp.check_consistency()
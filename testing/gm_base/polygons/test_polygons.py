@@ -6,6 +6,7 @@ import pytest
 
 from gm_base.polygons.polygons import *
 from gm_base.polygons.decomp import PolygonChange
+from gm_base.polygons import line_sweep
 from gm_base.polygons.plot_polygons import plot_polygon_decomposition
 #
 # def plot_polygon(self, polygon):
@@ -126,3 +127,203 @@ def test_check_displacement():
     assert not res
     assert decomp.get_last_polygon_changes() == (PolygonChange.shape, [1,2,3], None)
 
+
+def test_max_displacement_step():
+    decomp = PolygonDecomposition()
+    sg, = decomp.add_line((0, 0), (0, 2))
+    pt0 = sg.vtxs[0]
+    decomp.add_line((0, 0), (2, 0))
+    decomp.add_line((0, 2), (2, 0))
+    pt = decomp.add_point((.5,.5))
+    decomp.add_line((0, 0), (.5,.5))
+    decomp.add_line((2, 0), (.5,.5))
+    decomp.add_line( (.5,.5), (0, 2))
+    # moving point hits static segment
+    assert abs(decomp.max_displacement_step([pt0, pt], (1.0, 1.0)) - 0.5) < 1e-10
+    assert decomp.max_displacement_step([pt0, pt], (0.4, 0.4)) == 1.0
+
+    decomp = PolygonDecomposition()
+    for a, b in [((0, 0), (4, 0)), ((4, 0), (4, 4)), ((4, 4), (0, 4)), ((0, 4), (0, 0))]:
+        decomp.add_line(a, b)
+    free_pt = decomp.add_point((3.5, 2))
+    corner = decomp.add_point((4, 4))
+    # static point hit by segments rotating around their static ends
+    assert abs(decomp.max_displacement_step([corner], (-2, -2)) - 0.4) < 1e-10
+    assert not decomp.check_displacment([corner], (-2, -2))
+    assert decomp.check_displacment([corner], (-0.5, -0.5))
+    # static point hit by translated segment
+    right = [corner, decomp.add_point((4, 0))]
+    assert abs(decomp.max_displacement_step(right, (-1, 0)) - 0.5) < 1e-10
+    assert decomp.check_displacment(right, (1, 0))
+    # moving free point
+    assert abs(decomp.max_displacement_step([free_pt], (1, 0)) - 0.5) < 1e-10
+
+    decomp.move_points(right, (-0.4, 0))
+    assert decomp.find_polygon((3.7, 1)) == decomp.outer_polygon
+    assert len(decomp.segments_lookup.intersect_candidates(np.array([3.59, 1, 3.61, 3]))) > 0
+
+
+
+def decomp_canonical(pd, n_digits=6):
+    """
+    Decomposition description independent of object IDs, used to compare decompositions.
+    """
+    def xy(pt):
+        return tuple(np.round(pt.xy, n_digits))
+
+    def seg_key(seg):
+        return tuple(sorted((xy(seg.vtxs[out_vtx]), xy(seg.vtxs[in_vtx]))))
+
+    def wire_key(wire):
+        if wire.is_root():
+            return ()
+        # segment sides given by the end point of the half segment
+        return tuple(sorted(seg_key(seg) + (xy(seg.vtxs[side]),) for seg, side in wire.segments()))
+
+    points = sorted(xy(pt) for pt in pd.points.values())
+    segments = sorted(seg_key(seg) for seg in pd.segments.values())
+    polygons = sorted((wire_key(poly.outer_wire),
+                       tuple(sorted(wire_key(hole) for hole in poly.outer_wire.childs)),
+                       tuple(sorted(xy(pt) for pt in poly.free_points)))
+                      for poly in pd.polygons.values())
+    return points, segments, polygons
+
+
+def square_lines(x0, y0, x1, y1):
+    return [((x0, y0), (x1, y0)), ((x1, y0), (x1, y1)), ((x1, y1), (x0, y1)), ((x0, y1), (x0, y0))]
+
+
+def random_lines(n_lines, length, seed):
+    np.random.seed(seed)
+    p0 = np.random.rand(n_lines, 2)
+    p1 = p0 + length * (np.random.rand(n_lines, 2) - 0.5)
+    return square_lines(0, 0, 1, 1) + list(zip(p0, p1))
+
+
+@pytest.mark.parametrize("lines", [
+    square_lines(0, 0, 1, 1),
+    # hole, dendrite, free standing segment, free point
+    square_lines(0, 0, 3, 3) + square_lines(1, 1, 2, 2)
+        + [((0.5, 0.5), (0.7, 0.8)), ((10, 10), (11, 11)), ((1.5, 1.5), (1.5, 1.5))],
+    # crossings, T-junction, common end points
+    square_lines(0, 0, 2, 2) + [((0, 0), (2, 2)), ((0, 2), (2, 0)), ((1, 0), (1, 3))],
+    random_lines(50, 1.0, 0),
+    random_lines(300, 0.2, 1),
+    ])
+def test_add_lines(lines):
+    incremental = PolygonDecomposition()
+    incremental.set_tolerance(1e-6)
+    for a, b in lines:
+        incremental.add_line(a, b)
+
+    bulk = PolygonDecomposition()
+    bulk.set_tolerance(1e-6)
+    result = bulk.add_lines(lines)
+    bulk.decomp.check_consistency()
+    assert len(result) == len(lines)
+    assert decomp_canonical(bulk) == decomp_canonical(incremental)
+
+
+def grid_lines(n):
+    # crossings far from the line ends, no snapping at the default tolerance
+    return [((0, i + 0.5), (n, i + 0.5)) for i in range(n)] + [((i + 0.5, 0), (i + 0.5, n)) for i in range(n)]
+
+
+@pytest.mark.parametrize("lines, snapped", [
+    (grid_lines(5), False),
+    (square_lines(0, 0, 1, 1) + [((0.5, 0.005), (0.5, 0.9)), ((0.2, 0.2), (0.2, 0.995))], True),
+    (random_lines(50, 1.0, 0), True),
+    (random_lines(300, 0.2, 1), True),
+    ])
+def test_add_lines_default_tolerance(lines, snapped):
+    assert line_sweep.split_lines(np.array(lines, dtype=float), 0.01)[4] == snapped
+    assert (line_sweep.split_lines(np.array(lines, dtype=float), 0.01, stop_on_snap=True) is None) == snapped
+
+    incremental = PolygonDecomposition()
+    for a, b in lines:
+        incremental.add_line(a, b)
+
+    bulk = PolygonDecomposition()
+    assert bulk.tolerance == 0.01
+    result = bulk.add_lines(lines)
+    bulk.decomp.check_consistency()
+    assert len(result) == len(lines)
+    assert decomp_canonical(bulk) == decomp_canonical(incremental)
+
+    # own snapping of the bulk construction, consistent but possibly with less points
+    bulk = PolygonDecomposition()
+    bulk.add_lines(lines, exact=False)
+    bulk.decomp.check_consistency()
+    assert len(bulk.points) <= len(incremental.points)
+
+
+def test_add_lines_result():
+    pd = PolygonDecomposition()
+    seg_lists = pd.add_lines([((0, 0), (2, 0)), ((1, -1), (1, 1)), ((3, 3), (3, 3))])
+    assert [len(segs) for segs in seg_lists[:2]] == [2, 2]
+    assert seg_lists[2].is_free()
+    assert seg_lists[0][0].vtxs[in_vtx] == seg_lists[1][0].vtxs[in_vtx]
+
+    # not empty decomposition, lines added one by one
+    seg_lists = pd.add_lines([((0, -1), (2, -1))])
+    assert len(seg_lists[0]) == 2
+    assert len(pd.segments) == 6
+
+
+@pytest.mark.parametrize("lines", [
+    # nested squares, hole with a polygon inside, dendrite, vertical segments
+    square_lines(0, 0, 3, 3) + square_lines(1, 1, 2, 2) + square_lines(1.2, 1.2, 1.8, 1.8)
+        + [((0.5, 0.5), (0.7, 0.8)), ((0.5, 2.5), (0.5, 2.8)), ((4, 0), (5, 1))],
+    random_lines(100, 0.5, 2),
+    ])
+def test_find_polygon(lines):
+    pd = PolygonDecomposition()
+    pd.set_tolerance(1e-6)
+    pd.add_lines(lines)
+    np.random.seed(3)
+    points = np.random.rand(200, 2) * 6 - 1
+    # points on vertical lines through vertices
+    vtx_x = [pt.xy[0] for pt in pd.points.values()]
+    points = np.concatenate((points, np.stack((vtx_x, np.random.rand(len(vtx_x)) * 6 - 1), axis=1)))
+    for xy in points:
+        if pd._snap_point(xy)[0] < 2:
+            continue
+        containing = [poly for poly in pd.polygons.values() if poly.contains_point(xy)]
+        assert len(containing) == 1
+        assert pd.find_polygon(xy) == containing[0]
+
+
+def test_find_polygon_moved():
+    pd = PolygonDecomposition()
+    pd.add_lines(square_lines(0, 0, 1, 1))
+    inner_poly = pd.find_polygon((0.5, 0.5))
+    assert inner_poly != pd.outer_polygon
+    assert pd.find_polygon((1.5, 0.5)) == pd.outer_polygon
+    pd.move_points(list(pd.points.values()), np.array([1.0, 0.0]))
+    assert pd.find_polygon((0.5, 0.5)) == pd.outer_polygon
+    assert pd.find_polygon((1.5, 0.5)) == inner_poly
+
+
+def test_shape_arrays():
+    pd = PolygonDecomposition()
+    pd.set_tolerance(1e-6)
+    for a, b in random_lines(50, 0.5, 4):
+        pd.add_line(a, b)
+    for seg in list(pd.segments.values())[:-10:-1]:
+        pd.delete_segment(seg)
+    pd.move_points([pt for pt in pd.points.values() if pt.xy[0] > 0.9], np.array([0.001, 0.0]))
+
+    decomp = pd.decomp
+    for pt in pd.points.values():
+        assert np.all(decomp.points_xy[pt.id] == pt.xy)
+    for seg in pd.segments.values():
+        assert tuple(decomp.segments_vtxs[seg.id]) == seg.point_ids()
+        assert np.allclose(seg.vector, pt_xy_diff(decomp, seg))
+    unused = np.ones(decomp.segments_vtxs.size, dtype=bool)
+    unused[list(pd.segments.keys())] = False
+    assert np.all(decomp.segments_vtxs.data[unused] == -1)
+
+
+def pt_xy_diff(decomp, seg):
+    a, b = decomp.segments_vtxs[seg.id]
+    return decomp.points_xy[b] - decomp.points_xy[a]
@@ -31,4 +31,47 @@ def test_polygons_io():
     for dim in range(3):
         len(decomp.decomp.shapes[dim]) == len(new_decomp.decomp.shapes[dim])
     print(decomp)
-    print(new_decomp)
\ No newline at end of file
+    print(new_decomp)
+
+def polygon_shapes(decomp):
+    """
+    Polygons given by sorted coordinates of their outer wires and holes, indexed by polygon index.
+    """
+    def wire_key(wire):
+        return tuple(sorted(tuple(seg.vtxs[side].xy) for seg, side in wire.segments()))
+    return {poly.index: (wire_key(poly.outer_wire), sorted(wire_key(hole) for hole in poly.outer_wire.childs))
+            for poly in decomp.polygons.values()}
+
+
+def test_deserialize_wires(monkeypatch):
+    monkeypatch.setattr(polygons_io, "debug", True)
+    decomp = polygons.PolygonDecomposition()
+    decomp.add_line((0, 0), (4, 0))
+    decomp.add_line((4, 0), (4, 4))
+    decomp.add_line((4, 4), (0, 4))
+    decomp.add_line((0, 4), (0, 0))
+    # hole with dendrite, isolated segment and free point
+    decomp.add_line((1, 1), (2, 1))
+    decomp.add_line((2, 1), (2, 2))
+    decomp.add_line((2, 2), (1, 1))
+    decomp.add_line((2, 2), (2.5, 3))
+    decomp.add_line((3, 0.5), (3.5, 0.5))
+    decomp.add_point((3, 3))
+
+    nodes, topology = polygons_io.serialize(decomp)
+    new_decomp = polygons_io.deserialize(nodes, topology)
+    assert polygon_shapes(new_decomp) == polygon_shapes(decomp)
+    assert [len(p.free_points) for p in new_decomp.polygons.values()] == [len(p.free_points) for p in decomp.polygons.values()]
+    new_nodes, new_topology = polygons_io.serialize(new_decomp)
+    assert new_nodes == nodes
+    assert [s.node_ids for s in new_topology.segments] == [s.node_ids for s in topology.segments]
+
+    # old format, polygons given only by the outer wires, no outer polygon
+    topology.polygons = topology.polygons[1:]
+    for poly in topology.polygons:
+        poly.holes = []
+        poly.free_points = []
+    old_decomp = polygons_io.deserialize(nodes, topology)
+    old_shapes = polygon_shapes(old_decomp)
+    for index, (outer, holes) in polygon_shapes(decomp).items():
+        assert old_shapes[index][0] == outer